@@ -0,0 +1,153 @@
+"""
+Content-addressed cache for AI function-call results.
+
+analyze_onboarding and initialize_tree depend only on their prompt, so a retried
+onboarding submission (or a second student with the same answers and class list)
+can reuse an earlier result instead of making another model call. Results are
+stored on disk under a SHA-256 of the request parameters that affect the output
+(model, messages, functions, temperature) and evicted least-recently-used once
+the store exceeds its size. Being files, entries are shared by all gunicorn
+workers on the instance.
+
+Configuration (environment variables):
+  - SCIWEB_AI_CACHE_DIR: directory for cache entries (default: <tmp>/sciweb_ai_cache)
+  - SCIWEB_AI_CACHE_MB: size bound in megabytes (default 64, 0 disables the cache)
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_DIR = os.environ.get('SCIWEB_AI_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sciweb_ai_cache'))
+DEFAULT_MAX_BYTES = int(float(os.environ.get('SCIWEB_AI_CACHE_MB', 64)) * 1024 * 1024)
+
+# Request parameters that determine a completion; anything else (timeouts...) is ignored
+KEY_PARAMS = ('model', 'messages', 'functions', 'function_call', 'tools', 'tool_choice', 'temperature', 'max_tokens')
+
+
+def cache_key(params):
+    relevant = {name: params[name] for name in KEY_PARAMS if name in params}
+    encoded = json.dumps(relevant, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class DiskResponseCache:
+    """Size-bounded JSON store, one file per entry, evicted by last access time."""
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index = {}  # key -> (size, last access)
+        if self.enabled:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                self._load_index()
+            except OSError as e:
+                print(f"AI response cache disabled: {str(e)}")
+                self.max_bytes = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_index(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(self.directory, name))
+                self._index[name[:-5]] = (stat.st_size, stat.st_atime)
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+                self._index.pop(key, None)
+            return None
+        now = time.time()
+        with self._lock:
+            self.hits += 1
+            self._index[key] = (self._index.get(key, (0, 0))[0], now)
+        try:
+            # Many filesystems mount noatime, so record the access ourselves
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        encoded = json.dumps(value)
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                f.write(encoded)
+            # Atomic rename so concurrent readers never see a partial entry
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error writing AI response cache entry: {str(e)}")
+            return
+        with self._lock:
+            self._index[key] = (len(encoded), time.time())
+            self._evict()
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def _evict(self):
+        total = sum(size for size, _ in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            del self._index[key]
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._index.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "evictions": self.evictions,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._index),
+                "bytes": sum(size for size, _ in self._index.values()),
+                "maxBytes": self.max_bytes
+            }
+
+
+ai_response_cache = DiskResponseCache()
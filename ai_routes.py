@@ -1,14 +1,23 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, session
 import openai
 import json
 import os
-import tempfile
+import re
+import threading
+import time
+from contextlib import contextmanager
 from werkzeug.utils import secure_filename
 
-import urllib.request
-import urllib.error
-import urllib.parse
 from db_init import db
+from doc_cache import document_cache
+from projections import member_projection
+from concept_map import compact_concept_map, token_headers
+from ai_cache import ai_response_cache, cache_key
+from prompt_assets import prompt_assets
+from http_client import http_client, CircuitOpenError
+from metrics import instrument_method, internal_only
+from gradebook import GradebookStore, class_list, fetch_jupiter_payload, parse_gradebook
+import grade_analytics
 from firebase_admin import firestore
 
 # Load OpenAI API key from api_keys.json
@@ -20,13 +29,120 @@ OPENAI_API_KEY = api_keys.get('OpenAiAPIKey') or os.environ.get('OPENAI_API_KEY'
 client = None
 if OPENAI_API_KEY:
     client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    # Model call times show up in the request metrics as "ai"
+    instrument_method(client.chat.completions, 'create', 'ai')
+    instrument_method(client.audio.transcriptions, 'create', 'ai')
 
 # Add a helper function to check if AI features are available
 def is_ai_available():
     return client is not None
 
+# Client-side timeout of each model call, so a hung call cannot pin a worker thread
+AI_CALL_TIMEOUT = float(os.environ.get('SCIWEB_AI_TIMEOUT', 60))
+
+# Voice model calls run in the request's own gthread thread (gunicorn.conf.py). A thread
+# blocked on the network costs little, and nothing is left queued or billing once a
+# request gives up. SCIWEB_AI_CONCURRENCY bounds how many threads of a worker such calls
+# may hold at once; a request that cannot get a slot within AI_SLOT_WAIT_SECONDS gets a 503.
+AI_CONCURRENCY = int(os.environ.get('SCIWEB_AI_CONCURRENCY', 8))
+AI_SLOT_WAIT_SECONDS = 5
+ai_call_slots = threading.BoundedSemaphore(AI_CONCURRENCY)
+
+
+class AIBusyError(Exception):
+    """Every model call slot of this worker is taken."""
+
+
+@contextmanager
+def ai_call_slot():
+    if not ai_call_slots.acquire(timeout=AI_SLOT_WAIT_SECONDS):
+        raise AIBusyError()
+    try:
+        yield
+    finally:
+        ai_call_slots.release()
+
+def server_timing(stages):
+    """Format {stage: seconds} as a Server-Timing header value (durations in ms)"""
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items())
+
 ai_bp = Blueprint('ai', __name__)
 
+def normalize_input(value):
+    """Collapse whitespace in user-provided strings so trivially different inputs share a cache entry"""
+    if isinstance(value, str):
+        return re.sub(r'\s+', ' ', value).strip()
+    if isinstance(value, list):
+        return [normalize_input(item) for item in value]
+    if isinstance(value, dict):
+        return {key: normalize_input(item) for key, item in value.items()}
+    return value
+
+def cache_bypassed(data):
+    """Skip the response cache with {"noCache": true} or a Cache-Control: no-cache header"""
+    return bool((data or {}).get('noCache')) or 'no-cache' in request.headers.get('Cache-Control', '')
+
+def cached_function_call(bypass=False, **params):
+    """
+    Run a function-calling completion through the AI response cache.
+    Returns (function arguments, cache status) where status is hit, miss or bypass.
+    """
+    key = cache_key(params)
+    if bypass:
+        ai_response_cache.record_bypass()
+    else:
+        cached = ai_response_cache.get(key)
+        if cached is not None:
+            return cached, 'hit'
+    response = client.chat.completions.create(**params)
+    function_args = json.loads(response.choices[0].message.function_call.arguments)
+    # A bypass still refreshes the entry so the next normal request gets the new result
+    ai_response_cache.set(key, function_args)
+    return function_args, 'bypass' if bypass else 'miss'
+
+@ai_bp.route('/prompt_assets', methods=['GET'])
+@internal_only
+def get_prompt_assets():
+    """Hash, size and token count of each static prompt asset"""
+    return jsonify({"assets": prompt_assets.describe()})
+
+@ai_bp.route('/cache/stats', methods=['GET'])
+@internal_only
+def get_ai_cache_stats():
+    """Hit rate and size of the AI response cache for this instance"""
+    return jsonify(ai_response_cache.stats())
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def stream_chat_completion(**params):
+    """
+    Relay a chat completion to the browser as Server-Sent Events while it is generated.
+
+    Emits a 'delta' event ({"content": ...}) per chunk, then a 'done' event with the
+    assembled message ({"message": ...}), or an 'error' event if generation fails.
+    """
+    def generate():
+        parts = []
+        try:
+            completion = client.chat.completions.create(stream=True, timeout=AI_CALL_TIMEOUT, **params)
+            for chunk in completion:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield sse_event('delta', {"content": delta})
+            yield sse_event('done', {"message": ''.join(parts)})
+        except Exception as e:
+            print(f"Error streaming chat completion: {str(e)}")
+            yield sse_event('error', {"error": str(e)})
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @ai_bp.route('/challenge', methods=['POST'])
 def challenge_user():
     """
@@ -34,6 +150,8 @@ def challenge_user():
       - chat_history: list of dicts with 'role' ('user' or 'assistant') and 'content' (last 5 messages)
       - concept_map: list of nodes and edges (user's current map/tree structure)
       - subject: string (optional, for context)
+      - stream: bool (optional); if true the reply is streamed as Server-Sent Events
+        ('delta' events, then 'done' with the full message)
     Returns:
       - message: a single AI-generated Socratic, constructivist message (plain text)
     """
@@ -41,10 +159,12 @@ def challenge_user():
     if not is_ai_available():
         return jsonify({"message": "AI features are currently unavailable. Please set up your OpenAI API key."}), 503
         
-    data = request.get_json()
-    chat_history = data.get('chat_history', [])
-    concept_map = data.get('concept_map', [])
+    data = request.get_json(silent=True) or {}
+    chat_history = data.get('chat_history') or []
+    concept_map = data.get('concept_map') or []
     subject = data.get('subject', '')
+    if not isinstance(chat_history, list) or not isinstance(concept_map, (list, dict)):
+        return jsonify({"error": "chat_history must be an array and concept_map an array or object"}), 400
 
     # Compose system prompt
     # system_prompt = (
@@ -62,15 +182,34 @@ def challenge_user():
         "Try not to give too much direct information, in order to make it feel more like a conversation."
     )
 
+    recent_messages = [
+        msg for msg in chat_history[-5:]
+        if isinstance(msg, dict) and msg.get('role') in ('user', 'assistant') and msg.get('content')
+    ]
+    # Keep the parts of the map most relevant to the conversation, within the token budget
+    map_text, map_stats = compact_concept_map(
+        concept_map, ' '.join(str(msg['content']) for msg in recent_messages)
+    )
+    print(f"challenge_user: concept map tokens {map_stats['tokens_before']} -> {map_stats['tokens_after']}")
+
     # Build messages for OpenAI
     messages = [
         {"role": "system", "content": system_prompt},
-        {"role": "user", "content": f"The current concept map/tree structure for the subject '{subject}' is: {concept_map}"}
+        {"role": "user", "content": f"The current concept map/tree structure for the subject '{subject}' is:\n{map_text}"}
     ]
     # Add the last 5 chat messages (in order)
-    for msg in chat_history[-5:]:
-        if msg.get('role') in ('user', 'assistant') and msg.get('content'):
-            messages.append({"role": msg['role'], "content": msg['content']})
+    for msg in recent_messages:
+        messages.append({"role": msg['role'], "content": msg['content']})
+
+    if data.get('stream'):
+        response = stream_chat_completion(
+            model="gpt-4.1-mini",
+            messages=messages,
+            max_tokens=300,
+            temperature=0.7
+        )
+        response.headers.update(token_headers(map_stats))
+        return response
 
     try:
         response = client.chat.completions.create(
@@ -80,7 +219,7 @@ def challenge_user():
             temperature=0.7
         )
         ai_content = response.choices[0].message.content
-        return jsonify({"message": ai_content})
+        return jsonify({"message": ai_content}), 200, token_headers(map_stats)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -100,6 +239,8 @@ def voice_to_nodes():
     if not is_ai_available():
         return jsonify({"error": "AI features are currently unavailable. Please set up your OpenAI API key."}), 503
         
+    timings = {}
+    request_start = time.perf_counter()
     try:
         # Check if audio file is present
         if 'audio' not in request.files:
@@ -114,22 +255,24 @@ def voice_to_nodes():
         if not tree_state_json:
             return jsonify({"error": "No tree state provided"}), 400
         
-        tree_state = json.loads(tree_state_json)
+        # Keep the audio in memory; Whisper accepts a (filename, bytes, content type) tuple
+        audio_bytes = audio_file.read()
+        audio_upload = (secure_filename(audio_file.filename) or 'recording.webm', audio_bytes,
+                        audio_file.content_type or 'application/octet-stream')
+        # Upload covers receiving and parsing the multipart body up to here
+        timings['upload'] = time.perf_counter() - request_start
         
-        # Save audio file temporarily
-        audio_filename = secure_filename(audio_file.filename)
-        temp_dir = tempfile.mkdtemp()
-        temp_audio_path = os.path.join(temp_dir, audio_filename)
-        audio_file.save(temp_audio_path)
+        tree_state = json.loads(tree_state_json)
         
         # Transcribe audio using OpenAI Whisper
-        with open(temp_audio_path, "rb") as audio_data:
-            transcript_response = client.audio.transcriptions.create(
+        started = time.perf_counter()
+        with ai_call_slot():
+            transcript = client.audio.transcriptions.create(
                 model="whisper-1",
-                file=audio_data
-            )
-        
-        transcript = transcript_response.text
+                file=audio_upload,
+                timeout=AI_CALL_TIMEOUT
+            ).text
+        timings['transcribe'] = time.perf_counter() - started
         
         # Define function for structured output
         functions = [
@@ -206,33 +349,48 @@ def voice_to_nodes():
             "The goal of the concept map is to help the user understand their own thinking and learning. Use the concept map as a lens to understand the user's new thoughts and ideas."
         )
         
+        # Keep the parts of the tree most relevant to what was said, within the token budget
+        tree_text, tree_stats = compact_concept_map(tree_state, transcript, include_layout=True)
+        print(f"voice_to_nodes: tree state tokens {tree_stats['tokens_before']} -> {tree_stats['tokens_after']}")
+        
         # Prepare messages for OpenAI
         messages = [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Here is the current tree state: {json.dumps(tree_state)}"},
+            {"role": "user", "content": f"Here is the current tree state:\n{tree_text}"},
             {"role": "user", "content": (
                 f"I just recorded the following speech: '{transcript}'. "
             )}
         ]
         
         # Call OpenAI API with function calling
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",  # Using GPT-4 for better comprehension
-            messages=messages,
-            functions=functions,
-            function_call={"name": "generate_nodes"},
-            temperature=0.7
-        )
+        started = time.perf_counter()
+        with ai_call_slot():
+            response = client.chat.completions.create(
+                model="gpt-4.1-mini",  # Using GPT-4 for better comprehension
+                messages=messages,
+                functions=functions,
+                function_call={"name": "generate_nodes"},
+                temperature=0.7,
+                timeout=AI_CALL_TIMEOUT
+            )
+        timings['generate'] = time.perf_counter() - started
         
         # Extract function call result
         function_args = json.loads(response.choices[0].message.function_call.arguments)
         
-        # Clean up temporary files
-        os.remove(temp_audio_path)
-        os.rmdir(temp_dir)
-        
-        return jsonify(function_args)
-        
+        timings['total'] = time.perf_counter() - request_start
+        result = jsonify(function_args)
+        result.headers['Server-Timing'] = server_timing(timings)
+        result.headers.update(token_headers(tree_stats))
+        return result
+        
+    except AIBusyError:
+        return jsonify({"error": "Too many voice requests in progress, try again shortly"}), 503, \
+            {'Retry-After': str(AI_SLOT_WAIT_SECONDS)}
+    except openai.APITimeoutError:
+        print("Error in voice_to_nodes: model call timed out")
+        timings['total'] = time.perf_counter() - request_start
+        return jsonify({"error": "AI request timed out"}), 504, {'Server-Timing': server_timing(timings)}
     except Exception as e:
         print(f"Error in voice_to_nodes: {str(e)}")
         return jsonify({"error": str(e)}), 500 
@@ -254,7 +412,7 @@ def analyze_onboarding():
         
     try:
         data = request.get_json()
-        responses = data.get('responses', [])
+        responses = normalize_input(data.get('responses', []))
         print(responses)
         
         if not responses or len(responses) < 6:
@@ -339,7 +497,8 @@ def analyze_onboarding():
             {"role": "user", "content": user_prompt}
         ]
         
-        response = client.chat.completions.create(
+        function_args, cache_status = cached_function_call(
+            bypass=cache_bypassed(data),
             model="gpt-4-1106-preview",
             messages=messages,
             functions=functions,
@@ -347,68 +506,218 @@ def analyze_onboarding():
             temperature=0.7
         )
         
-        # Extract and return the generated cards
-        function_args = json.loads(response.choices[0].message.function_call.arguments)
-        return jsonify(function_args)
+        # Return the generated cards
+        return jsonify(function_args), 200, {'X-AI-Cache': cache_status}
         
     except Exception as e:
         print(f"Error in analyze_onboarding: {str(e)}")
         return jsonify({"error": str(e)}), 500 
 
+# When the Jupiter API is unreachable, serve sample.txt flagged as degraded (set to 0 to return 503 instead)
+JUPITER_SAMPLE_FALLBACK = os.environ.get('SCIWEB_JUPITER_FALLBACK', '1') != '0'
+
+gradebook_store = GradebookStore(db)
+
+# Member types (Members.userType) that may read other users' gradebooks
+GRADEBOOK_STAFF_TYPES = {'teacher', 'admin'}
+
+def gradebook_access_error(user_ids):
+    """None when the session may read these users' gradebooks, otherwise a 401/403 response"""
+    viewer = session.get('user_id')
+    if not viewer:
+        return jsonify({"error": "Not authenticated"}), 401
+    if all(user_id == viewer for user_id in user_ids):
+        return None
+    member = document_cache.get(db, 'Members', viewer, member_projection('public_card'))
+    if member.exists and (member.to_dict() or {}).get('userType') in GRADEBOOK_STAFF_TYPES:
+        return None
+    return jsonify({"error": "Not allowed to view this gradebook"}), 403
+
+def unavailable_response(message, error):
+    headers = {}
+    if isinstance(error, CircuitOpenError):
+        headers['Retry-After'] = str(int(error.retry_after) + 1)
+    return jsonify({"error": message, "details": str(error)}), 503, headers
+
+@ai_bp.route('/upstream/stats', methods=['GET'])
+@internal_only
+def get_upstream_stats():
+    """Circuit breaker state of each outbound host"""
+    return jsonify(http_client.stats())
+
 @ai_bp.route('/fetch_jupiter_data', methods=['POST'])
 def fetch_jupiter_data():
+    """
+    Return the user's classes from Jupiter.
+
+    Expects JSON with osis and password, and optionally userId (to keep a gradebook
+    snapshot; must be the signed-in user) and refresh (to skip a snapshot that is
+    still fresh).
+    """
     data = request.get_json()
     osis = data.get('osis')
     password = data.get('password')
+    user_id = data.get('userId')
     if not osis or not password:
         return jsonify({"error": "Missing credentials"}), 400
-    # Attempt to fetch from remote Jupiter API; fallback to sample.txt if it fails
-    # URL-encode credentials to safely include spaces and special characters
-    params = urllib.parse.urlencode({'osis': osis, 'password': password})
-    cloud_run_url = f'https://jupiterapi-xz43fty7fq-pd.a.run.app/fetchData?{params}'
+    if user_id and session.get('user_id') != user_id:
+        # Only the signed-in user's own snapshot is stored or reused; others get a one-off fetch
+        user_id = None
+
+    if user_id and not data.get('refresh') and gradebook_store.knows(user_id, osis, password):
+        record = gradebook_store.get(user_id)
+        if gradebook_store.is_fresh(record):
+            return jsonify({"classes": class_list(record['snapshot']), "source": "snapshot"})
+
     try:
-        with urllib.request.urlopen(cloud_run_url) as resp:
-            resp_data = resp.read().decode('utf-8')
-        result = json.loads(resp_data)
+        if user_id:
+            snapshot = gradebook_store.refresh(user_id, osis, password)['snapshot']
+        else:
+            snapshot = parse_gradebook(fetch_jupiter_payload(osis, password))
+        return jsonify({"classes": class_list(snapshot)})
     except Exception as e:
-        print(f"fetch_jupiter_data: remote fetch error: {e}, falling back to sample.txt")
-        try:
-            # Load sample response for local development
-            with open('sample.txt') as f:
-                result = json.load(f)
-        except Exception as e2:
-            print(f"fetch_jupiter_data: sample.txt load error: {e2}")
-            return jsonify({"error": "Failed to fetch Jupiter data", "details": str(e2)}), 500
-    nested_str = result.get('data')
-    if not nested_str:
-        return jsonify({"error": "Malformed response from Jupiter API"}), 500
-    nested = json.loads(nested_str)
-    courses = nested.get('courses', [])
-    classes_list = []
-    for c in courses:
-        name = c.get('name')
-        teacher = c.get('teacher')
-        schedule = c.get('schedule', '')
-        period = schedule.split(',')[0] if ',' in schedule else schedule
-        classes_list.append({"name": name, "teacher": teacher, "period": period})
-    return jsonify({"classes": classes_list}) 
+        print(f"fetch_jupiter_data: remote fetch error: {e}")
+        error = e
+
+    # Degraded mode: the user's last snapshot if there is one, otherwise the sample gradebook
+    record = gradebook_store.get(user_id) if user_id else None
+    if record is not None:
+        return jsonify({"classes": class_list(record['snapshot']), "degraded": True, "source": "snapshot",
+                        "reason": str(error)}), 200, {'X-Degraded': 'jupiter-unavailable'}
+    if not JUPITER_SAMPLE_FALLBACK:
+        return unavailable_response("Jupiter is currently unavailable", error)
+    try:
+        # Load sample response for local development
+        with open('sample.txt') as f:
+            snapshot = parse_gradebook(json.load(f))
+    except Exception as e2:
+        print(f"fetch_jupiter_data: sample.txt load error: {e2}")
+        return jsonify({"error": "Failed to fetch Jupiter data", "details": str(e2)}), 500
+    # Sample data, not the user's gradebook: let the client decide whether to keep it
+    return jsonify({"classes": class_list(snapshot), "degraded": True, "source": "sample",
+                    "reason": str(error)}), 200, {'X-Degraded': 'jupiter-unavailable'}
+
+@ai_bp.route('/gradebook/<user_id>', methods=['GET'])
+def get_gradebook(user_id):
+    """The user's latest gradebook snapshot with the changes since the one before it"""
+    try:
+        denied = gradebook_access_error([user_id])
+        if denied:
+            return denied
+        record = gradebook_store.get(user_id)
+        if record is None:
+            return jsonify({"error": "No gradebook snapshot for this user"}), 404
+        return jsonify(record)
+    except Exception as e:
+        print(f"Error in get_gradebook: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@ai_bp.route('/gradebook/<user_id>/changes', methods=['GET'])
+def get_gradebook_changes(user_id):
+    try:
+        denied = gradebook_access_error([user_id])
+        if denied:
+            return denied
+        record = gradebook_store.get(user_id)
+        if record is None:
+            return jsonify({"error": "No gradebook snapshot for this user"}), 404
+        return jsonify({"changes": record['changes'], "changedAt": record.get('changedAt'),
+                        "fetchedAt": record.get('fetchedAt')})
+    except Exception as e:
+        print(f"Error in get_gradebook_changes: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@ai_bp.route('/gradebook/<user_id>/analytics', methods=['GET'])
+def get_gradebook_analytics(user_id):
+    """Computed course grades, category averages and grade trends from the user's snapshot"""
+    try:
+        denied = gradebook_access_error([user_id])
+        if denied:
+            return denied
+        record = gradebook_store.get(user_id)
+        if record is None:
+            return jsonify({"error": "No gradebook snapshot for this user"}), 404
+        result = grade_analytics.analyze([record['snapshot']])[0]
+        result["trend"] = grade_analytics.trend_series(record['snapshot'])
+        result["fetchedAt"] = record.get('fetchedAt')
+        return jsonify(result)
+    except Exception as e:
+        print(f"Error in get_gradebook_analytics: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@ai_bp.route('/gradebook/<user_id>/what_if', methods=['POST'])
+def gradebook_what_if(user_id):
+    """
+    Project grades with hypothetical scores.
+
+    Expects JSON with:
+      - assignments: array of {course, category, score, points}
+    """
+    data = request.get_json() or {}
+    hypothetical = data.get('assignments')
+    if not isinstance(hypothetical, list) or not hypothetical:
+        return jsonify({"error": "assignments must be a non-empty array"}), 400
+    for assignment in hypothetical:
+        if not isinstance(assignment, dict) or not assignment.get('course') or not assignment.get('category') \
+                or not all(isinstance(assignment.get(key), (int, float)) for key in ('score', 'points')):
+            return jsonify({"error": "Each assignment needs course, category, score and points"}), 400
+    try:
+        denied = gradebook_access_error([user_id])
+        if denied:
+            return denied
+        record = gradebook_store.get(user_id)
+        if record is None:
+            return jsonify({"error": "No gradebook snapshot for this user"}), 404
+        return jsonify({"projections": grade_analytics.what_if(record['snapshot'], hypothetical)})
+    except Exception as e:
+        print(f"Error in gradebook_what_if: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@ai_bp.route('/gradebook/analytics', methods=['POST'])
+def get_cohort_analytics():
+    """
+    Course grades for several users at once (e.g. a counselor's students). Reading
+    anyone but yourself needs a staff account (GRADEBOOK_STAFF_TYPES).
+
+    Expects JSON with:
+      - userIds: array of user IDs
+      - trend: optional, include grade trend series
+    """
+    data = request.get_json() or {}
+    user_ids = data.get('userIds')
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({"error": "userIds must be a non-empty array"}), 400
+    try:
+        denied = gradebook_access_error(user_ids)
+        if denied:
+            return denied
+        records = {user_id: gradebook_store.get(user_id) for user_id in user_ids}
+        found = [user_id for user_id in user_ids if records[user_id] is not None]
+        # One pass over every course of every student
+        results = grade_analytics.analyze([records[user_id]['snapshot'] for user_id in found])
+        users = {}
+        for user_id, result in zip(found, results):
+            if data.get('trend'):
+                result["trend"] = grade_analytics.trend_series(records[user_id]['snapshot'])
+            users[user_id] = result
+        missing = [user_id for user_id in user_ids if records[user_id] is None]
+        return jsonify({"users": users, "missing": missing})
+    except Exception as e:
+        print(f"Error in get_cohort_analytics: {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
 @ai_bp.route('/initialize_tree', methods=['POST'])
 def initialize_tree():
     data = request.get_json()
     user_id = data.get('userId')
-    responses = data.get('responses')
-    classes = data.get('classes')
+    responses = normalize_input(data.get('responses'))
+    classes = normalize_input(data.get('classes'))
     if not user_id or not isinstance(responses, list) or classes is None:
         return jsonify({"error": "Missing initialization data"}), 400
-    # Load platform plan for context
-    try:
-        with open('SciWebPlan31.md') as f:
-            plan_content = f.read()
-    except Exception:
-        plan_content = ""
+    # Static context comes first and is identical across requests so the provider can cache the prefix
     system_prompt = (
-        f"Use the platform plan for context:\n{plan_content}\n"
+        f"Use the platform plan for context:\n{prompt_assets.get('platform_plan')}\n"
+        f"{prompt_assets.get('node_types')}\n"
         "Generate initial nodes and edges for a new knowledge web. "
         "Include motivation nodes based on user's responses, "
         "challenge nodes if any obstacles were mentioned, "
@@ -465,16 +774,17 @@ def initialize_tree():
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"User responses: {json.dumps(responses)}"},
-            {"role": "user", "content": f"User classes: {json.dumps(classes)}"}
+            {"role": "user", "content": f"User classes: {json.dumps(classes, sort_keys=True)}"}
         ]
-        response = client.chat.completions.create(
+        # Only the generated tree is cached; every request still saves its own Trees document
+        tree_args, cache_status = cached_function_call(
+            bypass=cache_bypassed(data),
             model="gpt-4.1-mini",
             messages=messages,
             functions=functions,
             function_call={"name": "generate_initial_tree"},
             temperature=0.7
         )
-        tree_args = json.loads(response.choices[0].message.function_call.arguments)
         nodes = tree_args.get("nodes", [])
         edges = tree_args.get("edges", [])
     except Exception as e:
@@ -495,7 +805,7 @@ def initialize_tree():
     except Exception as e:
         print(f"initialize_tree DB error: {e}")
         return jsonify({"error": "Failed to save tree", "details": str(e)}), 500
-    return jsonify({"id": doc_ref.id, "nodes": nodes, "edges": edges}), 201 
+    return jsonify({"id": doc_ref.id, "nodes": nodes, "edges": edges}), 201, {'X-AI-Cache': cache_status}
 
 @ai_bp.route('/get_realtime_token', methods=['POST'])
 def get_realtime_token():
@@ -507,7 +817,6 @@ def get_realtime_token():
         - peer_id: ID for WebRTC connection
     """
     try:
-        import requests
         import logging
 
         # Get the model to use for realtime API
@@ -516,7 +825,7 @@ def get_realtime_token():
         logging.info(f"Requesting OpenAI Realtime token for model: {model}")
         
         # Make request to OpenAI API to get a WebRTC token using the updated endpoint
-        response = requests.post(
+        response = http_client.post(
             "https://api.openai.com/v1/realtime/sessions",
             headers={
                 "Authorization": f"Bearer {OPENAI_API_KEY}",
@@ -553,6 +862,9 @@ def get_realtime_token():
         return jsonify({
             "token": token
         })
+    except CircuitOpenError as e:
+        print(f"Error generating realtime token: {str(e)}")
+        return unavailable_response("Realtime sessions are temporarily unavailable", e)
     except Exception as e:
         print(f"Error generating realtime token: {str(e)}")
         return jsonify({"error": str(e)}), 500
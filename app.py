@@ -1,10 +1,22 @@
 from flask import Flask, render_template, redirect, request, jsonify, session
 from ai_routes import ai_bp
-from firebase_routes import firebase_routes
+from firebase_routes import firebase_routes, member_index
+from db_init import db
+from doc_cache import document_cache
+from projections import member_projection
+import metrics
+import http_caching
+import static_assets
 app = Flask(__name__)
 # Register the AI Blueprint
 app.register_blueprint(ai_bp, url_prefix='/ai')
 app.register_blueprint(firebase_routes, url_prefix='/api')
+# Per-request timing: Server-Timing headers and /metrics
+metrics.init_app(app)
+# Hashed, precompressed assets from build_static.py (when built), then ETags and
+# 304s for pages and fingerprinted URLs for the remaining static files
+static_assets.init_app(app)
+http_caching.init_app(app)
 
 # Set a secret key for session management
 app.secret_key = 'your_secret_key_here'  # This should be a secure random key in production
@@ -60,20 +72,13 @@ def api_login():
         
         # For demo purposes, we'll just check against the Firebase database
         # using a helper function
-        from firebase_admin import firestore
+        # Keyed lookup through the Emails index instead of a query
+        user_doc = member_index.find_member(
+            'email', email, field_paths=member_projection('auth_session').fields + ['password'])
         
-        # Connect to Firestore
-        db = firestore.client()
-        
-        # Query members collection
-        members_ref = db.collection('Members')
-        query = members_ref.where('email', '==', email).limit(1)
-        results = list(query.stream())
-        
-        if not results:
+        if user_doc is None:
             return jsonify({"error": "User not found"}), 404
         
-        user_doc = results[0]
         user_data = user_doc.to_dict()
         
         # In a real app, you'd properly hash and validate the password
@@ -123,25 +128,16 @@ def get_current_user():
     
     # In a real app, you'd fetch this from the database
     try:
-        from firebase_admin import firestore
-        db = firestore.client()
-        user_doc = db.collection('Members').document(user_id).get()
+        user_doc = document_cache.get(db, 'Members', user_id, member_projection('auth_session'))
         
         if not user_doc.exists:
             session.clear()  # Clear invalid session
             return jsonify({"error": "User not found"}), 404
         
-        user_data = user_doc.to_dict()
-        
         # Return non-sensitive user data
-        safe_user_data = {
-            'id': user_id,
-            'email': user_data.get('email'),
-            'first_name': user_data.get('first_name'),
-            'last_name': user_data.get('last_name'),
-            'username': user_data.get('username'),
-            'profilePicUrl': user_data.get('profilePicUrl')
-        }
+        safe_user_data = {'id': user_id}
+        safe_user_data.update({field: None for field in member_projection('auth_session').fields})
+        safe_user_data.update(user_doc.to_dict())
         
         return jsonify({"user": safe_user_data})
     
@@ -0,0 +1,39 @@
+"""
+Index every existing member's email and username in Emails/Usernames. See member_index.py.
+
+Usage:
+    python backfill_member_index.py [--dry-run]
+
+Safe to run while the app is serving and to re-run: only missing entries are
+written. When two members share an email or username (ignoring case), or an
+entry points at another member, nothing is written and the duplicates are
+listed for cleanup. Once it reports no conflicts, set
+SCIWEB_MEMBER_INDEX_BACKFILLED=1 so signups stop checking Members directly.
+"""
+import argparse
+
+from db_init import db, is_firebase_available
+from member_index import MemberIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help="report missing entries and conflicts without writing")
+    args = parser.parse_args()
+
+    if not is_firebase_available():
+        print("Error: no database connection (service_key3.json missing?)")
+        return 1
+    result = MemberIndex(db).backfill(dry_run=args.dry_run)
+    for conflict in result['conflicts']:
+        if conflict.get('error'):
+            print(f"Conflict: {conflict['error']}")
+        else:
+            print(f"Conflict: {conflict['field']} {conflict['value']!r} is used by {', '.join(map(str, conflict['userIds']))}")
+    print(f"{result['members']} members, {result['missing']} missing entries, "
+          f"{result['indexed']} indexed, {len(result['conflicts'])} conflicts")
+    return 1 if result['conflicts'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,364 @@
+"""
+Offline load test for the Flask app.
+
+Boots `app` from app.py against the local in-process storage backend
+(SCIWEB_STORAGE=local) with a stand-in OpenAI client, seeds users, friends,
+classes, channel messages and trees, then drives a weighted mix of requests
+(tree autosaves, tree loads, profile reads, friend lists, channel polls, AI
+calls, page renders) from concurrent workers through Flask's test client.
+
+Reports requests, errors, throughput and p50/p95/p99 latency per endpoint and
+saves them as JSON, so runs on different commits can be compared:
+
+    python benchmark.py --workers 8 --requests 5000 --output before.json
+    python benchmark.py --workers 8 --requests 5000 --output after.json --compare before.json
+
+No network access or credentials are used. Latencies measure the app's own work
+(routing, serialization, caching, storage logic); --ai-latency adds a fixed
+delay to each stand-in model call.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+# Must be set before app.py (and db_init) is imported
+os.environ['SCIWEB_STORAGE'] = 'local'
+os.environ.setdefault('SCIWEB_AI_CACHE_DIR', tempfile.mkdtemp(prefix='sciweb_bench_cache_'))
+
+# Share of each scenario in the request mix
+DEFAULT_MIX = {
+    'tree_ops': 25,
+    'tree_put': 5,
+    'tree_get': 10,
+    'profile': 15,
+    'friends': 15,
+    'user_classes': 5,
+    'class_page': 5,
+    'messages_poll': 15,
+    'ai_challenge': 3,
+    'ai_onboarding': 2,
+    'page': 5,
+}
+
+
+# --- Stand-in OpenAI client ---
+
+def sample_from_schema(schema):
+    """Smallest value that satisfies a function-calling JSON schema"""
+    kind = schema.get('type')
+    if kind == 'object':
+        return {name: sample_from_schema(prop) for name, prop in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [sample_from_schema(schema.get('items', {})) for _ in range(3)]
+    if kind in ('number', 'integer'):
+        return 1
+    if kind == 'boolean':
+        return True
+    return schema.get('enum', ['benchmark'])[0]
+
+
+class FakeCompletions:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, stream=False, **params):
+        time.sleep(self.latency)
+        if stream:
+            return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word))])
+                         for word in ('What ', 'do ', 'you ', 'think?')])
+        function_call = None
+        if params.get('functions'):
+            arguments = json.dumps(sample_from_schema(params['functions'][0]['parameters']))
+            function_call = SimpleNamespace(name=params['functions'][0]['name'], arguments=arguments)
+        message = SimpleNamespace(content='What do you think connects these ideas?', function_call=function_call)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeOpenAI:
+    def __init__(self, latency=0.0):
+        self.chat = SimpleNamespace(completions=FakeCompletions(latency))
+
+
+# --- Seed data ---
+
+def make_tree(rng, user_id, nodes=40):
+    node_list = [{'id': f'n{i}', 'type': rng.choice(['goal', 'class', 'skill', 'task']), 'title': f'Node {i}',
+                  'position': {'x': rng.randint(0, 2000), 'y': rng.randint(0, 2000)}} for i in range(nodes)]
+    edges = [{'from': f'n{rng.randrange(i)}', 'to': f'n{i}'} for i in range(1, nodes)]
+    return {'userId': user_id, 'nodes': node_list, 'edges': edges, 'version': 1}
+
+
+def seed(db, rng, users, classes, messages_per_channel):
+    now = datetime.now(timezone.utc)
+    user_ids = [f'user{i}' for i in range(users)]
+    class_ids = [f'class{i}' for i in range(classes)]
+    for index, user_id in enumerate(user_ids):
+        db.collection('Members').document(user_id).set({
+            'first_name': f'First{index}', 'last_name': f'Last{index}', 'username': f'user{index}',
+            'email': f'user{index}@example.com', 'password': 'benchmark', 'grade': '10', 'bio': 'Benchmark user',
+            'friends': rng.sample([u for u in user_ids if u != user_id], min(20, users - 1)),
+            'settings': {'privacy': {'profileVisibility': 'friends'}},
+            'classes': [{'id': class_id, 'name': class_id.title(), 'period': str(p)}
+                        for p, class_id in enumerate(rng.sample(class_ids, min(6, classes)))],
+        })
+        db.collection('Trees').document(user_id).set(make_tree(rng, user_id))
+    channels = {}
+    for class_id in class_ids:
+        channel_ids = [f'{class_id}-general', f'{class_id}-help']
+        channels[class_id] = channel_ids
+        db.collection('Classes').document(class_id).set({
+            'name': class_id.title(), 'teacherName': 'Teacher',
+            'members': [{'userId': user_id, 'role': 'student', 'status': 'active'} for user_id in rng.sample(user_ids, min(25, users))],
+            'channels': [{'id': channel_id, 'name': channel_id.split('-')[1]} for channel_id in channel_ids],
+            'units': [{'id': f'{class_id}-unit{u}', 'title': f'Unit {u}', 'position': u} for u in range(5)],
+        })
+        for channel_id in channel_ids:
+            for m in range(messages_per_channel):
+                db.collection('Messages').document(f'{channel_id}-m{m}').set({
+                    'classId': class_id, 'channelId': channel_id, 'senderId': rng.choice(user_ids),
+                    'content': f'Message {m}', 'sentAt': now - timedelta(minutes=messages_per_channel - m),
+                })
+    return {'users': user_ids, 'classes': class_ids, 'channels': channels}
+
+
+# --- Scenarios: each returns (endpoint label, response) ---
+
+class Scenarios:
+    def __init__(self, data, rng):
+        self.data = data
+        self.rng = rng
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def user(self):
+        return self.rng.choice(self.data['users'])
+
+    def tree_ops(self, client):
+        user_id = self.user()
+        with self.lock:
+            base = self.versions.get(user_id, 1)
+        ops = [{'op': 'moveNode', 'id': f'n{self.rng.randrange(40)}',
+                'position': {'x': self.rng.randint(0, 2000), 'y': self.rng.randint(0, 2000)}},
+               {'op': 'retitleNode', 'id': f'n{self.rng.randrange(40)}', 'title': f'Renamed {self.rng.random():.4f}'}]
+        response = client.post(f'/api/Trees/{user_id}/ops', json={'baseVersion': base, 'ops': ops})
+        if response.status_code == 200:
+            with self.lock:
+                self.versions[user_id] = response.get_json().get('version', base)
+        return 'POST /api/Trees/<id>/ops', response
+
+    def tree_put(self, client):
+        user_id = self.user()
+        with self.lock:
+            version = self.versions.get(user_id, 1) + 1
+            self.versions[user_id] = version
+        tree = make_tree(self.rng, user_id)
+        tree.update(version=version, updatedAt=datetime.now(timezone.utc).isoformat())
+        return 'PUT /api/Trees/<id>', client.put(f'/api/Trees/{user_id}', json=tree)
+
+    def tree_get(self, client):
+        return 'GET /api/Trees/<id>', client.get(f'/api/Trees/{self.user()}')
+
+    def profile(self, client):
+        return 'GET /api/Members/<id>', client.get(f'/api/Members/{self.user()}')
+
+    def friends(self, client):
+        return 'GET /api/Members/<id>/friends', client.get(f'/api/Members/{self.user()}/friends')
+
+    def user_classes(self, client):
+        return 'GET /api/Members/<id>/classes', client.get(f'/api/Members/{self.user()}/classes')
+
+    def class_page(self, client):
+        return 'GET /api/Classes/<id>', client.get(f"/api/Classes/{self.rng.choice(self.data['classes'])}")
+
+    def messages_poll(self, client):
+        class_id = self.rng.choice(self.data['classes'])
+        channel_id = self.rng.choice(self.data['channels'][class_id])
+        url = f'/api/Classes/{class_id}/channels/{channel_id}/messages'
+        if self.rng.random() < 0.7:
+            # Follow-up poll for messages newer than the last one seen
+            url += f'?since={channel_id}-m{self.rng.randrange(10)}'
+        return 'GET /api/Classes/<id>/channels/<id>/messages', client.get(url)
+
+    def ai_challenge(self, client):
+        concept_map = [{'id': f'n{i}', 'title': f'Concept {i}', 'type': 'skill'} for i in range(30)]
+        chat = [{'role': 'user', 'content': 'How do enzymes work?'}]
+        return 'POST /ai/challenge', client.post('/ai/challenge', json={
+            'chat_history': chat, 'concept_map': concept_map, 'subject': 'Biology'})
+
+    def ai_onboarding(self, client):
+        # A few distinct answer sets, so the response cache sees both hits and misses
+        variant = self.rng.randrange(20)
+        responses = ['intro', f'Good grades {variant}', 'Curiosity', 'Time management', 'Visual', 'Weekly check-ins']
+        return 'POST /ai/analyze_onboarding', client.post('/ai/analyze_onboarding', json={'responses': responses})
+
+    def page(self, client):
+        path = self.rng.choice(['/', '/tree', '/profile'])
+        return f'GET {path}', client.get(path)
+
+
+# --- Runner ---
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for label, seconds, ok in samples:
+        entry = endpoints.setdefault(label, {'latencies': [], 'errors': 0})
+        entry['latencies'].append(seconds * 1000)
+        entry['errors'] += not ok
+    report = {}
+    for label, entry in sorted(endpoints.items()):
+        latencies = sorted(entry['latencies'])
+        report[label] = {
+            'requests': len(latencies),
+            'errors': entry['errors'],
+            'throughput': round(len(latencies) / elapsed, 2),
+            'meanMs': round(sum(latencies) / len(latencies), 3),
+            'p50Ms': round(percentile(latencies, 0.50), 3),
+            'p95Ms': round(percentile(latencies, 0.95), 3),
+            'p99Ms': round(percentile(latencies, 0.99), 3),
+        }
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(workers=4, requests=2000, duration=None, mix=None, users=50, classes=10, messages=200,
+        ai_latency=0.0, seed_value=1):
+    # app.py reads api_keys.json and sample.txt relative to the working directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+    import ai_routes
+    from db_init import db
+
+    rng = random.Random(seed_value)
+    ai_routes.client = FakeOpenAI(ai_latency)
+    db.reset()
+    data = seed(db, rng, users, classes, messages)
+
+    mix = mix or DEFAULT_MIX
+    scenarios = Scenarios(data, rng)
+    names, weights = zip(*mix.items())
+    samples = []
+    samples_lock = threading.Lock()
+    remaining = [requests]
+    deadline = time.perf_counter() + duration if duration else None
+
+    def worker():
+        client = app_module.app.test_client()
+        local = []
+        while True:
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    break
+            else:
+                with samples_lock:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+            scenario = getattr(scenarios, rng.choices(names, weights)[0])
+            start = time.perf_counter()
+            try:
+                label, response = scenario(client)
+                response.get_data()
+                ok = response.status_code < 500
+            except Exception as e:
+                label, ok = scenario.__name__, False
+                print(f"Error in {scenario.__name__}: {e}")
+            local.append((label, time.perf_counter() - start, ok))
+        with samples_lock:
+            samples.extend(local)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in range(workers):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - start
+
+    endpoints = summarize(samples, elapsed)
+    return {
+        'commit': git_commit(),
+        'ranAt': datetime.now(timezone.utc).isoformat(),
+        'config': {'workers': workers, 'requests': requests, 'duration': duration, 'mix': dict(mix), 'users': users,
+                   'classes': classes, 'messagesPerChannel': messages, 'aiLatency': ai_latency, 'seed': seed_value},
+        'total': {'requests': len(samples), 'errors': sum(not ok for _, _, ok in samples),
+                  'seconds': round(elapsed, 3), 'throughput': round(len(samples) / elapsed, 2)},
+        'endpoints': endpoints,
+    }
+
+
+def print_report(result, baseline=None):
+    base = (baseline or {}).get('endpoints', {})
+    print(f"{'endpoint':<48} {'reqs':>6} {'err':>4} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for label, stats in result['endpoints'].items():
+        line = (f"{label:<48} {stats['requests']:>6} {stats['errors']:>4} {stats['throughput']:>8.1f} "
+                f"{stats['p50Ms']:>8.2f} {stats['p95Ms']:>8.2f} {stats['p99Ms']:>8.2f}")
+        if label in base and base[label]['p95Ms']:
+            change = (stats['p95Ms'] - base[label]['p95Ms']) / base[label]['p95Ms'] * 100
+            line += f"  p95 {change:+.0f}%"
+        print(line)
+    total = result['total']
+    print(f"total: {total['requests']} requests, {total['errors']} errors, "
+          f"{total['throughput']:.1f} req/s over {total['seconds']}s (latencies in ms)")
+
+
+def parse_mix(text):
+    """'tree_ops=50,profile=50' -> {'tree_ops': 50, 'profile': 50}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown scenario '{name}', expected one of {sorted(DEFAULT_MIX)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the SciWeb Flask app")
+    parser.add_argument('--workers', type=int, default=4, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=2000, help="total requests (ignored with --duration)")
+    parser.add_argument('--duration', type=float, help="run for this many seconds instead of a request count")
+    parser.add_argument('--mix', type=parse_mix, help="scenario weights, e.g. tree_ops=50,profile=50")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--classes', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=200, help="seeded messages per channel")
+    parser.add_argument('--ai-latency', type=float, default=0.0, help="seconds added to each model call")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="earlier results JSON to compare p95 latencies against")
+    args = parser.parse_args()
+
+    result = run(args.workers, args.requests, args.duration, args.mix, args.users, args.classes,
+                 args.messages, args.ai_latency, args.seed)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Build step for static/: minify, content-hash and precompress the assets.
+
+Usage:
+    python build_static.py [--no-minify] [--no-brotli]
+
+For every asset under static/ (build/ excepted) this writes
+static/build/<dir>/<name>.<hash><ext>, plus .gz and .br siblings for text assets
+when they come out smaller, and records them in static/build/manifest.json.
+static_assets.py reads the manifest: url_for('static', ...) then points at the
+hashed files, which are served with year-long immutable caching and in the best
+encoding the browser accepts.
+
+JS and CSS are minified when the optional `rjsmin` / `rcssmin` packages are
+installed, and .br files need the optional `Brotli` package; without them the
+build still hashes and gzips everything.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+BUILD_DIR = 'build'
+MANIFEST_NAME = 'manifest.json'
+
+# Files the pages load; docs and notes under static/ are left out
+ASSET_EXTENSIONS = {'.js', '.css', '.svg', '.json', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+                    '.woff', '.woff2', '.mp4'}
+# Worth precompressing (images and video are already compressed)
+COMPRESSIBLE_EXTENSIONS = {'.js', '.css', '.svg', '.json'}
+# Smaller files gain nothing from compression
+MIN_COMPRESS_BYTES = 512
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def minify(data, extension):
+    if extension == '.js' and rjsmin is not None:
+        return rjsmin.jsmin(data.decode('utf-8')).encode('utf-8')
+    if extension == '.css' and rcssmin is not None:
+        return rcssmin.cssmin(data.decode('utf-8')).encode('utf-8')
+    return data
+
+
+def compress(data, use_brotli=True):
+    """{encoding: bytes} for the encodings that make the file smaller"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if use_brotli and brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+def iter_assets(static_dir):
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir):
+            dirs[:] = [d for d in dirs if d != BUILD_DIR]
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in ASSET_EXTENSIONS:
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, static_dir).replace(os.sep, '/'), path
+
+
+def build(static_dir=STATIC_DIR, minify_assets=True, use_brotli=True):
+    build_root = os.path.join(static_dir, BUILD_DIR)
+    # Rebuilt from scratch so files of removed or changed assets do not pile up
+    shutil.rmtree(build_root, ignore_errors=True)
+
+    assets = {}
+    totals = {'sourceBytes': 0, 'bytes': 0, 'gzipBytes': 0, 'brBytes': 0}
+    for name, path in iter_assets(static_dir):
+        with open(path, 'rb') as f:
+            source = f.read()
+        stem, extension = os.path.splitext(name)
+        extension = extension.lower()
+        data = minify(source, extension) if minify_assets else source
+        digest = content_hash(data)
+        built_name = f"{BUILD_DIR}/{stem}.{digest[:12]}{extension}"
+
+        out_path = os.path.join(static_dir, built_name)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, 'wb') as f:
+            f.write(data)
+        encodings = {}
+        if extension in COMPRESSIBLE_EXTENSIONS and len(data) >= MIN_COMPRESS_BYTES:
+            for encoding, body in compress(data, use_brotli).items():
+                with open(out_path + ('.br' if encoding == 'br' else '.gz'), 'wb') as f:
+                    f.write(body)
+                encodings[encoding] = len(body)
+
+        assets[name] = {
+            'file': built_name,
+            'hash': digest,
+            'sourceHash': content_hash(source),
+            'sourceBytes': len(source),
+            'bytes': len(data),
+            'encodings': encodings,
+        }
+        totals['sourceBytes'] += len(source)
+        totals['bytes'] += len(data)
+        totals['gzipBytes'] += encodings.get('gzip', len(data))
+        totals['brBytes'] += encodings.get('br', encodings.get('gzip', len(data)))
+
+    manifest = {'builtAt': datetime.now(timezone.utc).isoformat(), 'assets': assets, 'totals': totals}
+    with open(os.path.join(build_root, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minify, hash and precompress static assets")
+    parser.add_argument('--no-minify', action='store_true', help="copy JS/CSS as they are")
+    parser.add_argument('--no-brotli', action='store_true', help="only write gzip variants")
+    args = parser.parse_args()
+
+    if not args.no_minify and (rjsmin is None or rcssmin is None):
+        print("Note: install rjsmin and rcssmin to minify JS/CSS; copying them unminified")
+    if not args.no_brotli and brotli is None:
+        print("Note: install Brotli to write .br files; writing gzip only")
+    manifest = build(minify_assets=not args.no_minify, use_brotli=not args.no_brotli)
+
+    totals = manifest['totals']
+    print(f"Built {len(manifest['assets'])} assets into static/{BUILD_DIR}: "
+          f"{totals['sourceBytes'] / 1024:.0f} KB source, {totals['bytes'] / 1024:.0f} KB built, "
+          f"{totals['gzipBytes'] / 1024:.0f} KB gzip, {totals['brBytes'] / 1024:.0f} KB best encoding")
+
+
+if __name__ == "__main__":
+    main()
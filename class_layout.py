@@ -0,0 +1,159 @@
+"""
+Keyed layout for lists that used to be arrays inside a document.
+
+A user's classes and a class's channels and units were stored as arrays of
+objects in the Members and Classes documents. Changing one entry meant reading
+and rewriting the whole array, and the arrays kept growing toward Firestore's
+1 MiB document limit. They now live in subcollections keyed by the entry's ID:
+
+    Members/<userId>/classes/<classId>
+    Classes/<classId>/channels/<channelId>
+    Classes/<classId>/units/<unitId>
+
+Reads are dual: entries still in the legacy array are merged with the
+subcollection (the subcollection wins on the same key). Writes only touch the
+subcollection, so new and replaced entries need no migration; routes that must
+see or remove legacy entries call ensure_migrated() first, which moves the
+parent's array into the subcollection. migrate_layout.py moves all of them in
+one go.
+
+Subcollection documents carry a sequence number (SEQ_FIELD) so entries keep the
+order they had in the array; it is stripped from what reads return.
+"""
+import time
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+
+# (parent collection, field) -> key of each entry
+LAYOUTS = {
+    ('Members', 'classes'): 'id',
+    ('Classes', 'channels'): 'id',
+    ('Classes', 'units'): 'id',
+}
+
+# Insertion order of an entry: its index for migrated entries, a timestamp for new ones
+SEQ_FIELD = '_seq'
+
+# Firestore's maximum number of writes in one batch
+BATCH_WRITE_LIMIT = 500
+
+
+def _key_field(parent_collection, field):
+    return LAYOUTS[(parent_collection, field)]
+
+
+def item_ref(db, parent_collection, parent_id, field, key):
+    return db.collection(parent_collection).document(parent_id).collection(field).document(key)
+
+
+def next_seq():
+    return time.time_ns()
+
+
+def put_item(db, parent_collection, parent_id, field, data, seq=None, writer=None):
+    """
+    Write one entry by its key, keeping seq (its position) when replacing an entry.
+    With a writer (batch or transaction) the write is queued on it instead.
+    """
+    key = str(data[_key_field(parent_collection, field)])
+    ref = item_ref(db, parent_collection, parent_id, field, key)
+    payload = {**data, SEQ_FIELD: next_seq() if seq is None else seq}
+    if writer is not None:
+        writer.set(ref, payload)
+    else:
+        ref.set(payload)
+
+
+def _strip(data):
+    data.pop(SEQ_FIELD, None)
+    return data
+
+
+def read_items(db, parent_collection, parent_id, field, parent_data=None):
+    """
+    All entries of a list, legacy array first (in its order) then the rest of the
+    subcollection. Pass parent_data when the parent document was already read.
+    """
+    key_field = _key_field(parent_collection, field)
+    if parent_data is None:
+        parent = db.collection(parent_collection).document(parent_id).get(field_paths=[field])
+        parent_data = parent.to_dict() if parent.exists else {}
+    docs = list(db.collection(parent_collection).document(parent_id).collection(field).stream())
+    docs.sort(key=lambda doc: doc.to_dict().get(SEQ_FIELD) or 0)
+    stored = {doc.id: _strip(doc.to_dict()) for doc in docs}
+
+    items = []
+    for entry in parent_data.get(field) or []:
+        key = str(entry.get(key_field)) if isinstance(entry, dict) and entry.get(key_field) else None
+        items.append(stored.pop(key) if key in stored else entry)
+    items.extend(stored.values())
+    return items
+
+
+def migrate_parent(db, parent_collection, parent_id, field, legacy=None):
+    """
+    Move one document's legacy array into its subcollection and drop the array.
+    Returns the number of entries moved. Entries whose key already exists in the
+    subcollection were written after the array and are newer, so they are kept
+    and the array copy is dropped. Safe to re-run.
+    """
+    parent_ref = db.collection(parent_collection).document(parent_id)
+    if legacy is None:
+        parent = parent_ref.get(field_paths=[field])
+        legacy = (parent.to_dict() or {}).get(field) if parent.exists else None
+    if not legacy:
+        return 0
+
+    key_field = _key_field(parent_collection, field)
+    writes = []
+    for index, entry in enumerate(legacy):
+        if not isinstance(entry, dict):
+            continue
+        entry = {**entry, SEQ_FIELD: index}
+        if not entry.get(key_field):
+            # Entries without a key get one, like new entries do
+            entry[key_field] = parent_ref.collection(field).document().id
+        writes.append((parent_ref.collection(field).document(str(entry[key_field])), entry))
+    existing = {doc.id for doc in parent_ref.collection(field).select([]).stream()}
+    writes = [(ref, entry) for ref, entry in writes if ref.id not in existing]
+
+    # The array is only dropped in the last batch, once every entry has been copied
+    moved = 0
+    for start in range(0, len(writes), BATCH_WRITE_LIMIT - 1):
+        chunk = writes[start:start + BATCH_WRITE_LIMIT - 1]
+        batch = db.batch()
+        for ref, entry in chunk:
+            # create() so an entry written since the scan above is never overwritten
+            batch.create(ref, entry)
+        if start + BATCH_WRITE_LIMIT - 1 >= len(writes):
+            batch.update(parent_ref, {field: firestore.DELETE_FIELD})
+        try:
+            batch.commit()
+        except AlreadyExists:
+            # Nothing in this batch was written: scan again and skip the new entry
+            return moved + migrate_parent(db, parent_collection, parent_id, field)
+        moved += len(chunk)
+    if not writes:
+        parent_ref.update({field: firestore.DELETE_FIELD})
+    return moved
+
+
+def ensure_migrated(db, parent_collection, parent_id, field):
+    """
+    Read the parent's legacy array (cheap once it is gone) and migrate it.
+    Returns False if the parent document does not exist.
+    """
+    parent = db.collection(parent_collection).document(parent_id).get(field_paths=[field])
+    if not parent.exists:
+        return False
+    migrate_parent(db, parent_collection, parent_id, field, (parent.to_dict() or {}).get(field))
+    return True
+
+
+def with_items(db, collection, document_id, data):
+    """A document's dict with every keyed list of its collection filled in"""
+    for parent_collection, field in LAYOUTS:
+        if parent_collection == collection:
+            data[field] = read_items(db, collection, document_id, field, data)
+    return data
@@ -0,0 +1,191 @@
+"""
+Compact concept maps before they are sent to a model.
+
+The tree editor and the mindweb page send their whole map (positions, colors,
+styling) with every AI request. `compact_concept_map()` turns either format into
+a short adjacency list that keeps edge labels and a clipped node description:
+
+    n1 idea "Derivative": "Rate of change of a function" -> n2 (used to find), n4
+
+ranks nodes by relevance to the recent conversation or transcript, and keeps
+the most relevant ones that fit in a token budget. Token counts use tiktoken
+when it is installed and a characters/4 estimate otherwise.
+"""
+import json
+import os
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Default token budget for the serialized map
+DEFAULT_TOKEN_BUDGET = int(os.environ.get('SCIWEB_CONCEPT_MAP_TOKENS', 1500))
+# Node descriptions are clipped to this many characters
+DESCRIPTION_CHARS = 80
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# Too common to say anything about relevance
+_STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'can', 'do', 'for', 'from', 'how',
+    'i', 'if', 'in', 'is', 'it', 'my', 'of', 'on', 'or', 'so', 'that', 'the', 'this', 'to',
+    'was', 'what', 'when', 'which', 'why', 'with', 'you', 'your'
+}
+
+_encoding = None
+
+
+def count_tokens(text):
+    global _encoding
+    if tiktoken is not None:
+        try:
+            if _encoding is None:
+                _encoding = tiktoken.get_encoding('o200k_base')
+            return len(_encoding.encode(text))
+        except Exception:
+            pass
+    return (len(text) + 3) // 4
+
+
+def _words(text):
+    return {word for word in _WORD_RE.findall(text.lower()) if word not in _STOPWORDS}
+
+
+def _clip(text, limit):
+    text = " ".join(str(text or "").split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def normalize_map(concept_map):
+    """
+    Accept either a tree state ({"nodes": [...], "edges": [...]}) or a flat list of
+    mindweb node/edge data, and return (nodes, edges) as {id, type, title,
+    description, x, y} dicts and (from, to, label) triples. Malformed entries are
+    skipped and malformed positions ignored.
+    """
+    if isinstance(concept_map, dict):
+        items = [item for key in ('nodes', 'edges') if isinstance(concept_map.get(key), list)
+                 for item in concept_map[key]]
+    else:
+        items = list(concept_map) if isinstance(concept_map, list) else []
+
+    nodes, edges = [], []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        data = item.get('data') if isinstance(item.get('data'), dict) else item
+        source = data.get('from', data.get('source'))
+        target = data.get('to', data.get('target'))
+        if source is not None and target is not None:
+            edges.append((str(source), str(target), _clip(data.get('label'), DESCRIPTION_CHARS)))
+            continue
+        if data.get('id') is None:
+            continue
+        position = item.get('position') or data.get('position')
+        if not isinstance(position, dict):
+            position = {}
+        nodes.append({
+            'id': str(data['id']),
+            'type': str(data.get('type') or ''),
+            'title': str(data.get('title') or data.get('label') or data.get('name') or ''),
+            'description': _clip(data.get('description'), DESCRIPTION_CHARS),
+            'x': position.get('x'),
+            'y': position.get('y'),
+        })
+    return nodes, edges
+
+
+def rank_nodes(nodes, edges, context_text):
+    """Order node ids by relevance: word overlap with the context, then connectivity."""
+    context_words = _words(context_text or '')
+    degree = {node['id']: 0 for node in nodes}
+    neighbors = {node['id']: set() for node in nodes}
+    for source, target, _ in edges:
+        if source in degree and target in degree:
+            degree[source] += 1
+            degree[target] += 1
+            neighbors[source].add(target)
+            neighbors[target].add(source)
+
+    direct = {node['id']: len(_words(node['title']) & context_words) for node in nodes}
+    scores = {}
+    for node in nodes:
+        node_id = node['id']
+        # Mentioned nodes first, then their neighborhood, then hubs of the map
+        neighbor_score = sum(direct[other] for other in neighbors[node_id])
+        scores[node_id] = direct[node_id] * 10 + neighbor_score * 3 + min(degree[node_id], 10)
+    order = {node['id']: index for index, node in enumerate(nodes)}
+    return sorted(scores, key=lambda node_id: (-scores[node_id], order[node_id]))
+
+
+def _node_line(node, kept_edges):
+    line = f"{node['id']} {node['type'] or 'node'} {json.dumps(node['title'], ensure_ascii=False)}"
+    if node['description']:
+        line += f": {json.dumps(node['description'], ensure_ascii=False)}"
+    if kept_edges:
+        line += " -> " + ", ".join(f"{target} ({label})" if label else target for target, label in kept_edges)
+    return line
+
+
+def compact_concept_map(concept_map, context_text='', token_budget=DEFAULT_TOKEN_BUDGET, include_layout=False):
+    """
+    Serialize a concept map compactly within `token_budget` tokens.
+
+    Returns (text, stats) where stats has tokens_before (the raw JSON), tokens_after,
+    nodes_total and nodes_kept. With include_layout, a one-line bounding box of the
+    existing positions is added so the model can place new nodes clear of them.
+    """
+    tokens_before = count_tokens(json.dumps(concept_map, default=str))
+    nodes, edges = normalize_map(concept_map)
+    node_by_id = {node['id']: node for node in nodes}
+
+    header = "Concept map (id type \"title\": \"description\" -> outgoing connections (relationship)):"
+    lines = [header]
+    if include_layout:
+        xs = [node['x'] for node in nodes if isinstance(node['x'], (int, float))]
+        ys = [node['y'] for node in nodes if isinstance(node['y'], (int, float))]
+        if xs and ys:
+            lines.append(f"Existing nodes occupy x {min(xs):.0f}..{max(xs):.0f}, y {min(ys):.0f}..{max(ys):.0f}")
+
+    outgoing = {}
+    for source, target, label in edges:
+        if source in node_by_id and target in node_by_id:
+            outgoing.setdefault(source, []).append((target, label))
+
+    used = count_tokens("\n".join(lines))
+    kept = []
+    for node_id in rank_nodes(nodes, edges, context_text):
+        # Budget each node with all its edges; edges to dropped nodes are removed below
+        cost = count_tokens(_node_line(node_by_id[node_id], outgoing.get(node_id, []))) + 1
+        if used + cost > token_budget:
+            continue
+        kept.append(node_id)
+        used += cost
+
+    kept_set = set(kept)
+    # Present kept nodes in their original order so related nodes stay together
+    for node in nodes:
+        if node['id'] in kept_set:
+            kept_edges = [edge for edge in outgoing.get(node['id'], []) if edge[0] in kept_set]
+            lines.append(_node_line(node, kept_edges))
+    if len(kept) < len(nodes):
+        lines.append(f"({len(nodes) - len(kept)} less relevant nodes omitted)")
+
+    text = "\n".join(lines)
+    stats = {
+        'tokens_before': tokens_before,
+        'tokens_after': count_tokens(text),
+        'nodes_total': len(nodes),
+        'nodes_kept': len(kept),
+    }
+    return text, stats
+
+
+def token_headers(stats):
+    """Response headers reporting the effect of compaction"""
+    return {
+        'X-Concept-Map-Tokens-Before': str(stats['tokens_before']),
+        'X-Concept-Map-Tokens-After': str(stats['tokens_after']),
+        'X-Concept-Map-Nodes': f"{stats['nodes_kept']}/{stats['nodes_total']}",
+    }
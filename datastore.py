@@ -0,0 +1,583 @@
+"""
+Storage backends for SciWeb.
+
+Every route talks to a Firestore-shaped client (collection / document / where /
+stream). `create_client()` returns either the real Firestore client or a
+LocalClient, an in-process stand-in that supports the same operations, so the
+API can be run and benchmarked without a live Firestore project.
+
+Select the backend with the SCIWEB_STORAGE environment variable:
+  - "firestore" (default): the Firestore database configured in db_init.py
+  - "local": an empty in-memory store that lives for the life of the process
+"""
+import copy
+import functools
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core import exceptions as gcp_exceptions
+from google.cloud.firestore_v1 import transactional, transforms
+
+FIRESTORE = 'firestore'
+LOCAL = 'local'
+BACKENDS = (FIRESTORE, LOCAL)
+
+# Field path Firestore uses for the document ID in order_by() and cursors
+DOCUMENT_ID = '__name__'
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _get_field(data, field_path):
+    """Resolve a dotted field path ("settings.privacy.webVisibility") in a dict."""
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+
+def _project(data, field_paths):
+    """Keep only the given (possibly dotted) field paths, like a Firestore field mask."""
+    if field_paths is None:
+        return data
+    projected = {}
+    for field_path in field_paths:
+        value, found = _get_field(data, field_path)
+        if not found:
+            continue
+        parts = field_path.split('.')
+        target = projected
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return projected
+
+
+def _apply_value(current, value):
+    """Resolve Firestore sentinels/transforms against the current field value."""
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in result:
+                result.append(copy.deepcopy(item))
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        if not isinstance(current, list):
+            return []
+        return [item for item in current if item not in value.values]
+    if isinstance(value, transforms.Increment):
+        base = current if isinstance(current, (int, float)) else 0
+        return base + value.value
+    if isinstance(value, transforms.Maximum):
+        return value.value if not isinstance(current, (int, float)) else max(current, value.value)
+    if isinstance(value, transforms.Minimum):
+        return value.value if not isinstance(current, (int, float)) else min(current, value.value)
+    if isinstance(value, dict):
+        return {k: _apply_value(None, v) for k, v in value.items() if v is not transforms.DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def _set_field(data, field_path, value):
+    parts = field_path.split('.')
+    target = data
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    if value is transforms.DELETE_FIELD:
+        target.pop(parts[-1], None)
+    else:
+        target[parts[-1]] = _apply_value(target.get(parts[-1]), value)
+
+
+def _merge_into(target, data, deep=False):
+    """Write top-level keys of `data` into `target`, recursing into maps when merging."""
+    for key, value in data.items():
+        if value is transforms.DELETE_FIELD:
+            target.pop(key, None)
+        elif deep and isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_into(target[key], value, deep=True)
+        else:
+            target[key] = _apply_value(target.get(key), value)
+
+
+def _compare(op, left, right):
+    try:
+        if op == '==':
+            return left == right
+        if op == '!=':
+            return left is not None and left != right
+        if op == '<':
+            return left is not None and left < right
+        if op == '<=':
+            return left is not None and left <= right
+        if op == '>':
+            return left is not None and left > right
+        if op == '>=':
+            return left is not None and left >= right
+        if op == 'in':
+            return left in right
+        if op == 'not-in':
+            return left is not None and left not in right
+        if op == 'array-contains':
+            return isinstance(left, list) and right in left
+        if op == 'array-contains-any':
+            return isinstance(left, list) and any(item in left for item in right)
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported query operator: {op}")
+
+
+def _type_rank(value):
+    # Firestore orders values of different types by type first
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, list):
+        return 8
+    return 9
+
+
+def _compare_values(left, right):
+    left_rank, right_rank = _type_rank(left), _type_rank(right)
+    if left_rank != right_rank:
+        return -1 if left_rank < right_rank else 1
+    try:
+        return (left > right) - (left < right)
+    except TypeError:
+        return 0
+
+
+def _order_value(snapshot, field_path):
+    if field_path == DOCUMENT_ID:
+        return snapshot.id
+    return _get_field(snapshot._data, field_path)[0]
+
+
+class LocalDocumentSnapshot:
+    """Read-only view of a document, mirroring firestore.DocumentSnapshot."""
+
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        return copy.deepcopy(_get_field(self._data, field_path)[0])
+
+
+class LocalDocumentReference:
+    def __init__(self, client, collection_path, document_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = document_id
+
+    @property
+    def path(self):
+        return f"{self._collection_path}/{self.id}"
+
+    def collection(self, name):
+        return LocalCollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._get(self, field_paths)
+
+    def create(self, data):
+        return self._client._create(self, data)
+
+    def set(self, data, merge=False):
+        return self._client._set(self, data, merge=merge)
+
+    def update(self, data):
+        return self._client._update(self, data)
+
+    def delete(self, option=None):
+        return self._client._delete(self, option)
+
+
+class LocalQuery:
+    """Immutable query over a collection; each builder method returns a new query."""
+
+    def __init__(self, client, collection_path, filters=(), orders=(), limit=None,
+                 limit_to_last=False, projection=None, start=None, end=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._limit_to_last = limit_to_last
+        self._projection = projection
+        # Cursors are (values, inclusive) pairs, compared against the query ordering
+        self._start = start
+        self._end = end
+
+    def _copy(self, **overrides):
+        params = {
+            'filters': self._filters,
+            'orders': self._orders,
+            'limit': self._limit,
+            'limit_to_last': self._limit_to_last,
+            'projection': self._projection,
+            'start': self._start,
+            'end': self._end,
+        }
+        params.update(overrides)
+        return LocalQuery(self._client, self._collection_path, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count, limit_to_last=False)
+
+    def limit_to_last(self, count):
+        return self._copy(limit=count, limit_to_last=True)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def _cursor(self, document_fields):
+        """Turn a snapshot or a {field: value} dict into values for each ordering."""
+        values = []
+        for field_path, _ in self._effective_orders():
+            if isinstance(document_fields, LocalDocumentSnapshot):
+                values.append(_order_value(document_fields, field_path))
+            elif field_path == DOCUMENT_ID:
+                # Dict cursors only pin the explicit order fields
+                break
+            else:
+                values.append(_get_field(document_fields, field_path)[0])
+        return values
+
+    def start_at(self, document_fields):
+        return self._copy(start=(self._cursor(document_fields), True))
+
+    def start_after(self, document_fields):
+        return self._copy(start=(self._cursor(document_fields), False))
+
+    def end_before(self, document_fields):
+        return self._copy(end=(self._cursor(document_fields), False))
+
+    def end_at(self, document_fields):
+        return self._copy(end=(self._cursor(document_fields), True))
+
+    def _effective_orders(self):
+        # Firestore always breaks ties (and orders by default) on the document ID
+        orders = list(self._orders)
+        if not any(field_path == DOCUMENT_ID for field_path, _ in orders):
+            direction = orders[-1][1] if orders else 'ASCENDING'
+            orders.append((DOCUMENT_ID, direction))
+        return orders
+
+    def _compare_to_cursor(self, snapshot, cursor_values):
+        for (field_path, direction), cursor_value in zip(self._effective_orders(), cursor_values):
+            result = _compare_values(_order_value(snapshot, field_path), cursor_value)
+            if result:
+                return -result if direction == 'DESCENDING' else result
+        return 0
+
+    def _matches(self, data):
+        for field_path, op, value in self._filters:
+            field_value, _ = _get_field(data, field_path)
+            if not _compare(op, field_value, value):
+                return False
+        return True
+
+    def stream(self, transaction=None):
+        snapshots = [
+            snapshot for snapshot in self._client._list(self._collection_path)
+            if self._matches(snapshot._data)
+        ]
+        orders = self._effective_orders()
+        # Documents missing an order field are excluded, as in Firestore
+        snapshots = [
+            s for s in snapshots
+            if all(field_path == DOCUMENT_ID or _get_field(s._data, field_path)[1] for field_path, _ in orders)
+        ]
+
+        def compare(a, b):
+            for field_path, direction in orders:
+                result = _compare_values(_order_value(a, field_path), _order_value(b, field_path))
+                if result:
+                    return -result if direction == 'DESCENDING' else result
+            return 0
+
+        snapshots.sort(key=functools.cmp_to_key(compare))
+        if self._start is not None:
+            values, inclusive = self._start
+            snapshots = [s for s in snapshots
+                         if self._compare_to_cursor(s, values) > 0 or (inclusive and self._compare_to_cursor(s, values) == 0)]
+        if self._end is not None:
+            values, inclusive = self._end
+            snapshots = [s for s in snapshots
+                         if self._compare_to_cursor(s, values) < 0 or (inclusive and self._compare_to_cursor(s, values) == 0)]
+        if self._limit is not None:
+            snapshots = snapshots[-self._limit:] if self._limit_to_last else snapshots[:self._limit]
+        if self._projection is not None:
+            snapshots = [
+                LocalDocumentSnapshot(s.reference, _project(s._data, self._projection), s.create_time, s.update_time)
+                for s in snapshots
+            ]
+        return iter(snapshots)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+
+class LocalCollectionReference(LocalQuery):
+    def __init__(self, client, collection_path):
+        super().__init__(client, collection_path)
+
+    @property
+    def id(self):
+        return self._collection_path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return LocalDocumentReference(self._client, self._collection_path, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, data, document_id=None):
+        doc_ref = self.document(document_id)
+        write_time = doc_ref.set(data)
+        return write_time, doc_ref
+
+
+class LocalWriteBatch:
+    """Queues writes and applies them atomically on commit(), like firestore.WriteBatch."""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data):
+        self._writes.append((reference._client._create, reference, document_data))
+        return self
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append((lambda ref, data: ref._client._set(ref, data, merge=merge), reference, document_data))
+        return self
+
+    def update(self, reference, field_updates):
+        self._writes.append((reference._client._update, reference, field_updates))
+        return self
+
+    def delete(self, reference, option=None):
+        self._writes.append((lambda ref, _: ref._client._delete(ref, option), reference, None))
+        return self
+
+    def commit(self):
+        collections = self._client._collections
+        with self._client._lock:
+            # Records are replaced, never mutated, so keeping references is enough to roll back
+            previous = {
+                (ref._collection_path, ref.id): collections.get(ref._collection_path, {}).get(ref.id)
+                for _, ref, _ in self._writes
+            }
+            try:
+                results = [write(reference, data) for write, reference, data in self._writes]
+            except Exception:
+                # All-or-nothing, as a Firestore commit is
+                for (collection_path, document_id), record in previous.items():
+                    documents = collections.setdefault(collection_path, {})
+                    if record is None:
+                        documents.pop(document_id, None)
+                    else:
+                        documents[document_id] = record
+                raise
+            finally:
+                self._writes = []
+        return results
+
+
+class LocalTransaction(LocalWriteBatch):
+    """A write batch that can also read; the client lock is held for its whole lifetime."""
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, LocalDocumentReference):
+            return iter([ref_or_query.get()])
+        return ref_or_query.stream()
+
+
+class LocalWriteOption:
+    """Precondition for a delete, like the option returned by firestore.Client.write_option()."""
+
+    def __init__(self, exists):
+        self.exists = exists
+
+
+class LocalClient:
+    """
+    In-process stand-in for firestore.Client.
+
+    Documents are kept as plain dicts keyed by collection path and document ID,
+    and every read returns a deep copy so callers can mutate results freely, as
+    they can with real snapshots.
+    """
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.RLock()
+
+    def collection(self, name):
+        return LocalCollectionReference(self, name)
+
+    def document(self, path):
+        collection_path, document_id = path.rsplit('/', 1)
+        return LocalDocumentReference(self, collection_path, document_id)
+
+    def batch(self):
+        return LocalWriteBatch(self)
+
+    def transaction(self):
+        return LocalTransaction(self)
+
+    @staticmethod
+    def write_option(exists=None, **kwargs):
+        if exists is None or kwargs:
+            raise ValueError("The local backend only supports the exists= write option")
+        return LocalWriteOption(exists)
+
+    def reset(self):
+        with self._lock:
+            self._collections.clear()
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        """Batch read; like Firestore, snapshots are yielded in no particular order."""
+        with self._lock:
+            snapshots = [self._get(ref, field_paths) for ref in references]
+        return iter(snapshots)
+
+    def _get(self, doc_ref, field_paths=None):
+        with self._lock:
+            record = self._collections.get(doc_ref._collection_path, {}).get(doc_ref.id)
+            if record is None:
+                return LocalDocumentSnapshot(doc_ref, None)
+            return LocalDocumentSnapshot(doc_ref, copy.deepcopy(_project(record['data'], field_paths)),
+                                         record['create_time'], record['update_time'])
+
+    def _list(self, collection_path):
+        with self._lock:
+            documents = self._collections.get(collection_path, {})
+            return [
+                LocalDocumentSnapshot(LocalDocumentReference(self, collection_path, doc_id),
+                                      copy.deepcopy(record['data']),
+                                      record['create_time'], record['update_time'])
+                for doc_id, record in documents.items()
+            ]
+
+    def _write(self, doc_ref, data):
+        documents = self._collections.setdefault(doc_ref._collection_path, {})
+        now = _now()
+        record = documents.get(doc_ref.id)
+        create_time = record['create_time'] if record else now
+        documents[doc_ref.id] = {'data': data, 'create_time': create_time, 'update_time': now}
+        return now
+
+    def _set(self, doc_ref, data, merge=False):
+        with self._lock:
+            current = self._collections.get(doc_ref._collection_path, {}).get(doc_ref.id)
+            new_data = copy.deepcopy(current['data']) if merge and current else {}
+            _merge_into(new_data, data, deep=merge)
+            return self._write(doc_ref, new_data)
+
+    def _create(self, doc_ref, data):
+        with self._lock:
+            if doc_ref.id in self._collections.get(doc_ref._collection_path, {}):
+                raise gcp_exceptions.AlreadyExists(f"Document already exists: {doc_ref.path}")
+            new_data = {}
+            _merge_into(new_data, data)
+            return self._write(doc_ref, new_data)
+
+    def _update(self, doc_ref, data):
+        with self._lock:
+            current = self._collections.get(doc_ref._collection_path, {}).get(doc_ref.id)
+            if current is None:
+                raise gcp_exceptions.NotFound(f"No document to update: {doc_ref.path}")
+            new_data = copy.deepcopy(current['data'])
+            for field_path, value in data.items():
+                _set_field(new_data, field_path, value)
+            return self._write(doc_ref, new_data)
+
+    def _delete(self, doc_ref, option=None):
+        with self._lock:
+            documents = self._collections.get(doc_ref._collection_path, {})
+            if option is not None and option.exists != (doc_ref.id in documents):
+                if option.exists:
+                    raise gcp_exceptions.NotFound(f"No document to delete: {doc_ref.path}")
+                raise gcp_exceptions.AlreadyExists(f"Document already exists: {doc_ref.path}")
+            documents.pop(doc_ref.id, None)
+            return _now()
+
+
+def run_transaction(client, callback, *args, **kwargs):
+    """
+    Run `callback(transaction, *args, **kwargs)` in a transaction and commit it.
+
+    Firestore transactions are retried on contention by `firestore.transactional`;
+    local transactions hold the client lock instead, so they never contend.
+    An InstrumentedClient (metrics.py) runs the transaction on the client it
+    wraps and times it as a whole.
+    """
+    if hasattr(client, 'wrapped'):
+        with client.timed('db-write'):
+            return run_transaction(client.wrapped, callback, *args, **kwargs)
+    if isinstance(client, LocalClient):
+        with client._lock:
+            transaction = client.transaction()
+            result = callback(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+    return transactional(callback)(client.transaction(), *args, **kwargs)
+
+
+def create_client(backend=FIRESTORE, firestore_factory=None):
+    """
+    Build a storage client for the given backend name.
+
+    `firestore_factory` is called to build the real Firestore client so that
+    db_init keeps ownership of credentials and database selection.
+    """
+    if backend == LOCAL:
+        return LocalClient()
+    if backend == FIRESTORE:
+        if firestore_factory is None:
+            raise ValueError("A Firestore factory is required for the firestore backend")
+        return firestore_factory()
+    raise ValueError(f"Unknown storage backend '{backend}'. Expected one of {BACKENDS}")
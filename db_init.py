@@ -2,12 +2,31 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 import os
 
+import datastore
+import metrics
+
 # Flag to track if we're using Firebase
 firebase_available = False
 db = None
 
+# Storage backend: "firestore" (default) or "local" for an in-process stand-in
+storage_backend = os.environ.get('SCIWEB_STORAGE', datastore.FIRESTORE).lower()
+
+
+def _firestore_client():
+    client = firestore.client()
+    # Explicitly specify the database name using internal method
+    # This is a private method but currently the only way to specify a non-default database
+    client._database_string_internal = "projects/sturdy-analyzer-381018/databases/sciwebdb"
+    return client
+
+
+if storage_backend == datastore.LOCAL:
+    db = datastore.create_client(datastore.LOCAL)
+    firebase_available = True
+    print("Using local in-process storage backend")
 # Initialize Firebase if not already initialized and if service key exists
-if not firebase_admin._apps:
+elif not firebase_admin._apps:
     try:
         if os.path.exists('service_key3.json'):
             cred = credentials.Certificate('service_key3.json')
@@ -15,14 +34,10 @@ if not firebase_admin._apps:
                 'projectId': 'sturdy-analyzer-381018',
                 'storageBucket': 'bxscioly-455318.appspot.com'
             })
-            
+
             # Get Firestore client
-            db = firestore.client()
-            
-            # Explicitly specify the database name using internal method
-            # This is a private method but currently the only way to specify a non-default database
-            db._database_string_internal = "projects/sturdy-analyzer-381018/databases/sciwebdb"
-            
+            db = datastore.create_client(datastore.FIRESTORE, firestore_factory=_firestore_client)
+
             firebase_available = True
             print("Successfully connected to Firestore database: sciwebdb")
         else:
@@ -31,5 +46,9 @@ if not firebase_admin._apps:
         print(f"Error initializing Firebase: {str(e)}")
         print("Firebase functionality will be disabled.")
 
+# Time every storage call for the request metrics (Server-Timing and /metrics)
+if db is not None and metrics.METRICS_ENABLED:
+    db = metrics.InstrumentedClient(db)
+
 def is_firebase_available():
-    return firebase_available 
\ No newline at end of file
+    return firebase_available
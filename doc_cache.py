@@ -0,0 +1,240 @@
+"""
+Read-through cache for hot Firestore documents.
+
+Profile pages re-read the same Members/<id> document several times per load.
+`document_cache.get(db, collection, document_id)` serves those reads from a
+process-local LRU with a per-entry TTL, and the write paths call
+`document_cache.invalidate(...)` after they change a document.
+
+Reads can name a projection (see projections.py). A projected read is served
+from the cached full document when there is one, and otherwise fetches only the
+projected fields and caches them under their own key.
+
+Each gunicorn worker has its own in-process cache, so a write made through one
+worker can be served stale by another for up to the TTL. Set SCIWEB_CACHE_URL
+to a redis:// URL to share a single cache between workers instead (requires the
+optional `redis` package).
+
+Configuration (environment variables):
+  - SCIWEB_CACHE_TTL: seconds an entry stays fresh (default 30, 0 disables caching)
+  - SCIWEB_CACHE_SIZE: max entries in the in-process cache (default 2048)
+  - SCIWEB_CACHE_URL: optional shared backend
+"""
+import copy
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from projections import MEMBER_PROJECTIONS
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Collections whose documents are cached; everything else reads straight through
+CACHED_COLLECTIONS = {'Members'}
+
+DEFAULT_TTL = float(os.environ.get('SCIWEB_CACHE_TTL', 30))
+DEFAULT_SIZE = int(os.environ.get('SCIWEB_CACHE_SIZE', 2048))
+
+
+class LRUCacheBackend:
+    """Thread-safe in-process LRU with a TTL per entry."""
+
+    def __init__(self, max_entries=DEFAULT_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """Shared cache backend; values are pickled and expire via Redis TTLs."""
+
+    def __init__(self, url, prefix='sciweb:doc:'):
+        if redis is None:
+            raise RuntimeError("SCIWEB_CACHE_URL is set but the 'redis' package is not installed")
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        raw = self._client.get(self._prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + key, pickle.dumps(value), px=int(ttl * 1000))
+
+    def delete(self, key):
+        self._client.delete(self._prefix + key)
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self._prefix + '*'):
+            self._client.delete(key)
+
+    def __len__(self):
+        return sum(1 for _ in self._client.scan_iter(match=self._prefix + '*'))
+
+
+class CachedSnapshot:
+    """Minimal stand-in for a DocumentSnapshot, safe to keep in a cache."""
+
+    def __init__(self, document_id, data, update_time=None):
+        self.id = document_id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        # Callers mutate the result (e.g. deleting sensitive keys), so hand out a copy
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = self._data
+        for part in field_path.split('.'):
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return value
+
+
+class DocumentCache:
+    """Read-through document cache with hit/miss counters."""
+
+    def __init__(self, backend, ttl=DEFAULT_TTL, collections=CACHED_COLLECTIONS, projections=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.collections = set(collections)
+        # Projection names per collection, so invalidation can drop projected entries too
+        self.projections = {collection: set(names) for collection, names in (projections or {}).items()}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._counter_lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def enabled_for(self, collection):
+        return self.ttl > 0 and collection in self.collections
+
+    def get(self, db, collection, document_id, projection=None):
+        """
+        Return a snapshot for collection/document_id, from cache when fresh. With a
+        projection, the snapshot only holds the projected fields.
+        """
+        if not self.enabled_for(collection):
+            doc = db.collection(collection).document(document_id).get(
+                field_paths=projection.fields if projection else None)
+            if projection is None:
+                return doc
+            return CachedSnapshot(doc.id, projection.apply(doc.to_dict()) if doc.exists else None,
+                                  getattr(doc, 'update_time', None))
+
+        if projection is not None:
+            cached = self.peek(collection, document_id, projection)
+            if cached is not None:
+                self._count('hits')
+                return cached
+
+        key = f"{collection}/{document_id}" + (f"#{projection.name}" if projection else "")
+        if projection is None:
+            cached = self.backend.get(key)
+            if cached is not None:
+                self._count('hits')
+                return cached
+
+        self._count('misses')
+        doc = db.collection(collection).document(document_id).get(
+            field_paths=projection.fields if projection else None)
+        data = doc.to_dict() if doc.exists else None
+        if data is not None and projection is not None:
+            data = projection.apply(data)
+        snapshot = CachedSnapshot(doc.id, data, getattr(doc, 'update_time', None))
+        # Missing documents are not cached: a PUT may create them at any moment
+        if snapshot.exists:
+            self.backend.set(key, snapshot, self.ttl)
+        return snapshot
+
+    def peek(self, collection, document_id, projection=None):
+        """Return the cached snapshot without touching storage (None on a miss)."""
+        if not self.enabled_for(collection):
+            return None
+        full = self.backend.get(f"{collection}/{document_id}")
+        if projection is None:
+            return full
+        if full is not None:
+            return CachedSnapshot(full.id, projection.apply(full._data), full.update_time)
+        return self.backend.get(f"{collection}/{document_id}#{projection.name}")
+
+    def invalidate(self, collection, *document_ids):
+        if collection not in self.collections:
+            return
+        for document_id in document_ids:
+            self.backend.delete(f"{collection}/{document_id}")
+            for name in self.projections.get(collection, ()):
+                self.backend.delete(f"{collection}/{document_id}#{name}")
+            self._count('invalidations')
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.backend),
+            "ttlSeconds": self.ttl,
+            "backend": type(self.backend).__name__
+        }
+
+
+def _create_backend():
+    url = os.environ.get('SCIWEB_CACHE_URL')
+    if url:
+        try:
+            return RedisCacheBackend(url)
+        except Exception as e:
+            print(f"Error connecting to shared cache, using in-process cache: {str(e)}")
+    return LRUCacheBackend()
+
+
+document_cache = DocumentCache(_create_backend(), projections={'Members': MEMBER_PROJECTIONS})
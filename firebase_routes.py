@@ -1,10 +1,29 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
+import os
+import queue
+import threading
+import time
 
 from urllib.parse import urlparse, parse_qs
 
+from datastore import run_transaction
+from doc_cache import document_cache
+from message_hub import MessageHub, parse_sent_at
+from tree_ops import TreeOpError, validate_ops, apply_ops
+from projections import MEMBER_PROJECTIONS, member_projection
+from member_index import MemberIndex, IndexConflict
+from schemas import validate
+from metrics import bind, internal_only
+from http_caching import conditional_response, document_etag
+from class_layout import LAYOUTS, SEQ_FIELD, ensure_migrated, item_ref, put_item, read_items, with_items
+from google.api_core.exceptions import AlreadyExists, NotFound
+
 # Try to import from our initialization module
 try:
     from db_init import db, is_firebase_available
@@ -15,7 +34,7 @@ except ImportError:
 
 # Get Firebase Storage bucket if Firebase is available
 bucket = None
-if is_firebase_available():
+if is_firebase_available() and firebase_admin._apps:
     try:
         bucket = storage.bucket('sciweb-files')
     except Exception as e:
@@ -23,6 +42,49 @@ if is_firebase_available():
 
 firebase_routes = Blueprint('firebase_routes', __name__)
 
+
+member_index = MemberIndex(db)
+
+# Batched member reads: documents per get_all() call, and parallel calls for long lists
+MEMBER_BATCH_SIZE = 100
+MEMBER_FETCH_WORKERS = 4
+
+# Firestore's maximum number of writes in one batch or transaction
+BATCH_WRITE_LIMIT = 500
+
+# Upper bound on the `limit` query parameter of GET /<collection>
+MAX_PAGE_SIZE = 1000
+
+# Bulk import: accepted collections with the fields each item needs, and items per request
+BULK_REQUIRED_FIELDS = {
+    'Assignments': ['classId', 'title'],
+    'Events': ['classId', 'title'],
+    'Problems': ['title'],
+}
+MAX_BULK_ITEMS = 5000
+
+# Per-user collections that only their own routes serve, with a session check; the
+# generic /<collection> routes below refuse them
+PRIVATE_COLLECTIONS = {'Gradebooks'}
+
+# Messages returned by a channel fetch when no limit is given
+MESSAGE_PAGE_SIZE = 50
+
+# Channel push: long-poll cap, SSE keepalive interval, SSE connection lifetime, client retry
+MAX_LONG_POLL_SECONDS = 25
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_SECONDS = 300
+SSE_RETRY_MS = 3000
+# Open SSE streams and waiting long-polls allowed per process. Each holds one of the
+# worker's threads (SCIWEB_THREADS, see gunicorn.conf.py), so the cap leaves
+# SCIWEB_RESERVED_THREADS of them for other requests; past it streams get a 503 and
+# long-polls answer without waiting.
+WORKER_THREADS = int(os.environ.get('SCIWEB_THREADS', 64))
+RESERVED_THREADS = int(os.environ.get('SCIWEB_RESERVED_THREADS', 12))
+MAX_OPEN_STREAMS = max(1, WORKER_THREADS - RESERVED_THREADS)
+STREAM_RETRY_AFTER_SECONDS = 10
+open_stream_slots = threading.BoundedSemaphore(MAX_OPEN_STREAMS)
+
 # Helper to check Firebase availability for routes
 def firebase_required(f):
     def decorated_function(*args, **kwargs):
@@ -32,25 +94,164 @@ def firebase_required(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+def fetch_members(member_ids, projection=None):
+    """
+    Fetch several Members documents with batched reads instead of one get() each.
+
+    Lists longer than MEMBER_BATCH_SIZE are split into chunks that are fetched
+    in parallel. With a projection only its fields are read. Returns the existing
+    snapshots in the order of `member_ids`.
+    """
+    unique_ids = list(dict.fromkeys(member_ids))
+    if not unique_ids:
+        return []
+
+    # Serve what we can from the document cache and only fetch the rest
+    snapshots = {}
+    for member_id in unique_ids:
+        cached = document_cache.peek('Members', member_id, projection)
+        if cached is not None:
+            snapshots[member_id] = cached
+    missing_ids = [member_id for member_id in unique_ids if member_id not in snapshots]
+
+    members_ref = db.collection('Members')
+    chunks = [
+        [members_ref.document(member_id) for member_id in missing_ids[i:i + MEMBER_BATCH_SIZE]]
+        for i in range(0, len(missing_ids), MEMBER_BATCH_SIZE)
+    ]
+
+    def fetch_chunk(refs):
+        return list(db.get_all(refs, field_paths=projection.fields if projection else None))
+
+    if len(chunks) <= 1:
+        results = [fetch_chunk(chunk) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=min(MEMBER_FETCH_WORKERS, len(chunks))) as pool:
+            results = list(pool.map(bind(fetch_chunk), chunks))
+
+    # get_all() returns documents in arbitrary order
+    snapshots.update({snap.id: snap for chunk in results for snap in chunk if snap.exists})
+    return [snapshots[member_id] for member_id in unique_ids if member_id in snapshots]
+
+@firebase_routes.route('/cache/stats', methods=['GET'])
+@internal_only
+def cache_stats():
+    """Hit/miss counters for the document cache"""
+    return jsonify(document_cache.stats()), 200
+
+def apply_page_args(query, collection):
+    """
+    Apply the orderBy, limit and startAfter query parameters (see get_all) to a query.
+    Returns (query, None), or (None, error response) when a parameter is invalid.
+    """
+    order_by = request.args.get('orderBy')
+    if order_by:
+        direction = firestore.Query.DESCENDING if order_by.startswith('-') else firestore.Query.ASCENDING
+        query = query.order_by(order_by.lstrip('-'), direction=direction)
+
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return None, (jsonify({"error": "limit must be an integer"}), 400)
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            return None, (jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400)
+        query = query.limit(limit)
+
+    start_after = request.args.get('startAfter')
+    if start_after:
+        cursor_doc = db.collection(collection).document(start_after).get()
+        if not cursor_doc.exists:
+            return None, (jsonify({"error": "startAfter document not found"}), 400)
+        query = query.start_after(cursor_doc)
+    return query, None
+
 @firebase_routes.route('/<collection>', methods=['GET'])
 @firebase_required
 def get_all(collection):
-    """Get all documents from a collection"""
+    """
+    Get documents from a collection, streamed to the client as they are read.
+
+    Optional query parameters:
+      - limit: maximum number of documents (at most MAX_PAGE_SIZE)
+      - orderBy: field to order by, prefixed with '-' for descending order
+      - startAfter: ID of the last document of the previous page
+      - fields: comma-separated field paths to return instead of whole documents
+      - projection: for Members, a named projection (default public_card); see projections.py
+      - format: 'ndjson' for one {id: data} object per line instead of a JSON array
+    """
     try:
-        docs = db.collection(collection).stream()
-        items = [{doc.id: doc.to_dict()} for doc in docs]
-        return jsonify(items), 200
+        if collection in PRIVATE_COLLECTIONS:
+            return jsonify({"error": f"{collection} cannot be accessed through this endpoint"}), 403
+        query = db.collection(collection)
+
+        fields = request.args.get('fields')
+        projection = None
+        if collection == 'Members':
+            # Member documents hold passwords: only named projections are listed
+            if fields:
+                return jsonify({"error": "Use projection instead of fields for Members"}), 400
+            try:
+                projection = member_projection(request.args.get('projection', 'public_card'))
+            except KeyError:
+                return jsonify({"error": f"Unknown projection, expected one of {sorted(MEMBER_PROJECTIONS)}"}), 400
+            query = query.select(projection.fields)
+        elif fields:
+            query = query.select([field.strip() for field in fields.split(',') if field.strip()])
+
+        query, error = apply_page_args(query, collection)
+        if error:
+            return error
+
+        ndjson = request.args.get('format') == 'ndjson'
+
+        # Pull the first document before responding so query errors still map to a 500
+        docs = query.stream()
+        first_doc = next(docs, None)
+        docs = itertools.chain([first_doc], docs) if first_doc is not None else iter(())
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    json_provider = current_app.json
+
+    def generate():
+        try:
+            if ndjson:
+                for doc in docs:
+                    yield json_provider.dumps({doc.id: doc.to_dict()}) + '\n'
+            else:
+                yield '['
+                for index, doc in enumerate(docs):
+                    yield (',' if index else '') + json_provider.dumps({doc.id: doc.to_dict()})
+                yield ']'
+        except Exception as e:
+            # Headers are already sent; the truncated body tells the client something went wrong
+            print(f"Error streaming collection {collection}: {e}")
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(generate(), status=200, mimetype=mimetype)
+
+def document_head(collection, document_id):
+    """HEAD: 200 or 404 from a read with an empty field mask, so no fields are transferred"""
+    doc = db.collection(collection).document(document_id).get(field_paths=[])
+    return ('', 200) if doc.exists else ('', 404)
+
 @firebase_routes.route('/<collection>/<document_id>', methods=['GET'])
 @firebase_required
 def get_one(collection, document_id):
-    """Get a specific document from a collection"""
+    """Get a specific document from a collection (HEAD checks that it exists)"""
     try:
+        if collection in PRIVATE_COLLECTIONS:
+            return jsonify({"error": f"{collection} cannot be accessed through this endpoint"}), 403
+        if request.method == 'HEAD':
+            return document_head(collection, document_id)
         doc = db.collection(collection).document(document_id).get()
         if doc.exists:
-            return jsonify({doc.id: doc.to_dict()}), 200
+            # Lists kept in subcollections (class channels and units) are returned inline;
+            # writes to them also touch the class document, so its update_time covers them
+            response = jsonify({doc.id: with_items(db, collection, doc.id, doc.to_dict())})
+            return conditional_response(response, document_etag(doc, collection))
         return jsonify({"error": "Document not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -60,6 +261,8 @@ def get_one(collection, document_id):
 def create(collection):
     """Create a new document in a collection"""
     try:
+        if collection in PRIVATE_COLLECTIONS:
+            return jsonify({"error": f"{collection} cannot be accessed through this endpoint"}), 403
         data = request.get_json()
         if not data:
             return jsonify({"error": "No data provided"}), 400
@@ -70,46 +273,163 @@ def create(collection):
         if 'updatedAt' not in data:
              data['updatedAt'] = firestore.SERVER_TIMESTAMP
              
+        if collection == 'Members':
+            # Claims the email and username in the same transaction
+            member_id = member_index.create_member(data)
+            return jsonify({"id": member_id, "message": "Document created successfully"}), 201
+
+        if collection == 'Messages':
+            # Stored as a Timestamp from the server clock, so channel reads order and page consistently
+            data['sentAt'] = firestore.SERVER_TIMESTAMP
+
         # Add document with auto-generated ID
         doc_ref = db.collection(collection).document()
         doc_ref.set(data)
+
+        if collection == 'Messages' and data.get('classId') and data.get('channelId'):
+            publish_message(doc_ref.id, data)
         
         return jsonify({"id": doc_ref.id, "message": "Document created successfully"}), 201
+    except IndexConflict as e:
+        return jsonify({"error": str(e), "field": e.field}), 409
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500
 
+def parse_bulk_items():
+    """
+    Items of a bulk request body: a JSON array, or NDJSON (one object per line).
+    Returns a list of (item, error) pairs so a bad NDJSON line fails alone.
+    """
+    body = request.get_data(as_text=True).strip()
+    if body.startswith('['):
+        items = json.loads(body)
+        return [(item, None) for item in items]
+    parsed = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            parsed.append((json.loads(line), None))
+        except ValueError as e:
+            parsed.append((None, f"Invalid JSON: {e}"))
+    return parsed
+
+@firebase_routes.route('/<collection>/bulk', methods=['POST'])
+@firebase_required
+def bulk_create(collection):
+    """
+    Import many documents at once (e.g. a semester of assignments, events and problems).
+    
+    The body is a JSON array or NDJSON. Each item is validated against the
+    collection's schema in database.md; an item with an `id` is written under
+    that ID (so re-running an import overwrites instead of duplicating), others
+    get a new ID. Valid items are written in batches of BATCH_WRITE_LIMIT.
+    Returns one result per item, in order: created, invalid or failed. The status
+    is 201 when every item was created, 207 when only some were, and otherwise
+    400 (or 500 when storage failed).
+    """
+    if collection not in BULK_REQUIRED_FIELDS:
+        return jsonify({"error": f"Bulk import is only supported for {sorted(BULK_REQUIRED_FIELDS)}"}), 400
+    try:
+        try:
+            items = parse_bulk_items()
+        except ValueError as e:
+            return jsonify({"error": f"Invalid JSON: {e}"}), 400
+        if not items:
+            return jsonify({"error": "No data provided"}), 400
+        if len(items) > MAX_BULK_ITEMS:
+            return jsonify({"error": f"At most {MAX_BULK_ITEMS} items per request"}), 413
+        
+        results = []
+        writes = []
+        for index, (item, error) in enumerate(items):
+            errors = [error] if error else validate(collection, item, BULK_REQUIRED_FIELDS[collection])
+            if errors:
+                results.append({"index": index, "status": "invalid", "errors": errors})
+                continue
+            data = dict(item)
+            doc_id = data.pop('id', None)
+            data.setdefault('createdAt', firestore.SERVER_TIMESTAMP)
+            data.setdefault('updatedAt', firestore.SERVER_TIMESTAMP)
+            doc_ref = db.collection(collection).document(str(doc_id) if doc_id else None)
+            result = {"index": index, "id": doc_ref.id, "status": "created"}
+            results.append(result)
+            writes.append((doc_ref, data, result))
+        
+        for i in range(0, len(writes), BATCH_WRITE_LIMIT):
+            chunk = writes[i:i + BATCH_WRITE_LIMIT]
+            batch = db.batch()
+            for doc_ref, data, _ in chunk:
+                batch.set(doc_ref, data)
+            try:
+                batch.commit()
+            except Exception as e:
+                # A failed batch fails only its own items; earlier batches are already stored
+                print(f"Error committing bulk {collection} batch: {e}")
+                for _, _, result in chunk:
+                    result.update({"status": "failed", "error": str(e)})
+        document_cache.invalidate(collection, *[doc_ref.id for doc_ref, _, _ in writes])
+        
+        counts = {}
+        for result in results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        if counts.get('created'):
+            status = 201 if counts['created'] == len(results) else 207
+        else:
+            status = 500 if counts.get('failed') else 400
+        return jsonify({"results": results, "counts": counts}), status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @firebase_routes.route('/<collection>/<document_id>', methods=['PUT', 'PATCH'])
 @firebase_required
 def update(collection, document_id):
     """Update a document in a collection"""
     try:
+        if collection in PRIVATE_COLLECTIONS:
+            return jsonify({"error": f"{collection} cannot be accessed through this endpoint"}), 403
         data = request.get_json()
         if not data:
             return jsonify({"error": "No data provided"}), 400
-        
+        # Lists kept in subcollections (class_layout.py): an array written here would be
+        # shadowed by the subcollection entries on read
+        keyed = [field for parent, field in LAYOUTS if parent == collection and field in data]
+        if keyed:
+            return jsonify({"error": f"Update {', '.join(keyed)} through /{collection}/<id>/<list> instead"}), 400
+        if collection == 'Messages' and 'sentAt' in data:
+            return jsonify({"error": "sentAt is set by the server"}), 400
+        
+        if collection == 'Members':
+            # Keeps the email/username index in step with the member document
+            member_index.update_member(document_id, data, replace=request.method == 'PUT')
+            document_cache.invalidate(collection, document_id)
+            return jsonify({"message": "Document updated successfully"}), 200
+
         doc_ref = db.collection(collection).document(document_id)
-        doc = doc_ref.get()
-        
-        # For PATCH, only update specified fields if document exists
-        # For PUT, replace entire document (or create if it doesn't exist)
-        if not doc.exists:
-            if request.method == 'PATCH':
-                return jsonify({"error": "Document not found"}), 404
-            else:
-                # Create the document with the specified ID
-                doc_ref.set(data)
-                return jsonify({"message": "Document created successfully", "id": document_id}), 201
         
-        # Document exists, update it
+        # Single writes whose preconditions replace an existence read:
+        #  - PATCH updates the given fields; update() fails with NotFound if the document is missing
+        #  - PUT with If-None-Match: * only creates; create() fails with AlreadyExists if it exists
+        #  - any other PUT replaces the document, or creates it
         if request.method == 'PATCH':
             doc_ref.update(data)
-            message = "Document updated successfully"
+            message, status = "Document updated successfully", 200
+        elif request.headers.get('If-None-Match') == '*':
+            doc_ref.create(data)
+            message, status = "Document created successfully", 201
         else:
             doc_ref.set(data)
-            message = "Document replaced successfully"
+            message, status = "Document saved successfully", 200
+        document_cache.invalidate(collection, document_id)
         
-        return jsonify({"message": message}), 200
+        return jsonify({"message": message, "id": document_id}), status
+    except NotFound:
+        return jsonify({"error": "Document not found"}), 404
+    except AlreadyExists:
+        return jsonify({"error": "Document already exists"}), 409
+    except IndexConflict as e:
+        return jsonify({"error": str(e), "field": e.field}), 409
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -118,19 +438,100 @@ def update(collection, document_id):
 def delete(collection, document_id):
     """Delete a document from a collection"""
     try:
+        if collection in PRIVATE_COLLECTIONS:
+            return jsonify({"error": f"{collection} cannot be accessed through this endpoint"}), 403
+        if collection == 'Members':
+            # Frees the member's email and username
+            member_index.delete_member(document_id)
+            document_cache.invalidate(collection, document_id)
+            return jsonify({"message": "Document deleted successfully"}), 200
+
+        # The exists precondition turns a missing document into NotFound without a read
         doc_ref = db.collection(collection).document(document_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            return jsonify({"error": "Document not found"}), 404
-        
-        doc_ref.delete()
+        doc_ref.delete(option=db.write_option(exists=True))
+        document_cache.invalidate(collection, document_id)
         return jsonify({"message": "Document deleted successfully"}), 200
+    except NotFound:
+        return jsonify({"error": "Document not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 
+@firebase_routes.route('/Trees/<tree_id>/ops', methods=['POST'])
+@firebase_required
+def apply_tree_ops(tree_id):
+    """
+    Apply a batch of node/edge operations to a tree instead of replacing it.
+
+    Expects JSON with:
+      - baseVersion: the tree version the operations were computed against
+      - ops: list of operations (see tree_ops.py)
+    Returns the new version, or 409 with the current tree if the batch
+    cannot be rebased onto it.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
+
+        base_version = data.get('baseVersion')
+        if not isinstance(base_version, int) or base_version < 0:
+            return jsonify({"error": "baseVersion must be a non-negative integer"}), 400
+
+        ops = data.get('ops')
+        validate_ops(ops)
+    except TreeOpError as e:
+        return jsonify({"error": str(e)}), 400
+
+    tree_ref = db.collection('Trees').document(tree_id)
+
+    def apply_in_transaction(transaction):
+        tree_doc = tree_ref.get(transaction=transaction)
+        if not tree_doc.exists:
+            return {"error": "Tree not found"}, 404
+
+        tree = tree_doc.to_dict()
+        version = tree.get('version', 0)
+        nodes = tree.get('nodes', [])
+        edges = tree.get('edges', [])
+
+        conflicts = []
+        if base_version > version:
+            conflicts.append({"reason": f"baseVersion {base_version} is ahead of stored version {version}"})
+        else:
+            new_nodes, new_edges, conflicts = apply_ops(nodes, edges, ops)
+
+        if conflicts:
+            # Hand back the stored tree so the client can resync and retry
+            return {
+                "error": "Operations conflict with the current tree",
+                "conflicts": conflicts,
+                "version": version,
+                "nodes": nodes,
+                "edges": edges
+            }, 409
+
+        transaction.update(tree_ref, {
+            'nodes': new_nodes,
+            'edges': new_edges,
+            'version': version + 1,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        return {
+            "message": "Operations applied successfully",
+            "version": version + 1,
+            "applied": len(ops),
+            "rebased": base_version < version
+        }, 200
+
+    try:
+        body, status = run_transaction(db, apply_in_transaction)
+        return jsonify(body), status
+    except Exception as e:
+        print(f"Error applying tree ops for {tree_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @firebase_routes.route('/profile-photo', methods=['POST'])
 @firebase_required
 def upload_profile_photo():
@@ -158,7 +559,7 @@ def upload_profile_photo():
         
         # Get user document to find old profilePicUrl
         user_ref = db.collection('Members').document(user_id)
-        user_doc = user_ref.get()
+        user_doc = document_cache.get(db, 'Members', user_id)
         old_url = None
         if user_doc.exists:
             user_data = user_doc.to_dict()
@@ -201,6 +602,7 @@ def upload_profile_photo():
             'profilePicUrl': url,
             'updatedAt': firestore.SERVER_TIMESTAMP
         })
+        document_cache.invalidate('Members', user_id)
         
         return jsonify({"url": url, "success": True})
     
@@ -211,24 +613,23 @@ def upload_profile_photo():
 @firebase_routes.route('/Members/<user_id>', methods=['GET'])
 @firebase_required
 def get_user_profile(user_id):
-    """Get a user's profile data with settings"""
+    """Get a user's profile data with settings (?projection= picks another named projection)"""
     try:
-        # Get user document
-        user_doc = db.collection('Members').document(user_id).get()
+        projection = member_projection(request.args.get('projection', 'self_profile'))
+    except KeyError:
+        return jsonify({"error": f"Unknown projection, expected one of {sorted(MEMBER_PROJECTIONS)}"}), 400
+    try:
+        if request.method == 'HEAD':
+            return document_head('Members', user_id)
+        # Get only the projected fields of the user document
+        user_doc = document_cache.get(db, 'Members', user_id, projection)
         
         if not user_doc.exists:
             return jsonify({"error": "User not found"}), 404
         
-        # Return the user data
-        user_data = user_doc.to_dict()
-        
-        # Remove sensitive information
-        if 'password' in user_data:
-            del user_data['password']
-        if 'verification_code' in user_data:
-            del user_data['verification_code']
-        
-        return jsonify({"user": user_data}), 200
+        # The projection leaves out sensitive fields and the large arrays
+        response = jsonify({"user": user_doc.to_dict()})
+        return conditional_response(response, document_etag(user_doc, 'Members', projection.name))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -241,17 +642,15 @@ def update_user_profile(user_id):
         if not data:
             return jsonify({"error": "No data provided"}), 400
         
-        # Get user document
-        user_ref = db.collection('Members').document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            return jsonify({"error": "User not found"}), 404
-        
-        # Update the user data
-        user_ref.update(data)
+        # Update the user data (and the email/username index if either changes)
+        member_index.update_member(user_id, data)
+        document_cache.invalidate('Members', user_id)
         
         return jsonify({"message": "User profile updated successfully"}), 200
+    except NotFound:
+        return jsonify({"error": "User not found"}), 404
+    except IndexConflict as e:
+        return jsonify({"error": str(e), "field": e.field}), 409
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -261,14 +660,13 @@ def get_user_classes(user_id):
     """Get a user's classes"""
     try:
         # Get user document
-        user_doc = db.collection('Members').document(user_id).get()
+        user_doc = document_cache.get(db, 'Members', user_id)
         
         if not user_doc.exists:
             return jsonify({"error": "User not found"}), 404
         
-        # Get classes array from user data
-        user_data = user_doc.to_dict()
-        classes = user_data.get('classes', [])
+        # Legacy classes array merged with the classes subcollection
+        classes = read_items(db, 'Members', user_id, 'classes', user_doc.to_dict())
         
         return jsonify({"classes": classes}), 200
     except Exception as e:
@@ -289,42 +687,24 @@ def manage_user_classes(user_id):
         if not class_data:
             return jsonify({"error": "No class data provided"}), 400
         
-        # Get user document
-        user_ref = db.collection('Members').document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
+        # Moves a legacy classes array into Members/<user_id>/classes on first write
+        if not ensure_migrated(db, 'Members', user_id, 'classes'):
             return jsonify({"error": "User not found"}), 404
         
-        # Get current classes
-        user_data = user_doc.to_dict()
-        classes = user_data.get('classes', [])
-        
-        # Operation: add, update, or remove
-        if operation == 'add':
-            # Check if class already exists
-            for i, cls in enumerate(classes):
-                if cls.get('id') == class_data.get('id'):
-                    # Update existing class
-                    classes[i] = class_data
-                    break
-            else:
-                # Add new class
-                classes.append(class_data)
-        elif operation == 'update':
-            # Update existing class
-            for i, cls in enumerate(classes):
-                if cls.get('id') == class_data.get('id'):
-                    classes[i] = class_data
-                    break
-            else:
+        if not class_data.get('id'):
+            if operation == 'update':
                 return jsonify({"error": "Class not found"}), 404
+            class_data['id'] = db.collection('Members').document(user_id).collection('classes').document().id
         
-        # Update the user document
-        user_ref.update({
-            'classes': classes,
-            'updatedAt': firestore.SERVER_TIMESTAMP
-        })
+        # Operation: add (or replace) or update an existing class; a replaced class keeps its place
+        existing = item_ref(db, 'Members', user_id, 'classes', str(class_data['id'])).get(field_paths=[SEQ_FIELD])
+        if operation == 'update' and not existing.exists:
+            return jsonify({"error": "Class not found"}), 404
+        put_item(db, 'Members', user_id, 'classes', class_data,
+                 seq=existing.to_dict().get(SEQ_FIELD) if existing.exists else None)
+        
+        db.collection('Members').document(user_id).update({'updatedAt': firestore.SERVER_TIMESTAMP})
+        document_cache.invalidate('Members', user_id)
         
         return jsonify({
             "message": f"Class {operation}d successfully", 
@@ -347,66 +727,58 @@ def delete_user_class(user_id):
         if not class_id:
             return jsonify({"error": "No class ID provided"}), 400
         
-        # Get user document
-        user_ref = db.collection('Members').document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
+        if not ensure_migrated(db, 'Members', user_id, 'classes'):
             return jsonify({"error": "User not found"}), 404
         
-        # Get current classes
-        user_data = user_doc.to_dict()
-        classes = user_data.get('classes', [])
-        
-        # Remove the class with matching ID
-        updated_classes = [cls for cls in classes if cls.get('id') != class_id]
-        
-        if len(updated_classes) == len(classes):
+        class_ref = item_ref(db, 'Members', user_id, 'classes', str(class_id))
+        if not class_ref.get(field_paths=['id']).exists:
             return jsonify({"error": "Class not found"}), 404
+        class_ref.delete()
         
-        # Update the user document
-        user_ref.update({
-            'classes': updated_classes,
-            'updatedAt': firestore.SERVER_TIMESTAMP
-        })
+        db.collection('Members').document(user_id).update({'updatedAt': firestore.SERVER_TIMESTAMP})
+        document_cache.invalidate('Members', user_id)
         
         return jsonify({"message": "Class removed successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@firebase_routes.route('/api/Members/<user_id>/friends', methods=['GET'])
+@firebase_routes.route('/Members/<user_id>/friends', methods=['GET'])
 def get_user_friends(user_id):
     try:
-        user_ref = db.collection('Members').document(user_id)
-        user_doc = user_ref.get()
+        user_doc = document_cache.get(db, 'Members', user_id, member_projection('friend_ids'))
         
         if not user_doc.exists:
             return jsonify({'error': 'User not found'}), 404
         
-        user_data = user_doc.to_dict()
-        friend_ids = user_data.get('friends', [])
+        friend_ids = user_doc.to_dict().get('friends', [])
         
-        # Fetch friend details
+        # Fetch the public cards of all friends in batched reads
         friends = []
-        for friend_id in friend_ids:
-            friend_doc = db.collection('Members').document(friend_id).get()
-            if friend_doc.exists:
-                friend_data = friend_doc.to_dict()
-                # Remove sensitive information
-                for field in ['password', 'verificationCode']:
-                    if field in friend_data:
-                        del friend_data[field]
-                
-                # Add the ID to the friend data
-                friend_data['id'] = friend_id
-                friends.append(friend_data)
+        for friend_doc in fetch_members(friend_ids, member_projection('public_card')):
+            friend_data = friend_doc.to_dict()
+            # Add the ID to the friend data
+            friend_data['id'] = friend_doc.id
+            friends.append(friend_data)
         
         return jsonify({'friends': friends})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@firebase_routes.route('/api/Members/<user_id>/friends', methods=['POST'])
+def befriend(writer, user_id, friend_ids):
+    """Queue the two-way friend link writes; ArrayUnion keeps concurrent adds from losing updates"""
+    members_ref = db.collection('Members')
+    writer.update(members_ref.document(user_id), {'friends': firestore.ArrayUnion(list(friend_ids))})
+    for friend_id in friend_ids:
+        writer.update(members_ref.document(friend_id), {'friends': firestore.ArrayUnion([user_id])})
+
+def unfriend(writer, user_id, friend_ids):
+    members_ref = db.collection('Members')
+    writer.update(members_ref.document(user_id), {'friends': firestore.ArrayRemove(list(friend_ids))})
+    for friend_id in friend_ids:
+        writer.update(members_ref.document(friend_id), {'friends': firestore.ArrayRemove([user_id])})
+
+@firebase_routes.route('/Members/<user_id>/friends', methods=['POST'])
 def add_user_friend(user_id):
     try:
         data = request.json
@@ -415,20 +787,8 @@ def add_user_friend(user_id):
         
         friend_username = data['friendUsername']
         
-        # Check if user exists
-        user_ref = db.collection('Members').document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Find friend by username
-        friend_query = db.collection('Members').where('username', '==', friend_username).limit(1).get()
-        
-        if not friend_query:
-            return jsonify({'error': 'Friend not found'}), 404
-        
-        friend_doc = list(friend_query)[0] if friend_query else None
+        # Find friend by username with a keyed index read
+        friend_doc = member_index.find_member('username', friend_username, field_paths=['username'])
         
         if not friend_doc:
             return jsonify({'error': 'Friend not found'}), 404
@@ -439,31 +799,32 @@ def add_user_friend(user_id):
         if friend_id == user_id:
             return jsonify({'error': 'Cannot add yourself as a friend'}), 400
         
-        # Check if already friends
-        user_data = user_doc.to_dict()
-        user_friends = user_data.get('friends', [])
-        
-        if friend_id in user_friends:
-            return jsonify({'error': 'Already friends with this user'}), 400
-        
-        # Add friend
-        user_friends.append(friend_id)
-        user_ref.update({'friends': user_friends})
-        
-        # Add back as friend for the other user
-        friend_data = friend_doc.to_dict()
-        friend_friends = friend_data.get('friends', [])
+        user_ref = db.collection('Members').document(user_id)
         
-        if user_id not in friend_friends:
-            friend_friends.append(user_id)
-            db.collection('Members').document(friend_id).update({'friends': friend_friends})
+        def add_in_transaction(transaction):
+            user_doc = user_ref.get(field_paths=['friends'], transaction=transaction)
+            if not user_doc.exists:
+                return 'User not found', 404
+            if friend_id in (user_doc.to_dict().get('friends') or []):
+                return 'Already friends with this user', 400
+            # Both sides of the link are written in one commit
+            befriend(transaction, user_id, [friend_id])
+            return None, 200
+        
+        error, status = run_transaction(db, add_in_transaction)
+        if error:
+            return jsonify({'error': error}), status
+        document_cache.invalidate('Members', user_id, friend_id)
         
         return jsonify({'message': 'Friend added successfully', 'friendId': friend_id})
     
+    except NotFound:
+        # The friend was deleted after the username lookup
+        return jsonify({'error': 'Friend not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@firebase_routes.route('/api/Members/<user_id>/friends', methods=['DELETE'])
+@firebase_routes.route('/Members/<user_id>/friends', methods=['DELETE'])
 def remove_user_friend(user_id):
     try:
         data = request.json
@@ -471,45 +832,119 @@ def remove_user_friend(user_id):
             return jsonify({'error': 'No friend ID provided'}), 400
         
         friend_id = data['friendId']
-        
-        # Check if user exists
         user_ref = db.collection('Members').document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Remove friend from user's list
-        user_data = user_doc.to_dict()
-        user_friends = user_data.get('friends', [])
-        
-        if friend_id not in user_friends:
-            return jsonify({'error': 'Friend not in friend list'}), 400
-        
-        user_friends.remove(friend_id)
-        user_ref.update({'friends': user_friends})
-        
-        # Remove user from friend's list
         friend_ref = db.collection('Members').document(friend_id)
-        friend_doc = friend_ref.get()
         
-        if friend_doc.exists:
-            friend_data = friend_doc.to_dict()
-            friend_friends = friend_data.get('friends', [])
-            
-            if user_id in friend_friends:
-                friend_friends.remove(user_id)
-                friend_ref.update({'friends': friend_friends})
+        def remove_in_transaction(transaction):
+            user_doc = user_ref.get(field_paths=['friends'], transaction=transaction)
+            if not user_doc.exists:
+                return 'User not found', 404
+            if friend_id not in (user_doc.to_dict().get('friends') or []):
+                return 'Friend not in friend list', 400
+            if friend_ref.get(field_paths=['friends'], transaction=transaction).exists:
+                unfriend(transaction, user_id, [friend_id])
+            else:
+                # The friend's account is gone: only clean up this side
+                transaction.update(user_ref, {'friends': firestore.ArrayRemove([friend_id])})
+            return None, 200
+        
+        error, status = run_transaction(db, remove_in_transaction)
+        if error:
+            return jsonify({'error': error}), status
+        document_cache.invalidate('Members', user_id, friend_id)
         
         return jsonify({'message': 'Friend removed successfully'})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def class_member_ids(class_id):
+    """User IDs of the active members of a class, or None if the class does not exist"""
+    class_doc = db.collection('Classes').document(class_id).get(field_paths=['members'])
+    if not class_doc.exists:
+        return None
+    return [
+        member.get('userId') for member in class_doc.to_dict().get('members') or []
+        if member.get('userId') and member.get('status', 'active') == 'active'
+    ]
+
+@firebase_routes.route('/Members/<user_id>/friends/bulk', methods=['POST'])
+def bulk_friends(user_id):
+    """
+    Add or remove many friends at once, e.g. to import a class roster.
+    
+    Expects JSON with one of:
+      - usernames: array of usernames
+      - friendIds: array of member IDs
+      - classId: add every active member of the class
+    and optionally action: "add" (default) or "remove".
+    Returns a per-friend result: added, removed, alreadyFriends, notFriends, notFound or self.
+    """
+    try:
+        data = request.get_json() or {}
+        action = data.get('action', 'add')
+        if action not in ('add', 'remove'):
+            return jsonify({'error': 'action must be "add" or "remove"'}), 400
+        
+        results = []
+        candidate_ids = []
+        if 'classId' in data:
+            candidate_ids = class_member_ids(data['classId'])
+            if candidate_ids is None:
+                return jsonify({'error': 'Class not found'}), 404
+        elif isinstance(data.get('friendIds'), list):
+            candidate_ids = data['friendIds']
+        elif isinstance(data.get('usernames'), list):
+            for username in data['usernames']:
+                friend_id = member_index.lookup('username', username)
+                if friend_id:
+                    candidate_ids.append(friend_id)
+                else:
+                    results.append({'username': username, 'status': 'notFound'})
+        else:
+            return jsonify({'error': 'Provide usernames, friendIds or classId'}), 400
+        
+        user_doc = db.collection('Members').document(user_id).get(field_paths=['friends'])
+        if not user_doc.exists:
+            return jsonify({'error': 'User not found'}), 404
+        current_friends = set(user_doc.to_dict().get('friends') or [])
+        
+        candidate_ids = list(dict.fromkeys(candidate_ids))
+        # One batched read confirms which members exist
+        existing = {doc.id for doc in fetch_members([i for i in candidate_ids if i != user_id], member_projection('friend_ids'))}
+        
+        to_write = []
+        for friend_id in candidate_ids:
+            if friend_id == user_id:
+                status = 'self'
+            elif friend_id not in existing:
+                status = 'notFound'
+            elif action == 'add' and friend_id in current_friends:
+                status = 'alreadyFriends'
+            elif action == 'remove' and friend_id not in current_friends:
+                status = 'notFriends'
+            else:
+                status = 'added' if action == 'add' else 'removed'
+                to_write.append(friend_id)
+            results.append({'friendId': friend_id, 'status': status})
+        
+        # Each batch holds the user's own update plus one update per friend
+        chunk_size = BATCH_WRITE_LIMIT - 1
+        for i in range(0, len(to_write), chunk_size):
+            batch = db.batch()
+            (befriend if action == 'add' else unfriend)(batch, user_id, to_write[i:i + chunk_size])
+            batch.commit()
+        document_cache.invalidate('Members', user_id, *to_write)
+        
+        return jsonify({'results': results, 'changed': len(to_write)})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Add a specific route for adding a channel to a class
 @firebase_routes.route('/Classes/<class_id>/channels', methods=['POST'])
 def add_channel_to_class(class_id):
-    """Add a new channel object to the channels array of a specific class."""
+    """Add a new channel to a class (stored in Classes/<class_id>/channels)."""
     try:
         channel_data = request.get_json()
         if not channel_data:
@@ -519,16 +954,9 @@ def add_channel_to_class(class_id):
         if 'name' not in channel_data or not channel_data['name']:
             return jsonify({"error": "Channel name is required"}), 400
 
-        # Get the class document reference
+        # Generate a unique ID for the channel (Firestore's auto-ID)
         class_ref = db.collection('Classes').document(class_id)
-        class_doc = class_ref.get()
-
-        if not class_doc.exists:
-            return jsonify({"error": "Class not found"}), 404
-
-        # Generate a unique ID for the channel (e.g., using Firestore's auto-ID)
-        # Alternatively, could use uuid on the client/server
-        channel_id = db.collection('Classes').document().id # Re-using document() for ID generation
+        channel_id = class_ref.collection('channels').document().id
         
         # Add required fields to the channel data
         channel_data['id'] = channel_id
@@ -536,50 +964,199 @@ def add_channel_to_class(class_id):
         # Assume createdBy should be added (needs user context from request/session)
         # channel_data['createdBy'] = get_current_user_id() # Replace with actual user ID retrieval
         
-        # Use ArrayUnion to add the new channel object to the array
-        class_ref.update({
-            'channels': firestore.ArrayUnion([channel_data]),
-            'updatedAt': firestore.SERVER_TIMESTAMP # Update class timestamp
-        })
+        # One commit: the class timestamp update fails with NotFound for a missing class,
+        # and then the channel is not written either
+        batch = db.batch()
+        batch.update(class_ref, {'updatedAt': firestore.SERVER_TIMESTAMP})
+        put_item(db, 'Classes', class_id, 'channels', channel_data, writer=batch)
+        batch.commit()
 
         # Return the newly added channel data including its ID
         return jsonify({"message": "Channel added successfully", "channel": channel_data}), 201
 
+    except NotFound:
+        return jsonify({"error": "Class not found"}), 404
     except Exception as e:
         print(f"Error adding channel: {e}")
         return jsonify({"error": str(e)}), 500
 
+def message_cursor(since):
+    """
+    The start_after cursor for `since`: the message's snapshot for a message ID,
+    otherwise an ISO 8601 sentAt value as the Timestamp messages are stored with.
+    Raises ValueError for a `since` that is neither.
+    """
+    since_doc = db.collection('Messages').document(since).get()
+    if since_doc.exists:
+        return since_doc
+    return {'sentAt': parse_sent_at(since)}
+
+def query_channel_messages(class_id, channel_id, since=None, limit=MESSAGE_PAGE_SIZE, cursor=None):
+    """
+    Read messages of a channel ordered by sentAt, as JSON-ready dicts.
+
+    With `since` (see message_cursor) or a `cursor` from message_cursor() only
+    later messages are returned; otherwise the most recent `limit` messages.
+    """
+    # Needs a composite index on (classId, channelId, sentAt)
+    messages_query = db.collection('Messages') \
+        .where('classId', '==', class_id) \
+        .where('channelId', '==', channel_id) \
+        .order_by('sentAt')
+
+    if cursor is None and since:
+        cursor = message_cursor(since)
+
+    if cursor is not None:
+        messages_query = messages_query.start_after(cursor).limit(limit)
+    else:
+        messages_query = messages_query.limit_to_last(limit)
+
+    messages = []
+    # get() rather than stream(): Firestore cannot stream limit_to_last() queries
+    for msg in messages_query.get():
+        messages.append(_message_payload(msg.id, msg.to_dict()))
+    return messages
+
+def _message_payload(message_id, msg_data):
+    # Convert Firestore timestamp to ISO string for JSON compatibility
+    if isinstance(msg_data.get('sentAt'), datetime):
+         msg_data['sentAt'] = msg_data['sentAt'].isoformat()
+    # Add message ID to the data
+    msg_data['id'] = message_id
+    return msg_data
+
+message_hub = MessageHub(fetch_since=query_channel_messages)
+
+def publish_message(message_id, data):
+    """Push a just-written message to this process's subscribers of its channel"""
+    now = datetime.now(timezone.utc)
+    payload = {
+        key: now if value is firestore.SERVER_TIMESTAMP else value
+        for key, value in data.items()
+    }
+    message_hub.publish(data['classId'], data['channelId'], _message_payload(message_id, payload))
+
 # Route to get messages for a specific channel within a class
 @firebase_routes.route('/Classes/<class_id>/channels/<channel_id>/messages', methods=['GET'])
 def get_channel_messages(class_id, channel_id):
-    """Get all messages for a specific channel, ordered by timestamp."""
+    """
+    Get messages for a specific channel, oldest first.
+
+    Optional query parameters:
+      - since: a message ID or a sentAt value; only messages sent after it are returned
+      - limit: maximum number of messages (default MESSAGE_PAGE_SIZE)
+      - wait: with `since`, seconds to wait for a new message when there are none
+        yet (long-poll fallback for clients without EventSource)
+    Without `since`, the most recent `limit` messages are returned.
+    """
     try:
-        messages_query = db.collection('Messages') \
-            .where('classId', '==', class_id) \
-            .where('channelId', '==', channel_id) \
-            .stream()
-
-        messages = []
-        for msg in messages_query:
-            msg_data = msg.to_dict()
-            # Convert Firestore timestamp to ISO string for JSON compatibility
-            if isinstance(msg_data.get('sentAt'), datetime):
-                 msg_data['sentAt'] = msg_data['sentAt'].isoformat()
-            # Add message ID to the data
-            msg_data['id'] = msg.id 
-            messages.append(msg_data)
+        try:
+            limit = int(request.args.get('limit', MESSAGE_PAGE_SIZE))
+            wait = min(float(request.args.get('wait', 0)), MAX_LONG_POLL_SECONDS)
+        except ValueError:
+            return jsonify({"error": "limit and wait must be numbers"}), 400
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+
+        since = request.args.get('since')
+        try:
+            cursor = message_cursor(since) if since else None
+        except ValueError:
+            return jsonify({"error": "since must be a message ID or an ISO 8601 time"}), 400
+        if not since or wait <= 0:
+            return jsonify(query_channel_messages(class_id, channel_id, limit=limit, cursor=cursor)), 200
+        if not open_stream_slots.acquire(blocking=False):
+            # Too many connections waiting already: answer now and ask the client to back off
+            response = jsonify(query_channel_messages(class_id, channel_id, limit=limit, cursor=cursor))
+            response.headers['Retry-After'] = str(STREAM_RETRY_AFTER_SECONDS)
+            return response, 200
 
+        try:
+            # Subscribe before reading so nothing published in between is missed
+            hub, subscription = message_hub.subscribe(class_id, channel_id, last_id=since)
+            try:
+                messages = query_channel_messages(class_id, channel_id, limit=limit, cursor=cursor)
+                if not messages:
+                    try:
+                        messages = [subscription.get(timeout=wait)]
+                    except queue.Empty:
+                        messages = []
+            finally:
+                message_hub.unsubscribe(hub, subscription)
+        finally:
+            open_stream_slots.release()
         return jsonify(messages), 200
 
     except Exception as e:
         print(f"Error fetching messages for channel {channel_id}: {e}")
         return jsonify({"error": str(e)}), 500
 
+@firebase_routes.route('/Classes/<class_id>/channels/<channel_id>/stream', methods=['GET'])
+def stream_channel_messages(class_id, channel_id):
+    """
+    Server-Sent Events stream of new messages in a channel.
+
+    Each event carries one message as JSON with the message ID as the event ID,
+    so a reconnecting EventSource resumes from Last-Event-ID. The stream ends
+    after SSE_MAX_SECONDS to release the worker; browsers reconnect on their own.
+    Past MAX_OPEN_STREAMS the answer is a 503, and class.js falls back to polling.
+    """
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        cursor = message_cursor(since) if since else None
+    except ValueError:
+        return jsonify({"error": "since must be a message ID or an ISO 8601 time"}), 400
+    except Exception as e:
+        print(f"Error opening message stream for channel {channel_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    if not open_stream_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many open message streams, try again later"})
+        response.headers['Retry-After'] = str(STREAM_RETRY_AFTER_SECONDS)
+        return response, 503
+    try:
+        hub, subscription = message_hub.subscribe(class_id, channel_id, last_id=since)
+        backlog = query_channel_messages(class_id, channel_id, cursor=cursor) if since else []
+    except Exception as e:
+        open_stream_slots.release()
+        print(f"Error opening message stream for channel {channel_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    json_provider = current_app.json
+
+    def event(msg):
+        return f"id: {msg['id']}\nevent: message\ndata: {json_provider.dumps(msg)}\n\n"
+
+    def generate():
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        for msg in backlog:
+            yield event(msg)
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                msg = subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                continue
+            yield event(msg)
+
+    def close():
+        # Runs even when the client left before the body started, unlike a finally in generate()
+        message_hub.unsubscribe(hub, subscription)
+        open_stream_slots.release()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.call_on_close(close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # --- Assignments Routes --- 
 
 @firebase_routes.route('/Assignments', methods=['GET'])
 def get_assignments():
-    """Get assignments, optionally filtered by classId."""
+    """Get assignments, optionally filtered by classId and paged like get_all (limit, orderBy, startAfter)."""
     try:
         class_id = request.args.get('classId')
         
@@ -587,8 +1164,10 @@ def get_assignments():
         if class_id:
             query = query.where('classId', '==', class_id)
         
-        # Add ordering if needed, e.g., by dueDate
-        # query = query.order_by('dueDate', direction=firestore.Query.ASCENDING)
+        # e.g. ?orderBy=dueDate&limit=50
+        query, error = apply_page_args(query, 'Assignments')
+        if error:
+            return error
         
         docs = query.stream()
         assignments = []
@@ -614,7 +1193,7 @@ def get_assignments():
 
 @firebase_routes.route('/Events', methods=['GET'])
 def get_events():
-    """Get events, optionally filtered by classId."""
+    """Get events, optionally filtered by classId and paged like get_all (limit, orderBy, startAfter)."""
     try:
         class_id = request.args.get('classId')
         
@@ -622,8 +1201,10 @@ def get_events():
         if class_id:
             query = query.where('classId', '==', class_id)
         
-        # Add ordering if needed, e.g., by startDate
-        # query = query.order_by('startDate', direction=firestore.Query.ASCENDING)
+        # e.g. ?orderBy=startDate&limit=50
+        query, error = apply_page_args(query, 'Events')
+        if error:
+            return error
 
         docs = query.stream()
         events = []
@@ -647,11 +1228,11 @@ def get_events():
 # POST route for Events is already covered by the generic POST /<collection>
 # Ensure 'classId' is included in the JSON body when calling POST /Events
 
-# --- Units Route (Specific POST for adding to Class array) ---
+# --- Units Route (Specific POST for adding a unit to a Class) ---
 
 @firebase_routes.route('/Classes/<class_id>/units', methods=['POST'])
 def add_unit_to_class(class_id):
-    """Add a new unit object to the units array of a specific class."""
+    """Add a new unit to a class (stored in Classes/<class_id>/units)."""
     try:
         unit_data = request.get_json()
         if not unit_data:
@@ -660,14 +1241,9 @@ def add_unit_to_class(class_id):
         if 'title' not in unit_data or not unit_data['title']:
             return jsonify({"error": "Unit title is required"}), 400
             
-        class_ref = db.collection('Classes').document(class_id)
-        class_doc = class_ref.get()
-        
-        if not class_doc.exists:
-             return jsonify({"error": "Class not found"}), 404
-             
         # Generate ID, add timestamps etc.
-        unit_id = db.collection('Classes').document().id # Generate unique ID
+        class_ref = db.collection('Classes').document(class_id)
+        unit_id = class_ref.collection('units').document().id # Generate unique ID
         unit_data['id'] = unit_id
         unit_data['createdAt'] = datetime.now().isoformat() # Client-side timestamp is fine here too
         unit_data['updatedAt'] = datetime.now().isoformat()
@@ -678,14 +1254,16 @@ def add_unit_to_class(class_id):
         unit_data.setdefault('associatedFiles', [])
         unit_data.setdefault('associatedProblems', [])
         
-        # Add to the units array
-        class_ref.update({
-            'units': firestore.ArrayUnion([unit_data]),
-            'updatedAt': firestore.SERVER_TIMESTAMP
-        })
+        # One commit that fails with NotFound when the class does not exist
+        batch = db.batch()
+        batch.update(class_ref, {'updatedAt': firestore.SERVER_TIMESTAMP})
+        put_item(db, 'Classes', class_id, 'units', unit_data, writer=batch)
+        batch.commit()
         
         return jsonify({"message": "Unit added successfully", "unit": unit_data}), 201
         
+    except NotFound:
+        return jsonify({"error": "Class not found"}), 404
     except Exception as e:
          print(f"Error adding unit: {e}")
          return jsonify({"error": str(e)}), 500
@@ -0,0 +1,229 @@
+"""
+Vectorized grade computations over gradebook snapshots (see gradebook.py).
+
+All assignments of one or more snapshots are flattened into NumPy arrays so that
+category averages and course grades for every course (or a whole cohort) come
+out of a few bincount calls:
+
+  - category average = the grade Jupiter reports for the category, or
+    100 * earned / possible over its graded assignments when it reports none
+  - course grade = weighted mean of the category averages, re-normalized over
+    the categories that have grades (Jupiter's own formula, e.g. a final exam
+    category with no grades yet does not count)
+
+Jupiter's category grades are authoritative: the assignment list does not always
+carry everything a teacher counts. what_if() therefore adds hypothetical points
+on top of the reported average, weighted by the points listed so far.
+trend_series() reconstructs the course grade after each due date from the
+listed assignments alone.
+"""
+import numpy as np
+
+
+def _due_key(due):
+    """Sortable key for Jupiter's "M/D" due dates; the school year runs August to July"""
+    try:
+        month, day = (int(part) for part in str(due).split('/')[:2])
+    except ValueError:
+        return 0
+    return (month - 8) % 12 * 100 + day
+
+
+class GradeFrame:
+    """Flat arrays describing the courses, categories and graded assignments of snapshots."""
+
+    def __init__(self, snapshots, extra_assignments=None):
+        self.courses = []          # (snapshot index, course dict)
+        category_course = []
+        category_weight = []
+        category_reported = []
+        self.category_names = []
+        assignment_category = []
+        earned = []
+        possible = []
+        due = []
+        hypothetical = []
+        category_index = {}
+
+        for snapshot_index, snapshot in enumerate(snapshots):
+            for course in snapshot.get('courses', []):
+                course_index = len(self.courses)
+                self.courses.append((snapshot_index, course))
+                for category in course.get('categories', []):
+                    category_index[(course_index, category['name'])] = len(category_course)
+                    category_course.append(course_index)
+                    category_weight.append(category.get('weight') or 0.0)
+                    reported = category.get('grade')
+                    category_reported.append(np.nan if reported is None else reported)
+                    self.category_names.append(category['name'])
+                extra = (extra_assignments or {}).get((snapshot_index, course['name']), [])
+                assignments = [(a, False) for a in course.get('assignments', [])] + [(a, True) for a in extra]
+                for assignment, is_extra in assignments:
+                    index = category_index.get((course_index, assignment.get('category')))
+                    score, points = assignment.get('score'), assignment.get('points')
+                    # Ungraded work and assignments outside the course's categories do not count
+                    if index is None or score is None or points is None or assignment.get('graded') is False:
+                        continue
+                    assignment_category.append(index)
+                    earned.append(score)
+                    possible.append(points)
+                    due.append(_due_key(assignment.get('due')))
+                    hypothetical.append(is_extra)
+
+        self.category_course = np.array(category_course, dtype=np.intp)
+        self.category_weight = np.array(category_weight, dtype=float)
+        self.category_reported = np.array(category_reported, dtype=float)
+        self.assignment_category = np.array(assignment_category, dtype=np.intp)
+        self.earned = np.array(earned, dtype=float)
+        self.possible = np.array(possible, dtype=float)
+        self.due = np.array(due, dtype=np.int64)
+        self.hypothetical = np.array(hypothetical, dtype=bool)
+
+    @property
+    def course_count(self):
+        return len(self.courses)
+
+    @property
+    def category_count(self):
+        return len(self.category_course)
+
+    def _bincount(self, values, mask):
+        return np.bincount(self.assignment_category[mask], weights=values[mask], minlength=self.category_count)
+
+    def category_totals(self, from_assignments=False):
+        """
+        Earned and possible points per category. Unless from_assignments, earned points
+        of the listed assignments are scaled to match the reported category grade.
+        """
+        listed = ~self.hypothetical
+        earned = self._bincount(self.earned, listed)
+        possible = self._bincount(self.possible, listed)
+        if not from_assignments:
+            reported = ~np.isnan(self.category_reported) & (possible > 0)
+            earned = np.where(reported, self.category_reported / 100.0 * possible, earned)
+        earned += self._bincount(self.earned, self.hypothetical)
+        possible += self._bincount(self.possible, self.hypothetical)
+        return earned, possible
+
+    def category_averages(self, from_assignments=False):
+        earned, possible = self.category_totals(from_assignments)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            averages = np.where(possible > 0, 100.0 * earned / possible, np.nan)
+        if not from_assignments:
+            # A reported grade without listed assignments (e.g. a midyear exam) still counts
+            averages = np.where(np.isnan(averages), self.category_reported, averages)
+        return averages
+
+    def course_grades(self, averages=None):
+        """Weighted course grades; NaN for courses with no graded work"""
+        if averages is None:
+            averages = self.category_averages()
+        graded = ~np.isnan(averages)
+        weights = np.where(graded, self.category_weight, 0.0)
+        weighted = np.bincount(self.category_course, weights=np.where(graded, averages, 0.0) * weights,
+                               minlength=self.course_count)
+        total_weight = np.bincount(self.category_course, weights=weights, minlength=self.course_count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total_weight > 0, weighted / total_weight, np.nan)
+
+
+def _number(value, digits=2):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def analyze(snapshots):
+    """Category averages and computed grades for every course of every snapshot"""
+    frame = GradeFrame(snapshots)
+    earned, possible = frame.category_totals(from_assignments=True)
+    averages = frame.category_averages()
+    grades = frame.course_grades(averages)
+
+    results = [{"courses": []} for _ in snapshots]
+    categories_by_course = [[] for _ in range(frame.course_count)]
+    for index in range(frame.category_count):
+        categories_by_course[frame.category_course[index]].append({
+            "name": frame.category_names[index],
+            "weight": float(frame.category_weight[index]),
+            "average": _number(averages[index]),
+            "earned": float(earned[index]),
+            "possible": float(possible[index])
+        })
+    for course_index, (snapshot_index, course) in enumerate(frame.courses):
+        results[snapshot_index]["courses"].append({
+            "name": course['name'],
+            "grade": _number(grades[course_index]),
+            "reportedGrade": course.get('grade'),
+            "categories": categories_by_course[course_index]
+        })
+    for result in results:
+        course_grades = [c['grade'] for c in result['courses'] if c['grade'] is not None]
+        result["average"] = round(float(np.mean(course_grades)), 2) if course_grades else None
+    return results
+
+
+def what_if(snapshot, hypothetical):
+    """
+    Project course grades with hypothetical scores added.
+
+    hypothetical is a list of {course, category, score, points}. Returns one entry per
+    affected course with its current and projected grade.
+    """
+    extra = {}
+    for assignment in hypothetical:
+        extra.setdefault((0, assignment['course']), []).append(dict(assignment, graded=True))
+    current = GradeFrame([snapshot]).course_grades()
+    projected_frame = GradeFrame([snapshot], extra)
+    projected = projected_frame.course_grades()
+
+    projections = []
+    for course_index, (_, course) in enumerate(projected_frame.courses):
+        if (0, course['name']) not in extra:
+            continue
+        projections.append({
+            "course": course['name'],
+            "current": _number(current[course_index]),
+            "projected": _number(projected[course_index]),
+            "delta": _number(projected[course_index] - current[course_index])
+        })
+    return projections
+
+
+def trend_series(snapshot):
+    """Course grade after each due date, per course: {course name: [{due, grade}]}"""
+    frame = GradeFrame([snapshot])
+    series = {course['name']: [] for _, course in frame.courses}
+    if not len(frame.earned):
+        return series
+
+    # Running earned/possible per category in due-date order: one row per graded assignment
+    order = np.lexsort((frame.due, frame.category_course[frame.assignment_category]))
+    categories = frame.assignment_category[order]
+    rows = np.arange(len(order))
+    earned = np.zeros((len(order), frame.category_count))
+    possible = np.zeros((len(order), frame.category_count))
+    earned[rows, categories] = frame.earned[order]
+    possible[rows, categories] = frame.possible[order]
+    # Categories belong to a single course, so a cumulative sum over all rows stays per course
+    earned = np.cumsum(earned, axis=0)
+    possible = np.cumsum(possible, axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = np.where(possible > 0, 100.0 * earned / possible, np.nan)
+    row_course = frame.category_course[categories]
+    in_course = frame.category_course[np.newaxis, :] == row_course[:, np.newaxis]
+    weights = np.where(in_course & ~np.isnan(averages), frame.category_weight, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grades = np.nansum(np.where(weights > 0, averages, 0.0) * weights, axis=1) / weights.sum(axis=1)
+
+    due = frame.due[order]
+    # Keep the last row of each (course, due date): the grade once that day's work is in
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (row_course[1:] != row_course[:-1]) | (due[1:] != due[:-1])
+    due_labels = {}
+    for _, course in frame.courses:
+        for assignment in course.get('assignments', []):
+            due_labels.setdefault(_due_key(assignment.get('due')), assignment.get('due'))
+    for row in np.flatnonzero(last):
+        name = frame.courses[row_course[row]][1]['name']
+        series[name].append({"due": due_labels.get(int(due[row])), "grade": _number(grades[row])})
+    return series
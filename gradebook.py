@@ -0,0 +1,256 @@
+"""
+Per-user Jupiter gradebook snapshots.
+
+The Jupiter API returns a student's whole gradebook (every course with its
+categories and assignments) as a JSON string nested inside a JSON response.
+`GradebookStore` parses it once into a snapshot, diffs it against the previous
+snapshot of the same user and keeps the result in the Gradebooks collection,
+so class lists and grade views are served without calling Jupiter. Records read
+from storage are cached in process for SCIWEB_GRADEBOOK_CACHE_TTL seconds
+(default 60) in a bounded LRU, so a refresh made by another worker shows up
+here within that time.
+
+Users whose credentials were submitted to this process are refreshed in the
+background every SCIWEB_GRADEBOOK_REFRESH seconds (default 900) until they have
+not asked for their gradebook for SCIWEB_GRADEBOOK_IDLE seconds (default one
+day). Credentials are only kept in process memory, never in storage.
+"""
+import hashlib
+import html
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from doc_cache import LRUCacheBackend
+from http_client import http_client
+
+JUPITER_API_URL = 'https://jupiterapi-xz43fty7fq-pd.a.run.app/fetchData'
+GRADEBOOK_COLLECTION = 'Gradebooks'
+
+REFRESH_INTERVAL = float(os.environ.get('SCIWEB_GRADEBOOK_REFRESH', 900))
+IDLE_SECONDS = float(os.environ.get('SCIWEB_GRADEBOOK_IDLE', 24 * 3600))
+RECORD_TTL = float(os.environ.get('SCIWEB_GRADEBOOK_CACHE_TTL', 60))
+MAX_CACHED_RECORDS = int(os.environ.get('SCIWEB_GRADEBOOK_CACHE_SIZE', 1000))
+
+
+class GradebookError(Exception):
+    """Jupiter returned something that is not a gradebook."""
+
+
+def fetch_jupiter_payload(osis, password):
+    """Download the raw Jupiter response (raises UpstreamError/GradebookError)"""
+    resp = http_client.get(JUPITER_API_URL, params={'osis': osis, 'password': password})
+    if resp.status_code != 200:
+        raise GradebookError(f"Jupiter API returned HTTP {resp.status_code}")
+    return resp.json()
+
+
+def _text(value):
+    # Jupiter sends HTML-escaped names ("Midyear &amp; Final")
+    return html.unescape(value) if isinstance(value, str) else value
+
+
+def parse_gradebook(payload):
+    """Turn a Jupiter response ({"data": "<json string>"}) into a snapshot dict"""
+    nested_str = payload.get('data') if isinstance(payload, dict) else None
+    if not nested_str:
+        raise GradebookError("Malformed response from Jupiter API")
+    nested = json.loads(nested_str) if isinstance(nested_str, str) else nested_str
+
+    courses = []
+    for course in nested.get('courses', []):
+        schedule = course.get('schedule') or ''
+        courses.append({
+            "name": _text(course.get('name')),
+            "teacher": _text(course.get('teacher')),
+            "period": schedule.split(',')[0] if ',' in schedule else schedule,
+            "schedule": schedule,
+            "grade": course.get('grade'),
+            "categories": [
+                {"name": _text(c.get('name')), "grade": c.get('grade'), "weight": c.get('weight')}
+                for c in course.get('categories', [])
+            ],
+            "assignments": [
+                {
+                    "name": _text(a.get('name')),
+                    "due": a.get('due'),
+                    "category": _text(a.get('category')),
+                    "score": a.get('score'),
+                    "points": a.get('points'),
+                    "graded": a.get('graded', False)
+                }
+                for a in course.get('assignments', [])
+            ]
+        })
+    return {"student": nested.get('name'), "gpa": nested.get('gpa'), "courses": courses}
+
+
+def snapshot_hash(snapshot):
+    encoded = json.dumps(snapshot, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def class_list(snapshot):
+    """The {name, teacher, period} list returned by /ai/fetch_jupiter_data"""
+    return [{"name": c['name'], "teacher": c['teacher'], "period": c['period']} for c in snapshot['courses']]
+
+
+def _assignment_key(assignment):
+    return (assignment.get('name'), assignment.get('due'), assignment.get('category'))
+
+
+def diff_gradebooks(old, new):
+    """What changed between two snapshots (old may be None for the first snapshot)"""
+    old_courses = {c['name']: c for c in (old or {}).get('courses', [])}
+    new_courses = {c['name']: c for c in new.get('courses', [])}
+    changes = {
+        "coursesAdded": [name for name in new_courses if name not in old_courses],
+        "coursesRemoved": [name for name in old_courses if name not in new_courses],
+        "gradeChanges": [],
+        "newAssignments": [],
+        "scoreChanges": [],
+        "removedAssignments": []
+    }
+    if old is None:
+        return changes
+
+    for name, course in new_courses.items():
+        previous = old_courses.get(name)
+        if previous is None:
+            continue
+        if previous.get('grade') != course.get('grade'):
+            changes['gradeChanges'].append({"course": name, "from": previous.get('grade'), "to": course.get('grade')})
+        old_assignments = {_assignment_key(a): a for a in previous.get('assignments', [])}
+        new_assignments = {_assignment_key(a): a for a in course.get('assignments', [])}
+        for key, assignment in new_assignments.items():
+            before = old_assignments.get(key)
+            if before is None:
+                changes['newAssignments'].append(dict(assignment, course=name))
+            elif (before.get('score'), before.get('points'), before.get('graded')) != \
+                    (assignment.get('score'), assignment.get('points'), assignment.get('graded')):
+                changes['scoreChanges'].append({
+                    "course": name, "name": assignment['name'], "due": assignment.get('due'),
+                    "from": before.get('score'), "to": assignment.get('score'), "points": assignment.get('points')
+                })
+        for key, assignment in old_assignments.items():
+            if key not in new_assignments:
+                changes['removedAssignments'].append(dict(assignment, course=name))
+    return changes
+
+
+def has_changes(changes):
+    return any(changes.values())
+
+
+class GradebookStore:
+    """Snapshots keyed by user ID, read from a short-lived cache first and then from storage."""
+
+    def __init__(self, db, fetch_payload=fetch_jupiter_payload, refresh_interval=REFRESH_INTERVAL,
+                 idle_seconds=IDLE_SECONDS, record_ttl=RECORD_TTL, max_records=MAX_CACHED_RECORDS):
+        self.db = db
+        self._fetch_payload = fetch_payload
+        self.refresh_interval = refresh_interval
+        self.idle_seconds = idle_seconds
+        self.record_ttl = record_ttl
+        self._records = LRUCacheBackend(max_records)
+        self._credentials = {}  # user_id -> (osis, password, last requested)
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def get(self, user_id):
+        """Latest record ({snapshot, changes, hash, fetchedAt, changedAt}) or None"""
+        with self._lock:
+            if user_id in self._credentials:
+                # Reading the gradebook keeps its background refresh going
+                osis, password, _ = self._credentials[user_id]
+                self._credentials[user_id] = (osis, password, time.monotonic())
+        return self._load(user_id)
+
+    def _load(self, user_id):
+        record = self._records.get(user_id)
+        if record is not None:
+            return record
+        doc = self.db.collection(GRADEBOOK_COLLECTION).document(user_id).get()
+        if not doc.exists:
+            return None
+        record = doc.to_dict()
+        self._records.set(user_id, record, self.record_ttl)
+        return record
+
+    def knows(self, user_id, osis, password):
+        """Whether these are the credentials this process refreshes the user's gradebook with"""
+        with self._lock:
+            known = self._credentials.get(user_id)
+        return known is not None and known[:2] == (osis, password)
+
+    def is_fresh(self, record):
+        fetched_at = record.get('fetchedAt') if record else None
+        if fetched_at is None:
+            return False
+        return (datetime.now(timezone.utc) - fetched_at).total_seconds() < self.refresh_interval
+
+    def refresh(self, user_id, osis, password):
+        """Fetch from Jupiter now, store the new snapshot and return its record"""
+        snapshot = parse_gradebook(self._fetch_payload(osis, password))
+        self.register(user_id, osis, password)
+        return self.save(user_id, snapshot)
+
+    def save(self, user_id, snapshot):
+        previous = self._load(user_id)
+        now = datetime.now(timezone.utc)
+        digest = snapshot_hash(snapshot)
+        if previous is not None and previous.get('hash') == digest:
+            # Nothing changed: keep the last diff so clients still see what changed most recently
+            record = dict(previous, fetchedAt=now)
+            self.db.collection(GRADEBOOK_COLLECTION).document(user_id).set({"fetchedAt": now}, merge=True)
+        else:
+            changes = diff_gradebooks(previous['snapshot'] if previous else None, snapshot)
+            record = {
+                "userId": user_id,
+                "snapshot": snapshot,
+                "changes": changes,
+                "hash": digest,
+                "fetchedAt": now,
+                "changedAt": now
+            }
+            self.db.collection(GRADEBOOK_COLLECTION).document(user_id).set(record)
+            if previous is not None and has_changes(changes):
+                print(f"Gradebook changed for {user_id}: "
+                      f"{len(changes['newAssignments'])} new, {len(changes['scoreChanges'])} rescored")
+        self._records.set(user_id, record, self.record_ttl)
+        return record
+
+    def register(self, user_id, osis, password):
+        """Keep this user's snapshot refreshed in the background"""
+        with self._lock:
+            self._credentials[user_id] = (osis, password, time.monotonic())
+            if self._refresher is None and self.refresh_interval > 0:
+                self._refresher = threading.Thread(target=self._refresh_loop, daemon=True, name='gradebook-refresh')
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(min(60.0, self.refresh_interval))
+            now = time.monotonic()
+            with self._lock:
+                for user_id, (_, _, last_requested) in list(self._credentials.items()):
+                    if now - last_requested > self.idle_seconds:
+                        del self._credentials[user_id]
+                registered = [(user_id, osis, password) for user_id, (osis, password, _) in self._credentials.items()]
+                if not self._credentials:
+                    self._refresher = None
+                    return
+            for user_id, osis, password in registered:
+                try:
+                    # Storage has the latest fetchedAt, which another worker may have moved on
+                    if self.is_fresh(self._load(user_id)):
+                        continue
+                    self.save(user_id, parse_gradebook(self._fetch_payload(osis, password)))
+                except Exception as e:
+                    print(f"Error refreshing gradebook for {user_id}: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {"snapshots": len(self._records), "refreshing": len(self._credentials)}
@@ -0,0 +1,16 @@
+"""
+Gunicorn settings, read by app.yaml's entrypoint (gunicorn -c gunicorn.conf.py app:app).
+
+Threaded workers: an open SSE message stream or a waiting long-poll holds one
+thread for as long as it is open. firebase_routes caps those at
+SCIWEB_THREADS - SCIWEB_RESERVED_THREADS per worker, so the reserved threads
+always serve normal API requests. With the defaults an instance carries
+2 x (64 - 12) = 104 live channel viewers; past that, viewers fall back to
+polling every STREAM_RETRY_AFTER_SECONDS.
+"""
+import os
+
+bind = f":{os.environ.get('PORT', '8080')}"
+worker_class = 'gthread'
+workers = int(os.environ.get('SCIWEB_WORKERS', 2))
+threads = int(os.environ.get('SCIWEB_THREADS', 64))
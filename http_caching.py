@@ -0,0 +1,112 @@
+"""
+Conditional GETs and browser caching.
+
+  - Document reads (get_one, get_user_profile, and with them the tree load in
+    autosave.js) carry a strong ETag derived from the document's update_time.
+    A request whose If-None-Match matches gets a bodyless 304. The responses are
+    marked `private, no-cache`, so browsers keep them but revalidate every time.
+  - Rendered pages get an ETag hashed from their body, so a repeat visit to an
+    unchanged page is a 304.
+  - url_for('static', ...) adds a content hash (?v=...) to static URLs. A request
+    that carries the current hash is cached for a year as immutable; others
+    (e.g. ES modules imported by relative path) revalidate with Flask's ETag.
+    Assets from a static build (static_assets.py) already have hashed names and
+    their own caching headers, and are left alone.
+"""
+import hashlib
+import os
+import threading
+
+from flask import request
+
+from build_static import BUILD_DIR
+
+# Lifetime of fingerprinted static files
+STATIC_MAX_AGE = int(os.environ.get('SCIWEB_STATIC_MAX_AGE', 365 * 24 * 3600))
+
+
+def document_etag(snapshot, *variant):
+    """
+    Strong ETag for a document read: changes whenever the document is written.
+    `variant` names anything else that shapes the body (collection, projection).
+    """
+    update_time = getattr(snapshot, 'update_time', None)
+    if update_time is None:
+        return None
+    # Firestore timestamps have nanoseconds, which isoformat() leaves out
+    nanos = getattr(update_time, 'nanosecond', 0)
+    raw = '|'.join([*map(str, variant), snapshot.id, update_time.isoformat(), str(nanos)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def conditional_response(response, etag):
+    """Attach an ETag to a document response and answer If-None-Match with 304"""
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.make_conditional(request)
+    return response
+
+
+class StaticFingerprints:
+    """Content hashes of static files, recomputed when a file changes on disk"""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def version(self, filename):
+        path = os.path.join(self.static_folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._hashes.get(filename)
+        if cached and cached[0] == key:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                digest.update(block)
+        version = digest.hexdigest()[:12]
+        with self._lock:
+            self._hashes[filename] = (key, version)
+        return version
+
+
+def init_app(app):
+    """Fingerprint static URLs and set caching headers on static files and pages"""
+    fingerprints = StaticFingerprints(app.static_folder)
+    app.extensions['static_fingerprints'] = fingerprints
+
+    @app.url_defaults
+    def add_static_version(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values \
+                and not values['filename'].startswith(BUILD_DIR + '/'):
+            version = fingerprints.version(values['filename'])
+            if version:
+                values['v'] = version
+
+    @app.after_request
+    def set_caching_headers(response):
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return response
+        if request.endpoint == 'static' and not response.cache_control.immutable:
+            filename = (request.view_args or {}).get('filename')
+            if request.args.get('v') and request.args.get('v') == fingerprints.version(filename):
+                response.cache_control.public = True
+                response.cache_control.max_age = STATIC_MAX_AGE
+                response.cache_control.immutable = True
+                response.cache_control.no_cache = None
+            else:
+                response.cache_control.no_cache = True
+                response.cache_control.max_age = None
+        elif response.mimetype == 'text/html' and not response.is_streamed and not response.get_etag()[0]:
+            # Pages can differ per session, so only the browser may keep them
+            response.add_etag()
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.make_conditional(request)
+        return response
@@ -0,0 +1,210 @@
+"""
+Shared outbound HTTP client.
+
+All calls to third-party HTTP APIs (Jupiter, the OpenAI realtime session
+endpoint) go through `http_client`, which provides:
+  - one pooled keep-alive `requests.Session` per process
+  - explicit connect/read timeouts and an overall deadline per call, so a hung
+    upstream cannot hold a gunicorn thread indefinitely
+  - bounded retries with jittered exponential backoff
+  - a circuit breaker per host: after repeated failures calls fail fast with
+    CircuitOpenError until the cool-down has passed and a trial call succeeds
+
+Connect timeouts are retried for any method, since the request never reached
+the server. Other failures (dropped connections, read timeouts, 429/5xx
+responses) are only retried for idempotent methods.
+
+Configuration (environment variables):
+  - SCIWEB_HTTP_CONNECT_TIMEOUT: seconds to establish a connection (default 3.05)
+  - SCIWEB_HTTP_READ_TIMEOUT: seconds to wait for response data (default 20)
+  - SCIWEB_HTTP_DEADLINE: max seconds for a call including retries (default 30)
+  - SCIWEB_HTTP_RETRIES: retries after the first attempt (default 2)
+"""
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import timed
+
+CONNECT_TIMEOUT = float(os.environ.get('SCIWEB_HTTP_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('SCIWEB_HTTP_READ_TIMEOUT', 20))
+DEADLINE = float(os.environ.get('SCIWEB_HTTP_DEADLINE', 30))
+MAX_RETRIES = int(os.environ.get('SCIWEB_HTTP_RETRIES', 2))
+# Exponential backoff: base * 2^attempt, capped, with full jitter
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 4.0
+# Consecutive failures that open a host's circuit, and seconds before a trial call
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+# Keep-alive connections kept per host
+POOL_SIZE = 20
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+def _describe(error):
+    # requests errors embed the full URL, and query strings can carry credentials
+    return error if isinstance(error, str) else type(error).__name__
+
+
+class UpstreamError(Exception):
+    """An outbound call failed after its retries."""
+
+
+class CircuitOpenError(UpstreamError):
+    """Calls to this host are being short-circuited after repeated failures."""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"{host} is unavailable, retry in {retry_after:.0f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def allow(self):
+        """Whether a call may proceed; in half-open state only one trial call at a time"""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.threshold:
+                # A failed trial call restarts the cool-down
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class HttpClient:
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 deadline=DEADLINE, max_retries=MAX_RETRIES):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker()
+            return self._breakers[host]
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+    def request(self, method, url, timeout=None, deadline=None, **kwargs):
+        """
+        Send a request and return the `requests.Response` of the first attempt that
+        did not fail. 429/5xx responses that are not retried (or still fail on the last
+        attempt) are returned to the caller as-is. Raises CircuitOpenError when the
+        host is short-circuited and UpstreamError when every attempt failed.
+        """
+        method = method.upper()
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        if not breaker.allow():
+            raise CircuitOpenError(host, breaker.retry_after())
+
+        give_up_at = time.monotonic() + (deadline or self.deadline)
+        idempotent = method in IDEMPOTENT_METHODS
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            last_response = None
+            # Later attempts only get the time that is left before the deadline
+            remaining = max(0.1, give_up_at - time.monotonic())
+            attempt_timeout = timeout or (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+            try:
+                with timed('http'):
+                    response = self.session.request(method, url, timeout=attempt_timeout, **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                last_response = response
+                last_error = f"HTTP {response.status_code}"
+                retryable = idempotent
+            except requests.exceptions.ConnectTimeout as e:
+                last_error = e
+                retryable = True
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                last_error = e
+                retryable = idempotent
+            except requests.exceptions.RequestException as e:
+                breaker.record_failure()
+                raise UpstreamError(f"Request to {host} failed: {_describe(e)}") from e
+
+            delay = self._backoff(attempt)
+            if not retryable or attempt == self.max_retries or time.monotonic() + delay >= give_up_at:
+                break
+            print(f"Retrying {method} {host} in {delay:.2f}s after: {_describe(last_error)}")
+            time.sleep(delay)
+
+        breaker.record_failure()
+        if last_response is not None:
+            return last_response
+        raise UpstreamError(f"Request to {host} failed: {_describe(last_error)}")
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            host: {"state": breaker.state, "failures": breaker.failures, "retryAfter": round(breaker.retry_after(), 1)}
+            for host, breaker in breakers.items()
+        }
+
+
+http_client = HttpClient()
@@ -0,0 +1,279 @@
+"""
+Unique lookup indexes for Members.
+
+Each indexed field has a key collection whose document IDs are the normalized
+values (Emails/<email>, Usernames/<username>) and whose documents point at the
+member ({"userId": ...}). Index entries are written in the same transaction as
+the member document, so two indexed accounts can never claim the same email or
+username, and login or adding a friend is a keyed get instead of a query.
+
+Resolved keys are kept in a small in-process cache. Every hit is checked against
+the member document it points to, so an entry made stale by a rename in another
+worker is dropped instead of returning the wrong member.
+
+Members created before the index existed are only covered once they have an
+entry. Run `python backfill_member_index.py` once to index all of them (it stops
+on duplicates for manual cleanup), then set SCIWEB_MEMBER_INDEX_BACKFILLED=1.
+Until then:
+  - a lookup that misses the index falls back to the old exact-match query and
+    indexes the member it finds
+  - a new claim is also checked against Members with the value as typed and
+    lowercased, which misses legacy values stored in other case
+"""
+import os
+from urllib.parse import quote
+
+from google.api_core.exceptions import AlreadyExists, NotFound
+from firebase_admin import firestore
+
+from datastore import run_transaction
+from doc_cache import LRUCacheBackend
+
+INDEXED_FIELDS = {'email': 'Emails', 'username': 'Usernames'}
+CACHE_TTL = float(os.environ.get('SCIWEB_INDEX_CACHE_TTL', 300))
+# Set to 1 once backfill_member_index.py has indexed every existing member
+INDEX_BACKFILLED = os.environ.get('SCIWEB_MEMBER_INDEX_BACKFILLED', '0') == '1'
+# Index entries written per batch by backfill()
+BACKFILL_BATCH_SIZE = 500
+
+
+class IndexConflict(Exception):
+    """The email or username is already taken by another member."""
+
+    def __init__(self, field):
+        super().__init__(f"That {field or 'email or username'} is already taken")
+        self.field = field
+
+
+def normalize(value):
+    return value.strip().lower() if isinstance(value, str) else None
+
+
+def index_key(value):
+    """Document ID for a normalized value: '/' is not allowed in IDs, nor are '.' and '..'"""
+    key = quote(value, safe="@+")
+    return key if key not in ('.', '..') else quote(key, safe='')
+
+
+class MemberIndex:
+    def __init__(self, db, cache_ttl=CACHE_TTL, check_legacy=not INDEX_BACKFILLED):
+        self.db = db
+        self.cache_ttl = cache_ttl
+        self.check_legacy = check_legacy
+        self._cache = LRUCacheBackend()
+
+    def _ref(self, field, value):
+        return self.db.collection(INDEXED_FIELDS[field]).document(index_key(value))
+
+    def _cache_key(self, field, value):
+        return f"{field}:{value}"
+
+    def lookup(self, field, value):
+        """Member ID for an email/username, or None"""
+        key = normalize(value)
+        if not key:
+            return None
+        cached = self._cache.get(self._cache_key(field, key))
+        if cached is not None:
+            return cached
+        doc = self._ref(field, key).get()
+        user_id = doc.get('userId') if doc.exists else self._backfill(field, value.strip(), key)
+        if user_id:
+            self._cache.set(self._cache_key(field, key), user_id, self.cache_ttl)
+        return user_id
+
+    def _backfill(self, field, value, key):
+        # Members created before the index: find them once by the old query and index them
+        results = list(self.db.collection('Members').where(field, '==', value).limit(1).stream())
+        if not results:
+            return None
+        user_id = results[0].id
+        try:
+            self._ref(field, key).create({'userId': user_id, 'createdAt': firestore.SERVER_TIMESTAMP})
+        except AlreadyExists:
+            pass
+        return user_id
+
+    def _claimed_by_legacy(self, field, value, key, user_id=None):
+        """Whether a member other than user_id stores this value without an index entry yet"""
+        if not self.check_legacy:
+            return False
+        for candidate in dict.fromkeys([value.strip(), key]):
+            for doc in self.db.collection('Members').where(field, '==', candidate).select([field]).limit(2).stream():
+                if doc.id != user_id:
+                    return True
+        return False
+
+    def find_member(self, field, value, field_paths=None):
+        """Snapshot of the member with this email/username, or None"""
+        for _ in range(2):
+            user_id = self.lookup(field, value)
+            if user_id is None:
+                return None
+            paths = None if field_paths is None else list(dict.fromkeys(list(field_paths) + [field]))
+            doc = self.db.collection('Members').document(user_id).get(field_paths=paths)
+            # DocumentSnapshot.get() raises KeyError for a field the document lacks
+            if doc.exists and normalize((doc.to_dict() or {}).get(field)) == normalize(value):
+                return doc
+            # Stale cache entry (renamed or deleted in another worker): retry from storage
+            self.forget(field, value)
+        return None
+
+    def forget(self, field, *values):
+        for value in values:
+            if normalize(value):
+                self._cache.delete(self._cache_key(field, normalize(value)))
+
+    def _entries(self, data):
+        return {field: normalize(data.get(field)) for field in INDEXED_FIELDS if normalize(data.get(field))}
+
+    def create_member(self, data):
+        """Create a member document and its index entries atomically; returns the new ID"""
+        member_ref = self.db.collection('Members').document()
+        entries = self._entries(data)
+        # New members are always indexed, so only pre-index members can race with this check
+        for field, value in entries.items():
+            if self._claimed_by_legacy(field, data[field], value):
+                raise IndexConflict(field)
+
+        def create_in_transaction(transaction):
+            for field, value in entries.items():
+                if self._ref(field, value).get(transaction=transaction).exists:
+                    raise IndexConflict(field)
+            transaction.set(member_ref, data)
+            for field, value in entries.items():
+                transaction.create(self._ref(field, value), {'userId': member_ref.id, 'createdAt': firestore.SERVER_TIMESTAMP})
+
+        try:
+            run_transaction(self.db, create_in_transaction)
+        except AlreadyExists:
+            # Claimed by a concurrent signup between our read and the commit
+            raise IndexConflict(None)
+        return member_ref.id
+
+    def update_member(self, user_id, data, replace=False):
+        """
+        Update (or with replace, overwrite) a member and move its index entries when
+        the email or username changes. Raises NotFound for a missing member unless
+        replacing, and IndexConflict when a new value belongs to someone else.
+        """
+        member_ref = self.db.collection('Members').document(user_id)
+        touched = [field for field in INDEXED_FIELDS if replace or field in data]
+        if not touched:
+            # Nothing indexed changes: update() itself fails with NotFound for a missing member
+            member_ref.update(data)
+            return
+        for field in touched:
+            new = normalize(data.get(field))
+            if new and self._claimed_by_legacy(field, data[field], new, user_id):
+                raise IndexConflict(field)
+        old_values = {}
+
+        def update_in_transaction(transaction):
+            member = member_ref.get(transaction=transaction)
+            if not member.exists and not replace:
+                raise NotFound(f"Member {user_id} not found")
+            current = member.to_dict() if member.exists else {}
+            changes = {}
+            for field in touched:
+                old, new = normalize(current.get(field)), normalize(data.get(field))
+                if old != new:
+                    changes[field] = (old, new)
+            owned_old = set()
+            for field, (old, new) in changes.items():
+                if new:
+                    claimed = self._ref(field, new).get(transaction=transaction)
+                    if claimed.exists and claimed.get('userId') != user_id:
+                        raise IndexConflict(field)
+                if old:
+                    entry = self._ref(field, old).get(transaction=transaction)
+                    if entry.exists and entry.get('userId') == user_id:
+                        owned_old.add(field)
+            if replace:
+                transaction.set(member_ref, data)
+            else:
+                transaction.update(member_ref, data)
+            for field, (old, new) in changes.items():
+                if field in owned_old:
+                    transaction.delete(self._ref(field, old))
+                if new:
+                    transaction.set(self._ref(field, new), {'userId': user_id, 'createdAt': firestore.SERVER_TIMESTAMP})
+                old_values[field] = old
+
+        run_transaction(self.db, update_in_transaction)
+        for field, old in old_values.items():
+            self.forget(field, old)
+
+    def delete_member(self, user_id):
+        """Delete a member and the index entries that point at it"""
+        member_ref = self.db.collection('Members').document(user_id)
+        old_values = {}
+
+        def delete_in_transaction(transaction):
+            member = member_ref.get(transaction=transaction)
+            if not member.exists:
+                raise NotFound(f"Member {user_id} not found")
+            entries = self._entries(member.to_dict())
+            owned = {}
+            for field, value in entries.items():
+                entry = self._ref(field, value).get(transaction=transaction)
+                if entry.exists and entry.get('userId') == user_id:
+                    owned[field] = value
+            transaction.delete(member_ref)
+            for field, value in owned.items():
+                transaction.delete(self._ref(field, value))
+            old_values.update(entries)
+
+        run_transaction(self.db, delete_in_transaction)
+        for field, value in old_values.items():
+            self.forget(field, value)
+
+    def backfill(self, dry_run=False):
+        """
+        Index every member that has no entry yet. Nothing is written when two
+        members share a normalized email/username or an entry points at another
+        member; those come back as conflicts to resolve by hand.
+        Returns {"members", "indexed", "missing", "conflicts"}.
+        """
+        owners = {}  # (field, key) -> member IDs with that normalized value
+        members = 0
+        for doc in self.db.collection('Members').select(list(INDEXED_FIELDS)).stream():
+            members += 1
+            for field, key in self._entries(doc.to_dict() or {}).items():
+                owners.setdefault((field, key), []).append(doc.id)
+
+        conflicts = [
+            {"field": field, "value": key, "userIds": user_ids}
+            for (field, key), user_ids in owners.items() if len(user_ids) > 1
+        ]
+        missing = []
+        for field in INDEXED_FIELDS:
+            keys = [key for (owner_field, key), user_ids in owners.items() if owner_field == field and len(user_ids) == 1]
+            for start in range(0, len(keys), BACKFILL_BATCH_SIZE):
+                chunk = keys[start:start + BACKFILL_BATCH_SIZE]
+                entries = {doc.id: doc for doc in self.db.get_all([self._ref(field, key) for key in chunk])}
+                for key in chunk:
+                    user_id = owners[(field, key)][0]
+                    entry = entries.get(index_key(key))
+                    if entry is None or not entry.exists:
+                        missing.append((field, key, user_id))
+                    elif (entry.to_dict() or {}).get('userId') != user_id:
+                        conflicts.append({"field": field, "value": key,
+                                          "userIds": [user_id, (entry.to_dict() or {}).get('userId')]})
+
+        result = {"members": members, "indexed": 0, "missing": len(missing), "conflicts": conflicts}
+        if conflicts or dry_run:
+            return result
+        for start in range(0, len(missing), BACKFILL_BATCH_SIZE):
+            batch = self.db.batch()
+            for field, key, user_id in missing[start:start + BACKFILL_BATCH_SIZE]:
+                batch.create(self._ref(field, key), {'userId': user_id, 'createdAt': firestore.SERVER_TIMESTAMP})
+            try:
+                batch.commit()
+            except AlreadyExists:
+                # Claimed by a signup since the scan: rerun to see who holds it
+                result["conflicts"].append({"field": None, "value": None, "userIds": [],
+                                            "error": "an entry was claimed during the backfill; run it again"})
+                return result
+            result["indexed"] += len(missing[start:start + BACKFILL_BATCH_SIZE])
+        return result
@@ -0,0 +1,160 @@
+"""
+In-process fan-out of class channel messages.
+
+Every browser viewing a channel subscribes to that channel's ChannelHub instead
+of polling storage on its own. A hub is fed from two places:
+  - POST /api/Messages handled by this process publishes the new message directly
+  - while a hub has subscribers, one background thread per hub reads messages
+    newer than the last one it has seen, so messages written through other
+    gunicorn workers still reach this worker's subscribers
+
+Either way one storage read (or one write) is broadcast to all subscribers of
+the channel in this process. Hubs are dropped once their last subscriber leaves.
+A hub whose first subscriber gave no position starts after the newest stored
+message, so subscribers only get messages sent after they joined.
+"""
+import queue
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+# Seconds between storage reads of a hub's background poller
+POLL_INTERVAL = 3.0
+# Recently delivered message IDs remembered per hub to drop duplicates
+RECENT_IDS = 500
+# Messages buffered per subscriber before the slowest ones start losing messages
+SUBSCRIBER_QUEUE_SIZE = 200
+
+
+def parse_sent_at(value):
+    """
+    An ISO 8601 sentAt string as an aware datetime (naive values are UTC), so it
+    orders against the Timestamps messages are stored with. Raises ValueError.
+    """
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class ChannelHub:
+    def __init__(self, class_id, channel_id, fetch_since, poll_interval=POLL_INTERVAL):
+        self.class_id = class_id
+        self.channel_id = channel_id
+        self._fetch_since = fetch_since
+        self._poll_interval = poll_interval
+        self._subscribers = set()
+        self._recent_ids = deque(maxlen=RECENT_IDS)
+        self._last_id = None
+        self._seeded = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._poller = None
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self, last_id=None):
+        subscription = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._last_id is None and last_id:
+                self._last_id = last_id
+                self._seeded = True
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, daemon=True,
+                                                name=f"hub-{self.class_id}-{self.channel_id}")
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            if not self._subscribers:
+                self._wake.set()
+
+    def publish(self, message):
+        """Deliver a message dict (with an 'id') to every subscriber, once."""
+        with self._lock:
+            message_id = message.get('id')
+            if message_id in self._recent_ids:
+                return
+            self._recent_ids.append(message_id)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(message)
+            except queue.Full:
+                # A stalled client; it will catch up from its last event ID on reconnect
+                pass
+
+    def _seed(self):
+        """Start after the newest stored message instead of re-sending the latest page"""
+        latest = self._fetch_since(self.class_id, self.channel_id, None, limit=1)
+        with self._lock:
+            if self._last_id is None and latest:
+                self._last_id = latest[-1].get('id')
+            self._seeded = True
+
+    def _poll(self):
+        first = True
+        while True:
+            if not first:
+                self._wake.wait(self._poll_interval)
+                self._wake.clear()
+            first = False
+            with self._lock:
+                if not self._subscribers:
+                    self._poller = None
+                    return
+                since = self._last_id
+                seeded = self._seeded
+            try:
+                if not seeded:
+                    self._seed()
+                    continue
+                # Only storage reads advance the cursor: a message published locally may
+                # be newer than ones other workers wrote that this hub has not read yet
+                for message in self._fetch_since(self.class_id, self.channel_id, since):
+                    self.publish(message)
+                    with self._lock:
+                        self._last_id = message.get('id')
+            except Exception as e:
+                print(f"Error polling messages for channel {self.channel_id}: {e}")
+
+
+class MessageHub:
+    """Registry of ChannelHubs keyed by (class_id, channel_id)."""
+
+    def __init__(self, fetch_since, poll_interval=POLL_INTERVAL):
+        self._fetch_since = fetch_since
+        self._poll_interval = poll_interval
+        self._hubs = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, class_id, channel_id, last_id=None):
+        with self._lock:
+            hub = self._hubs.get((class_id, channel_id))
+            if hub is None:
+                hub = ChannelHub(class_id, channel_id, self._fetch_since, self._poll_interval)
+                self._hubs[(class_id, channel_id)] = hub
+            return hub, hub.subscribe(last_id)
+
+    def unsubscribe(self, hub, subscription):
+        hub.unsubscribe(subscription)
+        with self._lock:
+            if hub.subscriber_count == 0 and self._hubs.get((hub.class_id, hub.channel_id)) is hub:
+                del self._hubs[(hub.class_id, hub.channel_id)]
+
+    def publish(self, class_id, channel_id, message):
+        with self._lock:
+            hub = self._hubs.get((class_id, channel_id))
+        # Nobody in this process is listening: nothing to do
+        if hub is not None:
+            hub.publish(message)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "channels": len(self._hubs),
+                "subscribers": sum(hub.subscriber_count for hub in self._hubs.values())
+            }
@@ -0,0 +1,363 @@
+"""
+Per-request timing and storage-call instrumentation.
+
+Each request gets a RequestMetrics record (held in a context variable) that
+collects the time spent in:
+
+  - db-read:  document gets and batched get_all() reads
+  - db-query: query stream()/get()
+  - db-write: set/update/create/delete, batch commits and transactions
+  - ai:       OpenAI calls
+  - http:     outbound HTTP attempts made through http_client
+
+The db client from db_init is wrapped in an InstrumentedClient, which times
+every call and forwards everything else to the real client. When the request
+ends the totals are added to a Server-Timing header (after any stages the view
+set itself) and folded into per-route counters served in the Prometheus text
+format at /metrics. A route whose read count grows with its data (N+1 reads)
+shows up as a high ratio of sciweb_calls_total{kind="db-read"} to
+sciweb_requests_total.
+
+Work done on other threads is only counted when it runs through bind() (the
+shared executors do), and reads made while a streamed body is generated, after
+the headers went out, are not counted.
+"""
+import contextvars
+import hmac
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, jsonify, request
+
+# Set SCIWEB_METRICS=0 to turn off the middleware and /metrics
+METRICS_ENABLED = os.environ.get('SCIWEB_METRICS', '1') != '0'
+# Bearer token required by /metrics and the stats endpoints; while unset they answer 404
+METRICS_TOKEN = os.environ.get('SCIWEB_METRICS_TOKEN', '')
+
+# Request duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+KINDS = ('db-read', 'db-query', 'db-write', 'ai', 'http')
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Counts and time per kind of call for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds, documents=0):
+        with self._lock:
+            entry = self.calls.setdefault(kind, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += documents
+
+
+def record(kind, seconds, documents=0):
+    """Add a timed call to the current request (ignored outside a request)"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(kind, seconds, documents)
+
+
+@contextmanager
+def timed(kind, documents=0):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, time.perf_counter() - started, documents)
+
+
+def bind(fn):
+    """Wrap fn so calls on another thread are counted for the request that created it"""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # A Context can only be entered by one thread at a time, so each call gets a copy
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def instrument_method(owner, name, kind):
+    """Time every call of owner.<name> (e.g. an OpenAI client's chat.completions.create)"""
+    method = getattr(owner, name)
+
+    def timed_method(*args, **kwargs):
+        with timed(kind):
+            return method(*args, **kwargs)
+    setattr(owner, name, timed_method)
+
+
+# --- Storage client wrapper ---
+
+def _unwrap(obj):
+    return obj.wrapped if isinstance(obj, _Instrumented) else obj
+
+
+class _Instrumented:
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+def _timed_iter(kind, iterable_factory):
+    """Time a lazy read (stream()/get_all()) over its whole iteration"""
+    started = time.perf_counter()
+    documents = 0
+    try:
+        for item in iterable_factory():
+            documents += 1
+            yield item
+    finally:
+        record(kind, time.perf_counter() - started, documents)
+
+
+class InstrumentedQuery(_Instrumented):
+    """A collection reference or query"""
+
+    def _chain(name):
+        def method(self, *args, **kwargs):
+            return InstrumentedQuery(getattr(self.wrapped, name)(*args, **kwargs))
+        method.__name__ = name
+        return method
+
+    where = _chain('where')
+    order_by = _chain('order_by')
+    limit = _chain('limit')
+    limit_to_last = _chain('limit_to_last')
+    offset = _chain('offset')
+    select = _chain('select')
+    start_at = _chain('start_at')
+    start_after = _chain('start_after')
+    end_before = _chain('end_before')
+    end_at = _chain('end_at')
+    del _chain
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self.wrapped.document(*args, **kwargs))
+
+    def stream(self, *args, **kwargs):
+        return _timed_iter('db-query', lambda: self.wrapped.stream(*args, **kwargs))
+
+    def get(self, *args, **kwargs):
+        return list(_timed_iter('db-query', lambda: self.wrapped.get(*args, **kwargs)))
+
+    def add(self, *args, **kwargs):
+        with timed('db-write', 1):
+            write_time, doc_ref = self.wrapped.add(*args, **kwargs)
+        return write_time, InstrumentedDocument(doc_ref)
+
+
+class InstrumentedDocument(_Instrumented):
+    def get(self, *args, **kwargs):
+        with timed('db-read', 1):
+            return self.wrapped.get(*args, **kwargs)
+
+    def _write(name):
+        def method(self, *args, **kwargs):
+            with timed('db-write', 1):
+                return getattr(self.wrapped, name)(*args, **kwargs)
+        method.__name__ = name
+        return method
+
+    set = _write('set')
+    update = _write('update')
+    create = _write('create')
+    delete = _write('delete')
+    del _write
+
+    def collection(self, name):
+        return InstrumentedQuery(self.wrapped.collection(name))
+
+
+class InstrumentedBatch(_Instrumented):
+    def __init__(self, wrapped):
+        super().__init__(wrapped)
+        self.writes = 0
+
+    def _queue(name):
+        def method(self, reference, *args, **kwargs):
+            self.writes += 1
+            getattr(self.wrapped, name)(_unwrap(reference), *args, **kwargs)
+            return self
+        method.__name__ = name
+        return method
+
+    set = _queue('set')
+    update = _queue('update')
+    create = _queue('create')
+    delete = _queue('delete')
+    del _queue
+
+    def commit(self, *args, **kwargs):
+        with timed('db-write', self.writes):
+            return self.wrapped.commit(*args, **kwargs)
+
+
+class InstrumentedClient(_Instrumented):
+    """
+    Wraps a Firestore (or datastore.LocalClient) client. Transactions run on the
+    real client (see datastore.run_transaction) and are timed as one db-write.
+    """
+
+    def collection(self, name):
+        return InstrumentedQuery(self.wrapped.collection(name))
+
+    def document(self, path):
+        return InstrumentedDocument(self.wrapped.document(path))
+
+    def batch(self):
+        return InstrumentedBatch(self.wrapped.batch())
+
+    def get_all(self, references, *args, **kwargs):
+        references = [_unwrap(reference) for reference in references]
+        return _timed_iter('db-read', lambda: self.wrapped.get_all(references, *args, **kwargs))
+
+    @contextmanager
+    def timed(self, kind):
+        with timed(kind):
+            yield
+
+
+# --- Aggregates and the Flask side ---
+
+class MetricsRegistry:
+    """Per-route totals across requests, rendered in the Prometheus text format"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.requests = {}      # (route, method, status) -> count
+        self.durations = {}     # route -> [bucket counts..., count, sum]
+        self.calls = {}         # (route, kind) -> [calls, seconds, documents]
+
+    def observe(self, route, method, status, seconds, calls):
+        with self._lock:
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.setdefault(route, [0] * len(self.buckets) + [0, 0.0])
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            for kind, (count, total, documents) in calls.items():
+                entry = self.calls.setdefault((route, kind), [0, 0.0, 0])
+                entry[0] += count
+                entry[1] += total
+                entry[2] += documents
+
+    def render(self):
+        with self._lock:
+            requests = dict(self.requests)
+            durations = {route: list(values) for route, values in self.durations.items()}
+            calls = {key: list(values) for key, values in self.calls.items()}
+
+        lines = [
+            '# HELP sciweb_requests_total Requests handled, by route, method and status.',
+            '# TYPE sciweb_requests_total counter',
+        ]
+        for (route, method, status), count in sorted(requests.items()):
+            lines.append(f'sciweb_requests_total{{route="{_escape(route)}",method="{method}",status="{status}"}} {count}')
+
+        lines += [
+            '# HELP sciweb_request_duration_seconds Request wall time, by route.',
+            '# TYPE sciweb_request_duration_seconds histogram',
+        ]
+        for route, histogram in sorted(durations.items()):
+            label = f'route="{_escape(route)}"'
+            for bound, count in zip(self.buckets, histogram):
+                lines.append(f'sciweb_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'sciweb_request_duration_seconds_bucket{{{label},le="+Inf"}} {histogram[-2]}')
+            lines.append(f'sciweb_request_duration_seconds_count{{{label}}} {histogram[-2]}')
+            lines.append(f'sciweb_request_duration_seconds_sum{{{label}}} {histogram[-1]:.6f}')
+
+        for name, index, help_text, metric_type in (
+            ('sciweb_calls_total', 0, 'Storage and outbound calls made by requests, by route and kind.', 'counter'),
+            ('sciweb_call_seconds_total', 1, 'Time spent in those calls, by route and kind.', 'counter'),
+            ('sciweb_db_documents_total', 2, 'Documents read or written by those calls, by route and kind.', 'counter'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+            for (route, kind), values in sorted(calls.items()):
+                if index == 2 and not kind.startswith('db-'):
+                    continue
+                value = f'{values[index]:.6f}' if index == 1 else values[index]
+                lines.append(f'{name}{{route="{_escape(route)}",kind="{kind}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def server_timing_entries(metrics, total):
+    entries = [f'app;dur={total * 1000:.1f}']
+    for kind in KINDS:
+        if kind in metrics.calls:
+            count, seconds, _ = metrics.calls[kind]
+            entries.append(f'{kind};dur={seconds * 1000:.1f};desc="{count} call{"s" if count != 1 else ""}"')
+    return entries
+
+
+registry = MetricsRegistry()
+
+
+def internal_only(view):
+    """Serve a view only to requests with `Authorization: Bearer <SCIWEB_METRICS_TOKEN>`"""
+    def decorated_function(*args, **kwargs):
+        authorization = request.headers.get('Authorization', '')
+        if not METRICS_TOKEN or not hmac.compare_digest(authorization.encode(), f'Bearer {METRICS_TOKEN}'.encode()):
+            return jsonify({"error": "Not found"}), 404
+        return view(*args, **kwargs)
+    decorated_function.__name__ = view.__name__
+    return decorated_function
+
+
+def init_app(app):
+    """Install the timing middleware and the /metrics endpoint"""
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_metrics = RequestMetrics()
+        g.request_metrics_token = _current.set(g.request_metrics)
+
+    @app.after_request
+    def finish_request_metrics(response):
+        metrics = g.pop('request_metrics', None)
+        if metrics is None:
+            return response
+        total = time.perf_counter() - metrics.started
+        entries = server_timing_entries(metrics, total)
+        # Keep stages a view reported itself (e.g. voice_to_nodes) ahead of ours
+        existing = response.headers.get('Server-Timing')
+        response.headers['Server-Timing'] = ', '.join(([existing] if existing else []) + entries)
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        registry.observe(route, request.method, response.status_code, total, metrics.calls)
+        return response
+
+    @app.teardown_request
+    def clear_request_metrics(error=None):
+        token = g.pop('request_metrics_token', None)
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Torn down from another context than the one that started the request
+                _current.set(None)
+
+    @app.route('/metrics')
+    @internal_only
+    def prometheus_metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,50 @@
+"""
+Move legacy arrays (Members.classes, Classes.channels, Classes.units) into their
+keyed subcollections. See class_layout.py.
+
+Usage:
+    python migrate_layout.py [--collection Members|Classes] [--dry-run]
+
+Safe to run while the app is serving and to re-run: reads already merge both
+layouts, entries are written by key, and documents without an array are skipped.
+"""
+import argparse
+
+from class_layout import LAYOUTS, migrate_parent
+from db_init import db, is_firebase_available
+
+
+def migrate(collection=None, dry_run=False):
+    totals = {}
+    for parent_collection, field in LAYOUTS:
+        if collection and parent_collection != collection:
+            continue
+        documents = entries = 0
+        for doc in db.collection(parent_collection).select([field]).stream():
+            legacy = (doc.to_dict() or {}).get(field)
+            if not legacy:
+                continue
+            documents += 1
+            entries += len(legacy) if dry_run else migrate_parent(db, parent_collection, doc.id, field, legacy)
+        totals[f"{parent_collection}.{field}"] = (documents, entries)
+        print(f"{parent_collection}.{field}: {entries} entries in {documents} documents"
+              f"{' would be moved' if dry_run else ' moved'}")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--collection', choices=sorted({parent for parent, _ in LAYOUTS}),
+                        help="only migrate this parent collection")
+    parser.add_argument('--dry-run', action='store_true', help="count entries without writing")
+    args = parser.parse_args()
+
+    if not is_firebase_available():
+        print("Error: no database connection (service_key3.json missing?)")
+        return 1
+    migrate(args.collection, args.dry_run)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
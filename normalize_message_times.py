@@ -0,0 +1,60 @@
+"""
+Convert Messages.sentAt values stored as ISO 8601 strings into Timestamps.
+
+Usage:
+    python normalize_message_times.py [--dry-run]
+
+Channel reads order and page messages by sentAt, and Firestore sorts every
+string after every Timestamp, so messages saved before the server started
+setting sentAt itself would otherwise come after all newer ones. Safe to run
+while the app is serving and to re-run: only string values are rewritten.
+Values that are not valid ISO 8601 are listed and left alone.
+"""
+import argparse
+
+from class_layout import BATCH_WRITE_LIMIT
+from db_init import db, is_firebase_available
+from message_hub import parse_sent_at
+
+
+def normalize(dry_run=False):
+    converted = invalid = 0
+    batch, pending = db.batch(), 0
+    for doc in db.collection('Messages').select(['sentAt']).stream():
+        sent_at = (doc.to_dict() or {}).get('sentAt')
+        if not isinstance(sent_at, str):
+            continue
+        try:
+            timestamp = parse_sent_at(sent_at)
+        except ValueError:
+            invalid += 1
+            print(f"Skipping {doc.id}: sentAt {sent_at!r} is not ISO 8601")
+            continue
+        converted += 1
+        if dry_run:
+            continue
+        batch.update(doc.reference, {'sentAt': timestamp})
+        pending += 1
+        if pending == BATCH_WRITE_LIMIT:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    print(f"{converted} messages{' would be' if dry_run else ''} converted, {invalid} skipped")
+    return converted, invalid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help="count messages without writing")
+    args = parser.parse_args()
+
+    if not is_firebase_available():
+        print("Error: no database connection (service_key3.json missing?)")
+        return 1
+    normalize(args.dry_run)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,53 @@
+"""
+Named field masks for reading Members documents.
+
+Members documents carry growing arrays (classes, friends, friendRequests) that
+most views never show. A projection names the fields a view needs, so reads can
+ask storage for just those fields (`get(field_paths=...)`, `select(...)`) and
+responses never contain more than the view needs:
+
+  - public_card: what other users may see (friends lists, search results)
+  - self_profile: the signed-in user's own profile and settings page
+  - auth_session: the small identity payload behind /api/auth/user
+
+Sensitive fields (password, verification_code) are in none of them.
+"""
+
+
+class Projection:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = list(fields)
+
+    def apply(self, data):
+        """Reduce a full document dict to the projected fields (dotted paths allowed)"""
+        result = {}
+        for field in self.fields:
+            value, parts = data, field.split('.')
+            for part in parts:
+                if not isinstance(value, dict) or part not in value:
+                    break
+                value = value[part]
+            else:
+                target = result
+                for part in parts[:-1]:
+                    target = target.setdefault(part, {})
+                target[parts[-1]] = value
+        return result
+
+
+MEMBER_PROJECTIONS = {
+    projection.name: projection for projection in [
+        Projection('public_card', ['first_name', 'last_name', 'username', 'profilePicUrl', 'bio', 'grade', 'userType']),
+        Projection('self_profile', ['first_name', 'last_name', 'username', 'email', 'profilePicUrl', 'bio', 'grade',
+                                    'userType', 'settings', 'createdAt', 'updatedAt']),
+        Projection('auth_session', ['email', 'first_name', 'last_name', 'username', 'profilePicUrl']),
+        # Just the friend list, to look up friends' public cards
+        Projection('friend_ids', ['friends']),
+    ]
+}
+
+
+def member_projection(name):
+    """Look up a Members projection by name (KeyError if it does not exist)"""
+    return MEMBER_PROJECTIONS[name]
@@ -0,0 +1,103 @@
+"""
+Registry of static prompt context.
+
+Plan documents and node-type definitions are read once at startup instead of on
+every AI request. Keeping the text byte-identical between requests also lets the
+provider reuse its cached prompt prefix. Each asset is hashed and token-counted
+when loaded; when its file changes on disk it is reloaded on the next access
+(checked at most every SCIWEB_PROMPT_RELOAD seconds, default 2, 0 disables).
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from concept_map import count_tokens
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RELOAD_INTERVAL = float(os.environ.get('SCIWEB_PROMPT_RELOAD', 2))
+
+
+class PromptAsset:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.text = ""
+        self.sha256 = hashlib.sha256(b"").hexdigest()
+        self.tokens = 0
+        self.mtime = None
+        self.loaded_at = None
+        self.checked_at = 0.0
+
+    def load(self):
+        """(Re)read the file; a missing file leaves the asset empty rather than failing requests"""
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding='utf-8') as f:
+                text = f.read()
+        except OSError as e:
+            print(f"Error loading prompt asset {self.name}: {str(e)}")
+            mtime, text = None, ""
+        self.text = text
+        self.sha256 = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.tokens = count_tokens(text) if text else 0
+        self.mtime = mtime
+        self.loaded_at = datetime.now(timezone.utc)
+
+    def changed(self):
+        try:
+            return os.path.getmtime(self.path) != self.mtime
+        except OSError:
+            return self.mtime is not None
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "path": os.path.relpath(self.path, BASE_DIR),
+            "sha256": self.sha256,
+            "bytes": len(self.text.encode('utf-8')),
+            "tokens": self.tokens,
+            "loadedAt": self.loaded_at.isoformat() if self.loaded_at else None
+        }
+
+
+class PromptAssetRegistry:
+    def __init__(self, reload_interval=RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, path):
+        if not os.path.isabs(path):
+            path = os.path.join(BASE_DIR, path)
+        asset = PromptAsset(name, path)
+        asset.load()
+        with self._lock:
+            self._assets[name] = asset
+        return asset
+
+    def asset(self, name):
+        asset = self._assets[name]
+        if self.reload_interval > 0:
+            now = time.monotonic()
+            if now - asset.checked_at >= self.reload_interval:
+                with self._lock:
+                    if now - asset.checked_at >= self.reload_interval:
+                        asset.checked_at = now
+                        if asset.changed():
+                            asset.load()
+                            print(f"Reloaded prompt asset {name} ({asset.tokens} tokens)")
+        return asset
+
+    def get(self, name):
+        """Current text of a registered asset"""
+        return self.asset(name).text
+
+    def describe(self):
+        return [self.asset(name).describe() for name in list(self._assets)]
+
+
+prompt_assets = PromptAssetRegistry()
+prompt_assets.register('platform_plan', 'SciWebPlan31.md')
+prompt_assets.register('node_types', 'node_types.md')
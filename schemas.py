@@ -0,0 +1,110 @@
+"""
+Document schemas read from database.md.
+
+Each `### Collection` section of database.md has a `| Field | Type | Description |`
+table. Those tables are parsed once into {collection: {field path: type}} so
+imports can be checked against the same schema the docs describe. Nested fields
+use the doc's notation: `submissions.count` for objects, `attendees[].userId` for
+objects inside arrays.
+"""
+import os
+import re
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.md')
+
+# Firestore's limit on a document ID, in UTF-8 bytes
+MAX_ID_BYTES = 1500
+
+# Timestamps arrive from clients as ISO strings (or epoch numbers) and are stored as given
+TYPE_CHECKS = {
+    'String': lambda value: isinstance(value, str),
+    'Number': lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    'Boolean': lambda value: isinstance(value, bool),
+    'Timestamp': lambda value: isinstance(value, (str, int, float)) and not isinstance(value, bool),
+    'Object': lambda value: isinstance(value, dict),
+}
+
+
+def parse_schemas(path=SCHEMA_FILE):
+    """{collection: {field path: type}} from the markdown tables"""
+    schemas, current = {}, None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            heading = re.match(r'^###\s+(\w+)\s*$', line)
+            if heading:
+                current = schemas.setdefault(heading.group(1), {})
+                continue
+            if line.startswith('#'):
+                current = None
+                continue
+            row = re.match(r'^\|\s*([\w.\[\]]+)\s*\|\s*([\w<>]+)\s*\|', line)
+            if current is not None and row and row.group(1) != 'Field':
+                current[row.group(1)] = row.group(2)
+    return schemas
+
+
+SCHEMAS = parse_schemas()
+
+
+def _check(value, type_name):
+    if type_name.startswith('Array'):
+        if not isinstance(value, list):
+            return False
+        inner = type_name[len('Array<'):-1] if type_name.startswith('Array<') else None
+        return inner not in TYPE_CHECKS or all(TYPE_CHECKS[inner](item) for item in value if item is not None)
+    check = TYPE_CHECKS.get(type_name)
+    return check is None or check(value)
+
+
+def validate(collection, data, required=()):
+    """
+    List of problems with a document for a collection (empty when valid).
+    Unknown top-level fields are rejected; null is accepted for any documented field.
+    A string `id` is also checked against the rules for document IDs, since imports
+    store the document under it.
+    """
+    schema = SCHEMAS[collection]
+    if not isinstance(data, dict):
+        return ['Expected a JSON object']
+    errors = [f"Missing required field '{field}'" for field in required if data.get(field) in (None, '')]
+    top_level = {path.split('.')[0].split('[')[0] for path in schema}
+    errors += [f"Unknown field '{field}'" for field in data if field not in top_level]
+
+    for path, type_name in schema.items():
+        for label, value in _values(data, path):
+            if value is not None and not _check(value, type_name):
+                errors.append(f"Field '{label}' must be {type_name}")
+    if isinstance(data.get('id'), str) and data['id']:
+        errors += document_id_errors(data['id'])
+    return errors
+
+
+def document_id_errors(doc_id):
+    """Problems with a string used as a document ID"""
+    if '/' in doc_id:
+        return ["Field 'id' must not contain '/'"]
+    if doc_id in ('.', '..') or re.fullmatch(r'__.*__', doc_id):
+        return ["Field 'id' must not be '.', '..' or of the form __name__"]
+    if len(doc_id.encode('utf-8')) > MAX_ID_BYTES:
+        return [f"Field 'id' must be at most {MAX_ID_BYTES} bytes"]
+    return []
+
+
+def _values(data, path):
+    """(label, value) pairs found at a schema path like 'attendees[].userId'"""
+    found = [('', data)]
+    for part in path.split('.'):
+        is_array = part.endswith('[]')
+        name = part[:-2] if is_array else part
+        next_found = []
+        for label, value in found:
+            if not isinstance(value, dict) or name not in value:
+                continue
+            child_label = f"{label}.{name}" if label else name
+            child = value[name]
+            if is_array and isinstance(child, list):
+                next_found += [(f"{child_label}[{i}]", item) for i, item in enumerate(child)]
+            else:
+                next_found.append((child_label, child))
+        found = next_found
+    return found
@@ -255,6 +255,55 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Message push: the newest message ID rendered per channel, and the open live connection
+    const LONG_POLL_WAIT_SECONDS = 25;
+    const lastMessageIds = {};
+    let messageStream = null;
+    let liveChannelId = null;
+
+    function renderMessage(messagesContainer, msg) {
+        // Skip messages already on screen (e.g. our own, added when sent)
+        if (msg.id && messagesContainer.querySelector(`[data-message-id="${msg.id}"]`)) {
+            return;
+        }
+
+        // Determine if message is from current user (Replace 'CURRENT_USER_ID' logic)
+        const isCurrentUser = msg.senderId === 'CURRENT_USER_ID'; 
+        const avatarText = isCurrentUser ? 'ME' : msg.senderName ? msg.senderName.substring(0, 2).toUpperCase() : '??'; // Need senderName
+        const authorName = isCurrentUser ? 'You' : msg.senderName || 'Unknown User'; // Need senderName
+        
+         // Format timestamp (Example: using basic JS Date)
+        let formattedTime = 'Invalid Date';
+        try {
+            const date = new Date(msg.sentAt);
+            formattedTime = date.toLocaleTimeString([], { hour: 'numeric', minute: '2-digit' });
+            // Could add date if it's not today
+        } catch (e) { /* Ignore invalid date */ }
+        
+        const messageElement = document.createElement('div');
+        messageElement.className = 'message-group';
+        messageElement.setAttribute('data-message-id', msg.id);
+        messageElement.innerHTML = `
+            <div class="message-avatar">${avatarText}</div>
+            <div class="message-content">
+                <div class="message-header">
+                    <span class="message-author">${authorName}</span>
+                    <span class="message-time">${formattedTime}</span>
+                </div>
+                <div class="message-text">
+                    ${msg.content} <!-- Sanitize this content -->
+                </div>
+                <div class="message-reactions">
+                    <!-- TODO: Render existing reactions from msg.reactions -->
+                    <button class="btn-text btn-small">Add Reaction</button>
+                </div>
+                <!-- TODO: Add replies rendering -->
+            </div>
+        `;
+        messagesContainer.appendChild(messageElement);
+        addReactionListener(messageElement.querySelector('.message-reactions .btn-text'));
+    }
+
     // Function to load and render messages for a channel
     async function loadMessagesForChannel(channelId) {
         if (!channelId) return;
@@ -269,63 +318,22 @@ document.addEventListener('DOMContentLoaded', function() {
         messagesContainer.innerHTML = '<div class="loading-state">Loading messages...</div>';
 
         try {
+            // The server returns the most recent page, already ordered by sentAt
             const response = await fetch(`/api/Classes/${classId}/channels/${channelId}/messages`);
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             const messages = await response.json();
 
-            // Sort messages by timestamp client-side
-            messages.sort((a, b) => {
-                // Handle potential undefined or null dates
-                const dateA = a.sentAt ? new Date(a.sentAt) : new Date(0); // Treat missing date as epoch start
-                const dateB = b.sentAt ? new Date(b.sentAt) : new Date(0);
-                return dateA - dateB; // Ascending order
-            });
-
             // Clear loading state
             messagesContainer.innerHTML = ''; 
 
             if (messages.length === 0) {
+                delete lastMessageIds[channelId];
                 messagesContainer.innerHTML = '<div class="empty-state-large" style="min-height: 300px; display: flex; align-items: center; justify-content: center;"><i class="fas fa-comments" style="font-size: 3rem; margin-bottom: 1rem;"></i><p>No messages in this channel yet. Be the first!</p></div>';
             } else {
-                messages.forEach(msg => {
-                    // Determine if message is from current user (Replace 'CURRENT_USER_ID' logic)
-                    const isCurrentUser = msg.senderId === 'CURRENT_USER_ID'; 
-                    const avatarText = isCurrentUser ? 'ME' : msg.senderName ? msg.senderName.substring(0, 2).toUpperCase() : '??'; // Need senderName
-                    const authorName = isCurrentUser ? 'You' : msg.senderName || 'Unknown User'; // Need senderName
-                    
-                     // Format timestamp (Example: using basic JS Date)
-                    let formattedTime = 'Invalid Date';
-                    try {
-                        const date = new Date(msg.sentAt);
-                        formattedTime = date.toLocaleTimeString([], { hour: 'numeric', minute: '2-digit' });
-                        // Could add date if it's not today
-                    } catch (e) { /* Ignore invalid date */ }
-                    
-                    const messageElement = document.createElement('div');
-                    messageElement.className = 'message-group';
-                    messageElement.setAttribute('data-message-id', msg.id);
-                    messageElement.innerHTML = `
-                        <div class="message-avatar">${avatarText}</div>
-                        <div class="message-content">
-                            <div class="message-header">
-                                <span class="message-author">${authorName}</span>
-                                <span class="message-time">${formattedTime}</span>
-                            </div>
-                            <div class="message-text">
-                                ${msg.content} <!-- Sanitize this content -->
-                            </div>
-                            <div class="message-reactions">
-                                <!-- TODO: Render existing reactions from msg.reactions -->
-                                <button class="btn-text btn-small">Add Reaction</button>
-                            </div>
-                            <!-- TODO: Add replies rendering -->
-                        </div>
-                    `;
-                    messagesContainer.appendChild(messageElement);
-                    addReactionListener(messageElement.querySelector('.message-reactions .btn-text'));
-                });
+                messages.forEach(msg => renderMessage(messagesContainer, msg));
+                lastMessageIds[channelId] = messages[messages.length - 1].id;
                 // Scroll to the bottom after loading messages
                 messagesContainer.scrollTop = messagesContainer.scrollHeight;
             }
@@ -334,6 +342,84 @@ document.addEventListener('DOMContentLoaded', function() {
             console.error(`Error loading messages for channel ${channelId}:`, error);
             messagesContainer.innerHTML = '<div class="error-state">Error loading messages. Please try again.</div>';
         }
+
+        openMessageStream(channelId);
+    }
+
+    function appendNewMessages(channelId, messages) {
+        const messagesContainer = messagesContainerParent.querySelector(`.channel-messages[data-channel="${channelId}"]`);
+        if (!messagesContainer || messages.length === 0) return;
+
+        const emptyState = messagesContainer.querySelector('.empty-state-large');
+        if (emptyState) {
+            emptyState.remove();
+        }
+        const atBottom = messagesContainer.scrollTop + messagesContainer.clientHeight >= messagesContainer.scrollHeight - 20;
+        messages.forEach(msg => renderMessage(messagesContainer, msg));
+        lastMessageIds[channelId] = messages[messages.length - 1].id;
+        if (atBottom) {
+            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        }
+    }
+
+    // Receive new messages for the active channel as they are posted
+    function openMessageStream(channelId) {
+        if (messageStream) {
+            messageStream.close();
+            messageStream = null;
+        }
+        liveChannelId = channelId;
+
+        if (!window.EventSource) {
+            longPollChannel(channelId);
+            return;
+        }
+
+        const since = lastMessageIds[channelId];
+        const url = `/api/Classes/${classId}/channels/${channelId}/stream` + (since ? `?since=${encodeURIComponent(since)}` : '');
+        const stream = new EventSource(url);
+        stream.addEventListener('message', event => {
+            appendNewMessages(channelId, [JSON.parse(event.data)]);
+        });
+        stream.onerror = () => {
+            // EventSource reconnects by itself (resuming from the last event ID) unless it gave up
+            if (stream.readyState === EventSource.CLOSED && liveChannelId === channelId) {
+                console.warn('Message stream closed, falling back to long polling');
+                messageStream = null;
+                longPollChannel(channelId);
+            }
+        };
+        messageStream = stream;
+    }
+
+    // Fallback: repeatedly wait on the server for messages newer than the last one rendered
+    async function longPollChannel(channelId) {
+        while (liveChannelId === channelId) {
+            const since = lastMessageIds[channelId];
+            const url = since
+                ? `/api/Classes/${classId}/channels/${channelId}/messages?since=${encodeURIComponent(since)}&wait=${LONG_POLL_WAIT_SECONDS}`
+                : `/api/Classes/${classId}/channels/${channelId}/messages`;
+            try {
+                const response = await fetch(url);
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                const messages = await response.json();
+                if (liveChannelId !== channelId) return;
+                appendNewMessages(channelId, messages);
+                const retryAfter = Number(response.headers.get('Retry-After'));
+                if (retryAfter > 0) {
+                    // The server is out of waiting slots and answered right away
+                    await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+                } else if (!since && messages.length === 0) {
+                    // Empty channel and nothing to wait on yet: back off before asking again
+                    await new Promise(resolve => setTimeout(resolve, LONG_POLL_WAIT_SECONDS * 1000));
+                }
+            } catch (error) {
+                console.error(`Error refreshing messages for channel ${channelId}:`, error);
+                await new Promise(resolve => setTimeout(resolve, 5000));
+            }
+        }
     }
 
     async function handleCreateChannel() {
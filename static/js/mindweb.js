@@ -1447,6 +1447,31 @@ document.addEventListener('DOMContentLoaded', function() {
         messageElem.innerHTML = `<p>${message}</p>`;
         aiMessages.appendChild(messageElem);
         aiMessages.scrollTop = aiMessages.scrollHeight;
+        return messageElem;
+    }
+
+    // Read a Server-Sent Events response from /ai/challenge, calling onEvent(event, data) per event
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let event = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                if (data) onEvent(event, JSON.parse(data));
+            }
+        }
     }
 
     function addUserMessage(message) {
@@ -1512,7 +1537,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const payload = {
                 chat_history: chatHistory,
                 concept_map: [...nodes, ...edges],
-                subject: subject
+                subject: subject,
+                stream: true
             };
 
             try {
@@ -1521,6 +1547,25 @@ document.addEventListener('DOMContentLoaded', function() {
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify(payload)
                 });
+                // Streamed reply: show tokens as they arrive
+                if (response.ok && (response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+                    const messageElem = addAIMessage('');
+                    const textElem = messageElem.querySelector('p');
+                    let text = '';
+                    await readEventStream(response, (event, eventData) => {
+                        if (event === 'delta') {
+                            text += eventData.content;
+                            textElem.textContent = text;
+                            aiMessages.scrollTop = aiMessages.scrollHeight;
+                        } else if (event === 'done') {
+                            text = eventData.message;
+                            textElem.textContent = text || 'AI did not return a message.';
+                        } else if (event === 'error') {
+                            textElem.textContent = 'AI service error: ' + eventData.error;
+                        }
+                    });
+                    return;
+                }
                 let data;
                 try {
                     data = await response.json();
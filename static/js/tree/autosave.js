@@ -7,6 +7,12 @@ import * as Edges from './edges.js';
 // Autosave state
 let saveTimeout;
 const SAVE_DELAY = 2000; // 2 seconds delay before saving
+const MAX_SAVE_ATTEMPTS = 3; // conflicting /ops batches are replayed at most this often
+
+// Server-side version of the tree and the state last written at that version.
+// Saves send only the operations that differ from lastSavedState.
+let treeVersion = 0;
+let lastSavedState = null;
 
 // Function to schedule autosave
 export function scheduleAutosave() {
@@ -14,18 +20,9 @@ export function scheduleAutosave() {
   saveTimeout = setTimeout(saveTreeState, SAVE_DELAY);
 }
 
-// Function to save tree state
-export async function saveTreeState() {
-  // Get current user ID from localStorage
-  const userId = localStorage.getItem('userId');
-  if (!userId) {
-    console.error('No user ID found');
-    return;
-  }
-
-  // Prepare tree data - now properly capturing all node data from the DOM
-  const treeData = {
-    userId: userId,
+// Capture the current nodes and edges in their saved form
+function serializeTree() {
+  return {
     nodes: Array.from(document.querySelectorAll('.node')).map(nodeEl => {
       const nodeObj = Nodes.nodes.find(n => n.id === nodeEl.dataset.id);
       return {
@@ -43,29 +40,173 @@ export async function saveTreeState() {
     edges: Edges.edges.map(edge => ({
       from: edge.from,
       to: edge.to
-    })),
-    updatedAt: new Date().toISOString()
+    }))
   };
+}
 
-  console.log('Saving tree state:', userId, treeData);
+function sameValue(a, b) {
+  return JSON.stringify(a ?? null) === JSON.stringify(b ?? null);
+}
 
-  try {
-    // Send to server
-    const response = await fetch('/api/Trees/' + userId, {
-      method: 'PUT',
+// Build the operation batch that turns `previous` into `current` (see tree_ops.py)
+function diffTrees(previous, current) {
+  const previousNodes = new Map(previous.nodes.map(node => [node.id, node]));
+  const currentIds = new Set(current.nodes.map(node => node.id));
+  const edgeKey = edge => `${edge.from}->${edge.to}`;
+  const previousEdges = new Set(previous.edges.map(edgeKey));
+  const currentEdges = new Set(current.edges.map(edgeKey));
+
+  const nodeAdds = [];
+  const nodeUpdates = [];
+  current.nodes.forEach(node => {
+    const before = previousNodes.get(node.id);
+    if (!before) {
+      nodeAdds.push({ op: 'addNode', node });
+      return;
+    }
+    if (!sameValue(before.position, node.position)) {
+      nodeUpdates.push({ op: 'moveNode', id: node.id, position: node.position });
+    }
+    if (before.title !== node.title) {
+      nodeUpdates.push({ op: 'retitleNode', id: node.id, title: node.title });
+    }
+    const fields = {};
+    ['type', 'dueDate', 'content'].forEach(field => {
+      if (!sameValue(before[field], node[field])) fields[field] = node[field];
+    });
+    if (Object.keys(fields).length > 0) {
+      nodeUpdates.push({ op: 'updateNode', id: node.id, fields });
+    }
+  });
+
+  const edgeDeletes = previous.edges
+    .filter(edge => !currentEdges.has(edgeKey(edge)))
+    .map(edge => ({ op: 'deleteEdge', edge }));
+  const nodeDeletes = previous.nodes
+    .filter(node => !currentIds.has(node.id))
+    .map(node => ({ op: 'deleteNode', id: node.id }));
+  const edgeAdds = current.edges
+    .filter(edge => !previousEdges.has(edgeKey(edge)))
+    .map(edge => ({ op: 'addEdge', edge }));
+
+  return [...nodeAdds, ...nodeUpdates, ...edgeDeletes, ...nodeDeletes, ...edgeAdds];
+}
+
+// Create the tree document; never overwrites one saved meanwhile (e.g. by another tab)
+async function createTree(userId, tree) {
+  const response = await fetch('/api/Trees/' + userId, {
+    method: 'PUT',
+    headers: {
+      'Content-Type': 'application/json',
+      'If-None-Match': '*'
+    },
+    body: JSON.stringify({
+      userId: userId,
+      nodes: tree.nodes,
+      edges: tree.edges,
+      version: 0,
+      createdAt: new Date().toISOString(),
+      updatedAt: new Date().toISOString()
+    })
+  });
+
+  if (response.status === 409) {
+    return false;
+  }
+  if (!response.ok) {
+    const errorText = await response.text();
+    console.error('Server error:', response.status, errorText);
+    throw new Error(`Failed to save tree state: ${response.status}`);
+  }
+  treeVersion = 0;
+  return true;
+}
+
+// Send an operation batch. When the stored tree moved on (e.g. another tab) and
+// rejects some operations, replay the rest on the stored version instead of
+// overwriting it. Returns the number of operations that had to be dropped.
+async function sendOps(userId, tree, ops) {
+  let pending = ops;
+  let baseVersion = treeVersion;
+  let dropped = 0;
+
+  for (let attempt = 0; attempt < MAX_SAVE_ATTEMPTS; attempt++) {
+    if (pending.length === 0) {
+      return dropped;
+    }
+
+    const response = await fetch('/api/Trees/' + userId + '/ops', {
+      method: 'POST',
       headers: {
         'Content-Type': 'application/json'
       },
-      body: JSON.stringify(treeData)
+      body: JSON.stringify({ baseVersion, ops: pending })
     });
 
-    if (!response.ok) {
+    if (response.ok) {
+      const result = await response.json();
+      treeVersion = result.version;
+      return dropped;
+    }
+
+    if (response.status === 404) {
+      // No stored tree: this editor's state is all there is
+      if (await createTree(userId, tree)) {
+        return dropped;
+      }
+      baseVersion = 0;
+      continue;
+    }
+
+    if (response.status !== 409) {
       const errorText = await response.text();
       console.error('Server error:', response.status, errorText);
       throw new Error(`Failed to save tree state: ${response.status}`);
     }
 
+    const result = await response.json();
+    console.warn('Tree operations conflict, replaying on version', result.version, result.conflicts);
+    const rejected = new Set(
+      (result.conflicts || []).filter(conflict => conflict.index !== undefined).map(conflict => conflict.index)
+    );
+    pending = pending.filter((_, index) => !rejected.has(index));
+    dropped += rejected.size;
+    baseVersion = result.version;
+  }
+
+  throw new Error('Failed to save tree state: the tree keeps changing');
+}
+
+// Function to save tree state
+export async function saveTreeState() {
+  // Get current user ID from localStorage
+  const userId = localStorage.getItem('userId');
+  if (!userId) {
+    console.error('No user ID found');
+    return;
+  }
+
+  // Prepare tree data - now properly capturing all node data from the DOM
+  const currentState = serializeTree();
+
+  try {
+    // Without a loaded tree, every node and edge is new
+    const ops = diffTrees(lastSavedState || { nodes: [], edges: [] }, currentState);
+    if (ops.length === 0) {
+      return;
+    }
+
+    console.log('Saving tree operations:', userId, ops);
+    const dropped = await sendOps(userId, currentState, ops);
+
+    lastSavedState = currentState;
     console.log('Tree state saved successfully');
+
+    if (dropped > 0) {
+      // Some edits targeted nodes changed elsewhere: show what was actually stored
+      showMessage('Your web was changed in another window. Showing the latest version.');
+      await loadTreeState();
+    }
   } catch (error) {
     console.error('Error saving tree state:', error);
     showMessage('Error saving your web. Please try again later.');
@@ -91,24 +232,32 @@ export async function loadTreeState() {
           userId: userId,
           nodes: [],
           edges: [],
+          version: 0,
           createdAt: new Date().toISOString(),
           updatedAt: new Date().toISOString()
         };
 
         // Create a new document with a specific ID rather than letting Firebase generate one
         const createResponse = await fetch('/api/Trees/' + userId, {
-          method: 'PUT', // PUT will create the document if it doesn't exist
+          method: 'PUT',
           headers: {
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            'If-None-Match': '*' // Only create: never overwrite a tree saved meanwhile (e.g. by another tab)
           },
           body: JSON.stringify(newTree)
         });
         
+        if (createResponse.status === 409) {
+          // Created by another tab since our GET: load that one instead
+          return loadTreeState();
+        }
         if (!createResponse.ok) {
           throw new Error('Failed to create new tree');
         }
         
         console.log('New tree created successfully');
+        treeVersion = 0;
+        lastSavedState = { nodes: [], edges: [] };
         
         // Return empty tree data
         return {
@@ -138,6 +287,12 @@ export async function loadTreeState() {
       actualTreeData = treeData[userId];
     }
 
+    treeVersion = actualTreeData.version || 0;
+    lastSavedState = {
+      nodes: actualTreeData.nodes || [],
+      edges: (actualTreeData.edges || []).map(edge => ({ from: edge.from, to: edge.to }))
+    };
+
     // Recreate nodes if they exist
     if (actualTreeData.nodes && actualTreeData.nodes.length > 0) {
       let maxId = 0;
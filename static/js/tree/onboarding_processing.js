@@ -38,13 +38,14 @@ async function processUserResponses(answers) {
         fetch('/ai/fetch_jupiter_data', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ osis: creds.fullname, password: creds.jupiterPassword })
+            body: JSON.stringify({ osis: creds.fullname, password: creds.jupiterPassword, userId: localStorage.getItem('userId') })
         })
         .then(resp => {
             if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
             return resp.json();
         })
         .then(data => {
+            if (data.degraded) console.warn('Jupiter unavailable, using sample classes:', data.reason);
             console.log('Fetched classes:', data.classes);
             localStorage.setItem('classes', JSON.stringify(data.classes));
         })
@@ -502,10 +503,11 @@ function showProceedButton(container) {
             const resp = await fetch('/ai/fetch_jupiter_data', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ osis: creds.fullname, password: creds.jupiterPassword })
+                body: JSON.stringify({ osis: creds.fullname, password: creds.jupiterPassword, userId: localStorage.getItem('userId') })
             });
             if (resp.ok) {
                 const data = await resp.json();
+                if (data.degraded) console.warn('Jupiter unavailable, using sample classes:', data.reason);
                 console.log('Fetched classes:', data.classes);
                 classes = data.classes;
                 localStorage.setItem('classes', JSON.stringify(classes));
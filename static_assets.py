@@ -0,0 +1,111 @@
+"""
+Serving the assets built by build_static.py.
+
+When static/build/manifest.json exists:
+  - url_for('static', filename='js/main.js') resolves to the hashed build file
+    (/static/build/js/main.<hash>.js), which is served with year-long immutable
+    caching.
+  - Requests for the source path itself, or for build/<source path> (what the
+    relative imports and url()s inside a built file resolve to), get the built
+    file too, revalidated through an ETag.
+  - Either way the .br or .gz variant is sent when the browser accepts it.
+
+Assets whose source changed since the build are left out of the manifest and
+served as they are (see http_caching.py), so an outdated build never serves old
+code. Without a manifest nothing changes.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import request, send_from_directory
+
+from build_static import BUILD_DIR, MANIFEST_NAME
+from http_caching import STATIC_MAX_AGE
+
+# Preferred first; file suffix of each precompressed variant
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class AssetManifest:
+    def __init__(self, static_folder, assets=None):
+        self.static_folder = static_folder
+        self.assets = assets or {}
+        self.by_file = {entry['file']: entry for entry in self.assets.values()}
+
+    @classmethod
+    def load(cls, static_folder):
+        path = os.path.join(static_folder, BUILD_DIR, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return cls(static_folder)
+        with open(path) as f:
+            assets = json.load(f).get('assets', {})
+        current = {}
+        for name, entry in assets.items():
+            try:
+                with open(os.path.join(static_folder, name), 'rb') as f:
+                    source_hash = hashlib.sha256(f.read()).hexdigest()
+            except OSError:
+                continue
+            if source_hash == entry.get('sourceHash'):
+                current[name] = entry
+        if len(current) < len(assets):
+            print(f"Static build is out of date for {len(assets) - len(current)} assets; "
+                  f"serving those from source (run python build_static.py)")
+        return cls(static_folder, current)
+
+    def resolve(self, filename):
+        """Built file for a source filename, or None"""
+        entry = self.assets.get(filename)
+        return entry['file'] if entry else None
+
+
+def _accepted_encoding(entry):
+    for encoding, suffix in ENCODINGS:
+        if encoding in entry.get('encodings', {}) and request.accept_encodings[encoding]:
+            return encoding, suffix
+    return None, ''
+
+
+def init_app(app):
+    """Resolve static URLs through the manifest and serve precompressed variants"""
+    manifest = AssetManifest.load(app.static_folder)
+    app.extensions['asset_manifest'] = manifest
+    if not manifest.assets:
+        return
+    serve_source = app.view_functions['static']
+
+    @app.url_defaults
+    def resolve_static_url(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = manifest.resolve(values['filename']) or values['filename']
+
+    def serve_static(filename):
+        entry = manifest.by_file.get(filename)
+        immutable = entry is not None
+        if entry is None and filename.startswith(BUILD_DIR + '/'):
+            # Relative imports and url()s in a built file resolve to build/<source path>
+            filename = filename[len(BUILD_DIR) + 1:]
+        entry = entry or manifest.assets.get(filename)
+        if entry is None:
+            return serve_source(filename=filename)
+
+        encoding, suffix = _accepted_encoding(entry)
+        mimetype = mimetypes.guess_type(entry['file'])[0] or 'application/octet-stream'
+        response = send_from_directory(app.static_folder, entry['file'] + suffix, mimetype=mimetype,
+                                       etag=f"{entry['hash'][:32]}-{encoding or 'identity'}", conditional=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        if immutable:
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        else:
+            response.cache_control.no_cache = True
+            response.cache_control.max_age = None
+        return response
+
+    app.view_functions['static'] = serve_static
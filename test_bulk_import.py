@@ -0,0 +1,133 @@
+"""
+POST /api/<collection>/bulk against the local storage backend: per-item
+results and the 201/207/400/500 status for full, partial and failed imports.
+
+Run with: python -m pytest test_bulk_import.py
+"""
+import json
+import os
+
+os.environ['SCIWEB_STORAGE'] = 'local'
+
+import pytest
+
+import firebase_routes
+from app import app
+from db_init import db
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def unique(prefix):
+    return f'{prefix}-{os.urandom(4).hex()}'
+
+
+def test_all_items_created(client):
+    class_id = unique('class')
+    items = [{'classId': class_id, 'title': f'Homework {i}', 'points': 10} for i in range(3)]
+    items.append({'id': unique('hw'), 'classId': class_id, 'title': 'Keyed'})
+    response = client.post('/api/Assignments/bulk', json=items)
+
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body['counts'] == {'created': 4}
+    assert [result['index'] for result in body['results']] == [0, 1, 2, 3]
+    assert body['results'][3]['id'] == items[3]['id']
+    stored = db.collection('Assignments').document(items[3]['id']).get().to_dict()
+    assert stored['title'] == 'Keyed' and 'id' not in stored and stored['createdAt'] is not None
+
+
+def test_rerun_with_ids_overwrites(client):
+    event_id = unique('event')
+    for title in ('Field trip', 'Field trip (moved)'):
+        response = client.post('/api/Events/bulk', json=[{'id': event_id, 'classId': 'bio', 'title': title}])
+        assert response.status_code == 201
+    assert db.collection('Events').document(event_id).get().to_dict()['title'] == 'Field trip (moved)'
+
+
+def test_partial_import_is_207(client):
+    ndjson = '\n'.join([
+        json.dumps({'title': 'Balance the equation'}),
+        '{not json',
+        json.dumps({'content': 'no title'}),
+        json.dumps({'title': 'Wrong points', 'points': 'ten'}),
+        json.dumps({'id': 'a/b', 'title': 'Bad id'}),
+    ])
+    response = client.post('/api/Problems/bulk', data=ndjson, content_type='application/x-ndjson')
+
+    assert response.status_code == 207
+    body = response.get_json()
+    assert body['counts'] == {'created': 1, 'invalid': 4}
+    assert [result['status'] for result in body['results']] == ['created', 'invalid', 'invalid', 'invalid', 'invalid']
+    assert body['results'][1]['errors'][0].startswith('Invalid JSON')
+    assert all(result['errors'] for result in body['results'][1:])
+
+
+def test_nothing_valid_is_400(client):
+    response = client.post('/api/Events/bulk', json=[{'title': 'No class'}, {'classId': 'bio'}])
+    assert response.status_code == 400
+    assert response.get_json()['counts'] == {'invalid': 2}
+
+
+@pytest.mark.parametrize('collection, body, status', [
+    ('Members', [{'email': 'ada@example.com'}], 400),
+    ('Assignments', [], 400),
+    ('Assignments', '[oops', 400),
+])
+def test_rejected_requests(client, collection, body, status):
+    if isinstance(body, str):
+        response = client.post(f'/api/{collection}/bulk', data=body, content_type='application/json')
+    else:
+        response = client.post(f'/api/{collection}/bulk', json=body)
+    assert response.status_code == status
+
+
+def test_too_many_items_is_413(client, monkeypatch):
+    monkeypatch.setattr(firebase_routes, 'MAX_BULK_ITEMS', 2)
+    response = client.post('/api/Problems/bulk', json=[{'title': str(i)} for i in range(3)])
+    assert response.status_code == 413
+
+
+class FailingBatch:
+    def __init__(self, batch):
+        self._batch = batch
+
+    def set(self, reference, data):
+        self._batch.set(reference, data)
+
+    def commit(self):
+        raise RuntimeError("storage unavailable")
+
+
+def fail_batches(monkeypatch, failing):
+    """Make the batches whose (0-based) number is in `failing` fail on commit"""
+    create_batch = db.batch
+    created = []
+
+    def batch():
+        created.append(1)
+        return FailingBatch(create_batch()) if len(created) - 1 in failing else create_batch()
+
+    monkeypatch.setattr(db, 'batch', batch)
+
+
+def test_failed_batch_fails_only_its_items(client, monkeypatch):
+    monkeypatch.setattr(firebase_routes, 'BATCH_WRITE_LIMIT', 2)
+    fail_batches(monkeypatch, {1})
+    response = client.post('/api/Problems/bulk', json=[{'title': f'Problem {i}'} for i in range(4)])
+
+    assert response.status_code == 207
+    body = response.get_json()
+    assert [result['status'] for result in body['results']] == ['created', 'created', 'failed', 'failed']
+    assert body['results'][2]['error'] == 'storage unavailable'
+    assert not db.collection('Problems').document(body['results'][2]['id']).get().exists
+
+
+def test_storage_failure_is_500(client, monkeypatch):
+    fail_batches(monkeypatch, {0})
+    response = client.post('/api/Problems/bulk', json=[{'title': 'Lost'}, {'points': 1}])
+    assert response.status_code == 500
+    assert response.get_json()['counts'] == {'failed': 1, 'invalid': 1}
@@ -0,0 +1,105 @@
+"""
+Legacy arrays and their keyed subcollections (class_layout.py): dual reads and
+migration, run against the local storage backend.
+
+Run with: python -m pytest test_class_layout.py
+"""
+import os
+
+os.environ['SCIWEB_STORAGE'] = 'local'
+
+import pytest
+
+import class_layout
+from app import app
+from class_layout import SEQ_FIELD, ensure_migrated, item_ref, migrate_parent, put_item, read_items
+from datastore import LocalClient
+from db_init import db as app_db
+
+CHANNELS = [{'id': 'general', 'name': 'General'}, {'id': 'help', 'name': 'Help'}, {'name': 'Unkeyed'}]
+
+
+@pytest.fixture
+def db():
+    db = LocalClient()
+    db.collection('Classes').document('bio').set({'name': 'Biology', 'channels': CHANNELS})
+    return db
+
+
+def stored(db, field='channels'):
+    docs = db.collection('Classes').document('bio').collection(field).stream()
+    return {doc.id: doc.to_dict() for doc in docs}
+
+
+def test_reads_merge_array_and_subcollection(db):
+    put_item(db, 'Classes', 'bio', 'channels', {'id': 'help', 'name': 'Help desk'})
+    put_item(db, 'Classes', 'bio', 'channels', {'id': 'labs', 'name': 'Labs'})
+    items = read_items(db, 'Classes', 'bio', 'channels')
+    assert [item['name'] for item in items] == ['General', 'Help desk', 'Unkeyed', 'Labs']
+    assert all(SEQ_FIELD not in item for item in items)
+
+
+def test_migration_moves_entries_in_order(db):
+    assert migrate_parent(db, 'Classes', 'bio', 'channels') == 3
+    assert 'channels' not in db.collection('Classes').document('bio').get().to_dict()
+    entries = stored(db)
+    assert entries['general'] == {'id': 'general', 'name': 'General', SEQ_FIELD: 0}
+    unkeyed = [entry for entry in entries.values() if entry['name'] == 'Unkeyed']
+    assert unkeyed[0][SEQ_FIELD] == 2 and unkeyed[0]['id'] in entries
+    assert [item['name'] for item in read_items(db, 'Classes', 'bio', 'channels')] == ['General', 'Help', 'Unkeyed']
+
+    assert migrate_parent(db, 'Classes', 'bio', 'channels') == 0
+    assert len(stored(db)) == 3
+
+
+def test_migration_keeps_newer_subcollection_entries(db):
+    put_item(db, 'Classes', 'bio', 'channels', {'id': 'help', 'name': 'Help desk'})
+    assert migrate_parent(db, 'Classes', 'bio', 'channels') == 2
+    assert stored(db)['help']['name'] == 'Help desk'
+
+
+def test_migration_skips_an_entry_written_during_it(db, monkeypatch):
+    # A channel saved between the scan and the commit: the batch fails and is redone
+    original_batch = db.batch
+    calls = []
+
+    def racing_batch():
+        if not calls:
+            put_item(db, 'Classes', 'bio', 'channels', {'id': 'general', 'name': 'Announcements'})
+        calls.append(1)
+        return original_batch()
+
+    monkeypatch.setattr(db, 'batch', racing_batch)
+    assert migrate_parent(db, 'Classes', 'bio', 'channels') == 2
+    assert stored(db)['general']['name'] == 'Announcements'
+    assert 'channels' not in db.collection('Classes').document('bio').get().to_dict()
+
+
+def test_migration_in_several_batches(db, monkeypatch):
+    monkeypatch.setattr(class_layout, 'BATCH_WRITE_LIMIT', 3)
+    units = [{'id': f'unit{i}', 'title': f'Unit {i}'} for i in range(7)]
+    db.collection('Classes').document('bio').update({'units': units})
+    assert migrate_parent(db, 'Classes', 'bio', 'units') == 7
+    assert [item['id'] for item in read_items(db, 'Classes', 'bio', 'units')] == [unit['id'] for unit in units]
+    assert 'units' not in db.collection('Classes').document('bio').get().to_dict()
+
+
+def test_ensure_migrated(db):
+    assert ensure_migrated(db, 'Classes', 'missing', 'channels') is False
+    assert ensure_migrated(db, 'Classes', 'bio', 'channels') is True
+    assert item_ref(db, 'Classes', 'bio', 'channels', 'help').get().exists
+
+
+def test_api_serves_merged_lists_and_rejects_array_patches():
+    class_id = f'class-{os.urandom(4).hex()}'
+    app_db.collection('Classes').document(class_id).set({'name': 'Biology', 'channels': CHANNELS[:2]})
+    client = app.test_client()
+
+    response = client.post(f'/api/Classes/{class_id}/channels', json={'name': 'Labs'})
+    assert response.status_code == 201
+    channels = client.get(f'/api/Classes/{class_id}').get_json()[class_id]['channels']
+    assert [channel['name'] for channel in channels] == ['General', 'Help', 'Labs']
+
+    response = client.patch(f'/api/Classes/{class_id}', json={'channels': []})
+    assert response.status_code == 400
+    assert len(client.get(f'/api/Classes/{class_id}').get_json()[class_id]['channels']) == 3
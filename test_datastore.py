@@ -0,0 +1,135 @@
+"""
+The local storage backend (datastore.LocalClient): write batches,
+transactions, preconditions and field-masked reads of Members projections.
+
+Run with: python -m pytest test_datastore.py
+"""
+import pytest
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore_v1 import transforms
+
+from datastore import LocalClient, run_transaction
+from projections import MEMBER_PROJECTIONS, Projection, member_projection
+
+MEMBER = {
+    'first_name': 'Ada', 'last_name': 'Lovelace', 'username': 'ada', 'email': 'ada@example.com',
+    'password': 'hashed', 'verification_code': '123456', 'userType': 'student',
+    'settings': {'privacy': {'webVisibility': 'friends'}, 'theme': 'dark'},
+    'classes': ['c1', 'c2'], 'friends': ['u2'],
+}
+
+
+@pytest.fixture
+def db():
+    return LocalClient()
+
+
+def test_batch_commit_is_all_or_nothing(db):
+    db.collection('Classes').document('c1').set({'name': 'Biology'})
+    batch = db.batch()
+    batch.set(db.collection('Classes').document('c2'), {'name': 'Chemistry'})
+    batch.update(db.collection('Classes').document('c1'), {'name': 'Biology II'})
+    batch.create(db.collection('Classes').document('c1'), {'name': 'Duplicate'})
+    with pytest.raises(AlreadyExists):
+        batch.commit()
+
+    assert db.collection('Classes').document('c1').get().to_dict() == {'name': 'Biology'}
+    assert not db.collection('Classes').document('c2').get().exists
+    assert len(batch) == 0
+
+
+def test_transaction_reads_and_writes_atomically(db):
+    counter = db.collection('Counters').document('views')
+    counter.set({'count': 1})
+
+    def bump(transaction):
+        snapshot = next(transaction.get(counter))
+        transaction.update(counter, {'count': snapshot.get('count') + 1})
+        return snapshot.get('count')
+
+    assert run_transaction(db, bump) == 1
+    assert counter.get().to_dict() == {'count': 2}
+
+
+def test_failed_transaction_writes_nothing(db):
+    ref = db.collection('Trees').document('t1')
+
+    def fail(transaction):
+        transaction.set(ref, {'version': 1})
+        raise RuntimeError("abort")
+
+    with pytest.raises(RuntimeError):
+        run_transaction(db, fail)
+    assert not ref.get().exists
+
+
+def test_transaction_commit_fails_on_a_broken_precondition(db):
+    ref = db.collection('Trees').document('t1')
+
+    def update_missing(transaction):
+        transaction.set(db.collection('Trees').document('t2'), {'version': 0})
+        transaction.update(ref, {'version': 1})
+
+    with pytest.raises(NotFound):
+        run_transaction(db, update_missing)
+    assert not db.collection('Trees').document('t2').get().exists
+
+
+def test_write_preconditions(db):
+    ref = db.collection('Events').document('e1')
+    with pytest.raises(NotFound):
+        ref.update({'title': 'Quiz'})
+    with pytest.raises(NotFound):
+        ref.delete(option=db.write_option(exists=True))
+    ref.create({'title': 'Quiz'})
+    with pytest.raises(AlreadyExists):
+        ref.create({'title': 'Test'})
+    ref.delete(option=db.write_option(exists=True))
+    assert not ref.get().exists
+
+
+def test_update_applies_transforms_and_dotted_paths(db):
+    ref = db.collection('Members').document('u1')
+    ref.set(MEMBER)
+    ref.update({
+        'classes': transforms.ArrayUnion(['c2', 'c3']),
+        'friends': transforms.ArrayRemove(['u2']),
+        'settings.theme': 'light',
+        'updatedAt': transforms.SERVER_TIMESTAMP,
+    })
+    data = ref.get().to_dict()
+    assert data['classes'] == ['c1', 'c2', 'c3']
+    assert data['friends'] == []
+    assert data['settings'] == {'privacy': {'webVisibility': 'friends'}, 'theme': 'light'}
+    assert data['updatedAt'] is not None
+
+
+def test_reads_return_copies(db):
+    ref = db.collection('Members').document('u1')
+    ref.set(MEMBER)
+    ref.get().to_dict()['classes'].append('c9')
+    assert ref.get().to_dict()['classes'] == ['c1', 'c2']
+
+
+@pytest.mark.parametrize('name', sorted(MEMBER_PROJECTIONS))
+def test_projections_never_include_secrets(db, name):
+    ref = db.collection('Members').document('u1')
+    ref.set(MEMBER)
+    projection = member_projection(name)
+    fetched = ref.get(field_paths=projection.fields).to_dict()
+
+    assert fetched == projection.apply(MEMBER)
+    assert 'password' not in fetched and 'verification_code' not in fetched
+    assert set(fetched) <= {field.split('.')[0] for field in projection.fields}
+
+
+def test_select_masks_query_results(db):
+    db.collection('Members').document('u1').set(MEMBER)
+    fields = member_projection('public_card').fields
+    results = [doc.to_dict() for doc in db.collection('Members').where('username', '==', 'ada').select(fields).stream()]
+    assert results == [member_projection('public_card').apply(MEMBER)]
+
+
+def test_dotted_projection_keeps_nested_fields():
+    projection = Projection('visibility', ['settings.privacy.webVisibility', 'missing.field'])
+    assert projection.apply(MEMBER) == {'settings': {'privacy': {'webVisibility': 'friends'}}}
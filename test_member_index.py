@@ -0,0 +1,139 @@
+"""
+Email/username uniqueness in member_index.MemberIndex against the local
+storage backend: claims, renames, deletes, legacy members and the backfill.
+
+Run with: python -m pytest test_member_index.py
+"""
+import pytest
+from google.api_core.exceptions import NotFound
+
+from datastore import LocalClient
+from member_index import IndexConflict, MemberIndex, index_key
+
+
+@pytest.fixture
+def db():
+    return LocalClient()
+
+
+@pytest.fixture
+def index(db):
+    return MemberIndex(db)
+
+
+def entry(db, collection, value):
+    doc = db.collection(collection).document(index_key(value)).get()
+    return doc.to_dict()['userId'] if doc.exists else None
+
+
+def test_create_member_claims_normalized_values(db, index):
+    user_id = index.create_member({'email': ' Ada@Example.com ', 'username': 'Ada'})
+    assert entry(db, 'Emails', 'ada@example.com') == user_id
+    assert entry(db, 'Usernames', 'ada') == user_id
+    assert index.lookup('email', 'ADA@example.com') == user_id
+    assert index.find_member('username', 'ada').id == user_id
+
+
+@pytest.mark.parametrize('field, value', [('email', 'ADA@EXAMPLE.COM'), ('username', 'ada ')])
+def test_duplicate_claims_conflict(db, index, field, value):
+    index.create_member({'email': 'ada@example.com', 'username': 'ada'})
+    other = {'email': 'grace@example.com', 'username': 'grace', field: value}
+    with pytest.raises(IndexConflict) as raised:
+        index.create_member(other)
+    assert raised.value.field == field
+    assert len(list(db.collection('Members').stream())) == 1
+
+
+def test_rename_moves_the_entry(db, index):
+    user_id = index.create_member({'email': 'ada@example.com', 'username': 'ada'})
+    assert index.find_member('username', 'ada').id == user_id
+
+    index.update_member(user_id, {'username': 'countess'})
+    assert entry(db, 'Usernames', 'ada') is None
+    assert entry(db, 'Usernames', 'countess') == user_id
+    assert index.find_member('username', 'ada') is None
+    assert index.find_member('username', 'countess').id == user_id
+
+    # The old name is free again
+    assert index.create_member({'email': 'other@example.com', 'username': 'ada'})
+
+
+def test_rename_onto_a_taken_value_conflicts(db, index):
+    ada = index.create_member({'email': 'ada@example.com', 'username': 'ada'})
+    index.create_member({'email': 'grace@example.com', 'username': 'grace'})
+    with pytest.raises(IndexConflict):
+        index.update_member(ada, {'username': 'Grace'})
+    assert db.collection('Members').document(ada).get().to_dict()['username'] == 'ada'
+    assert entry(db, 'Usernames', 'ada') == ada
+
+
+def test_replace_drops_removed_values(db, index):
+    user_id = index.create_member({'email': 'ada@example.com', 'username': 'ada'})
+    index.update_member(user_id, {'email': 'ada@example.com'}, replace=True)
+    assert entry(db, 'Usernames', 'ada') is None
+    assert entry(db, 'Emails', 'ada@example.com') == user_id
+
+
+def test_update_of_a_missing_member(index):
+    with pytest.raises(NotFound):
+        index.update_member('missing', {'username': 'ghost'})
+    with pytest.raises(NotFound):
+        index.update_member('missing', {'bio': 'no indexed fields'})
+
+
+def test_delete_releases_entries(db, index):
+    user_id = index.create_member({'email': 'ada@example.com', 'username': 'ada'})
+    index.delete_member(user_id)
+    assert entry(db, 'Emails', 'ada@example.com') is None
+    assert entry(db, 'Usernames', 'ada') is None
+    assert index.lookup('email', 'ada@example.com') is None
+
+
+def test_legacy_members_block_new_claims(db, index):
+    db.collection('Members').document('legacy').set({'email': 'ada@example.com', 'username': 'ada'})
+    with pytest.raises(IndexConflict):
+        index.create_member({'email': 'ADA@example.com', 'username': 'someone'})
+    new_id = index.create_member({'email': 'grace@example.com', 'username': 'grace'})
+    with pytest.raises(IndexConflict):
+        index.update_member(new_id, {'username': 'ada'})
+    # The legacy member may keep its own values
+    index.update_member('legacy', {'username': 'ada'})
+
+    # After the backfill the legacy check is off and the index decides alone
+    assert not MemberIndex(db, check_legacy=False)._claimed_by_legacy('username', 'ada', 'ada')
+
+
+def test_lookup_indexes_legacy_members(db, index):
+    db.collection('Members').document('legacy').set({'email': 'ada@example.com', 'username': 'ada'})
+    assert index.lookup('username', 'ada') == 'legacy'
+    assert entry(db, 'Usernames', 'ada') == 'legacy'
+
+
+def test_backfill_indexes_missing_entries(db, index):
+    indexed = index.create_member({'email': 'grace@example.com', 'username': 'grace'})
+    db.collection('Members').document('legacy').set({'email': 'Ada@Example.com', 'username': 'ada'})
+    db.collection('Members').document('no-username').set({'email': 'kat@example.com'})
+
+    assert index.backfill(dry_run=True) == {"members": 3, "indexed": 0, "missing": 3, "conflicts": []}
+    assert entry(db, 'Emails', 'ada@example.com') is None
+
+    assert index.backfill() == {"members": 3, "indexed": 3, "missing": 3, "conflicts": []}
+    assert entry(db, 'Emails', 'ada@example.com') == 'legacy'
+    assert entry(db, 'Usernames', 'ada') == 'legacy'
+    assert entry(db, 'Emails', 'kat@example.com') == 'no-username'
+    assert entry(db, 'Usernames', 'grace') == indexed
+
+    assert index.backfill() == {"members": 3, "indexed": 0, "missing": 0, "conflicts": []}
+
+
+def test_backfill_stops_on_duplicates(db, index):
+    db.collection('Members').document('a').set({'email': 'ada@example.com', 'username': 'ada'})
+    db.collection('Members').document('b').set({'email': 'ADA@example.com', 'username': 'ada2'})
+    db.collection('Usernames').document('grace').set({'userId': 'someone-else'})
+    db.collection('Members').document('c').set({'email': 'grace@example.com', 'username': 'grace'})
+
+    result = index.backfill()
+    assert result["indexed"] == 0
+    assert {(conflict['field'], conflict['value']) for conflict in result["conflicts"]} == {
+        ('email', 'ada@example.com'), ('username', 'grace')}
+    assert entry(db, 'Usernames', 'ada') is None
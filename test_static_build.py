@@ -0,0 +1,89 @@
+"""
+Loads /tree against a static build and follows every module import and CSS
+url() it references, so a build that breaks relative paths fails here.
+
+Run with: python -m pytest test_static_build.py
+"""
+import os
+import re
+import shutil
+import tempfile
+from urllib.parse import urljoin, urlsplit
+
+from flask import Flask, render_template
+
+import static_assets
+from build_static import BUILD_DIR, build
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PAGE_URL = re.compile(r'(?:src|href)="(/static/[^"]+)"')
+JS_IMPORT = re.compile(r'''(?:^|;|\s)(?:import|export)\s*(?:[^'";]*?\sfrom\s*)?['"](\.{1,2}/[^'"]+)['"]''', re.M)
+CSS_URL = re.compile(r'''url\(\s*['"]?(?!data:|https?:|/)([^'")]+)['"]?\s*\)''')
+
+
+def make_app(static_dir):
+    app = Flask(__name__, static_folder=static_dir, template_folder=os.path.join(REPO_DIR, 'templates'))
+    app.add_url_rule('/tree', 'tree', lambda: render_template('tree-modular.html'))
+    static_assets.init_app(app)
+    return app
+
+
+def follow_assets(client, urls):
+    """Fetch every URL and the relative URLs it references; returns {url: status}"""
+    seen = {}
+    pending = list(urls)
+    while pending:
+        url = pending.pop()
+        if url in seen:
+            continue
+        response = client.get(url)
+        seen[url] = response.status_code
+        if response.status_code != 200:
+            continue
+        path = urlsplit(url).path
+        if path.endswith('.js'):
+            references = JS_IMPORT.findall(response.get_data(as_text=True))
+        elif path.endswith('.css'):
+            references = CSS_URL.findall(response.get_data(as_text=True))
+        else:
+            references = []
+        pending.extend(urljoin(path, reference) for reference in references)
+    return seen
+
+
+def test_tree_page_loads_after_build():
+    with tempfile.TemporaryDirectory() as tmp:
+        static_dir = os.path.join(tmp, 'static')
+        shutil.copytree(os.path.join(REPO_DIR, 'static'), static_dir, ignore=shutil.ignore_patterns(BUILD_DIR))
+        build(static_dir, use_brotli=False)
+        client = make_app(static_dir).test_client()
+
+        page = client.get('/tree')
+        assert page.status_code == 200
+        urls = PAGE_URL.findall(page.get_data(as_text=True))
+        assert any(url.startswith(f'/static/{BUILD_DIR}/js/tree-modular.') for url in urls)
+
+        statuses = follow_assets(client, urls)
+        missing = {url: status for url, status in statuses.items() if status != 200}
+        assert not missing, f"assets that did not load: {missing}"
+        assert f'/static/{BUILD_DIR}/js/tree/main.js' in statuses
+        assert f'/static/{BUILD_DIR}/js/tree/autosave.js' in statuses
+
+
+def test_css_url_references_load_after_build():
+    with tempfile.TemporaryDirectory() as tmp:
+        static_dir = os.path.join(tmp, 'static')
+        shutil.copytree(os.path.join(REPO_DIR, 'static'), static_dir, ignore=shutil.ignore_patterns(BUILD_DIR))
+        manifest = build(static_dir, use_brotli=False)
+        client = make_app(static_dir).test_client()
+
+        css_url = '/static/' + manifest['assets']['css/motivation_stream.css']['file']
+        statuses = follow_assets(client, [css_url])
+        assert statuses == {css_url: 200, f'/static/{BUILD_DIR}/images/pattern.svg': 200}
+
+
+if __name__ == "__main__":
+    test_tree_page_loads_after_build()
+    test_css_url_references_load_after_build()
+    print("Static build checks passed")
@@ -0,0 +1,135 @@
+"""
+Tree operation batches (tree_ops.py) and the /api/Trees/<id>/ops endpoint,
+run against the local storage backend.
+
+Run with: python -m pytest test_tree_ops.py
+"""
+import os
+
+os.environ['SCIWEB_STORAGE'] = 'local'
+
+import pytest
+
+from app import app
+from tree_ops import MAX_OPS_PER_BATCH, TreeOpError, apply_ops, validate_ops
+
+NODES = [
+    {'id': '1', 'type': 'topic', 'title': 'Cells', 'position': {'x': 0, 'y': 0}},
+    {'id': '2', 'type': 'topic', 'title': 'Mitosis', 'position': {'x': 100, 'y': 0}},
+]
+EDGES = [{'from': '1', 'to': '2'}]
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture
+def tree_id(client):
+    tree_id = f'tree-{os.urandom(4).hex()}'
+    response = client.put(f'/api/Trees/{tree_id}', json={'userId': tree_id, 'nodes': NODES, 'edges': EDGES, 'version': 3})
+    assert response.status_code == 200
+    return tree_id
+
+
+@pytest.mark.parametrize('ops', [
+    [],
+    'addNode',
+    [{'op': 'addNode', 'node': {'title': 'no id'}}],
+    [{'op': 'moveNode', 'id': '1'}],
+    [{'op': 'retitleNode', 'id': '1', 'title': 5}],
+    [{'op': 'addEdge', 'edge': {'from': '1'}}],
+    [{'op': 'renameNode', 'id': '1'}],
+    [{'op': 'deleteNode', 'id': '1'}] * (MAX_OPS_PER_BATCH + 1),
+])
+def test_validate_ops_rejects_malformed_batches(ops):
+    with pytest.raises(TreeOpError):
+        validate_ops(ops)
+
+
+def test_apply_ops_edits_a_copy():
+    ops = [
+        {'op': 'addNode', 'node': {'id': '3', 'title': 'Meiosis'}},
+        {'op': 'moveNode', 'id': '1', 'position': {'x': 5, 'y': 6}},
+        {'op': 'retitleNode', 'id': '2', 'title': 'Mitosis phases'},
+        {'op': 'updateNode', 'id': '2', 'fields': {'id': 'hijacked', 'dueDate': '2026-11-01'}},
+        {'op': 'addEdge', 'edge': {'from': '2', 'to': '3'}},
+        {'op': 'addEdge', 'edge': {'from': '2', 'to': '3'}},
+    ]
+    nodes, edges, conflicts = apply_ops(NODES, EDGES, ops)
+    assert conflicts == []
+    assert [node['id'] for node in nodes] == ['1', '2', '3']
+    assert nodes[0]['position'] == {'x': 5, 'y': 6}
+    assert nodes[1]['title'] == 'Mitosis phases' and nodes[1]['dueDate'] == '2026-11-01'
+    assert edges == [{'from': '1', 'to': '2'}, {'from': '2', 'to': '3'}]
+    assert NODES[0]['position'] == {'x': 0, 'y': 0}
+
+
+def test_delete_node_removes_its_edges_and_is_idempotent():
+    ops = [{'op': 'deleteNode', 'id': '2'}, {'op': 'deleteNode', 'id': '2'}]
+    nodes, edges, conflicts = apply_ops(NODES, EDGES, ops)
+    assert conflicts == []
+    assert [node['id'] for node in nodes] == ['1']
+    assert edges == []
+
+
+def test_apply_ops_reports_conflicting_indexes():
+    ops = [
+        {'op': 'addNode', 'node': {'id': '1'}},
+        {'op': 'moveNode', 'id': '9', 'position': {'x': 0, 'y': 0}},
+        {'op': 'retitleNode', 'id': '1', 'title': 'Still applies'},
+        {'op': 'addEdge', 'edge': {'from': '1', 'to': '9'}},
+    ]
+    _, _, conflicts = apply_ops(NODES, EDGES, ops)
+    assert [conflict['index'] for conflict in conflicts] == [0, 1, 3]
+
+
+def test_ops_endpoint_applies_and_bumps_version(client, tree_id):
+    response = client.post(f'/api/Trees/{tree_id}/ops', json={
+        'baseVersion': 3, 'ops': [{'op': 'retitleNode', 'id': '1', 'title': 'Cell biology'}]})
+    assert response.status_code == 200
+    assert response.get_json()['version'] == 4
+    assert response.get_json()['rebased'] is False
+
+    tree = client.get(f'/api/Trees/{tree_id}').get_json()[tree_id]
+    assert tree['version'] == 4
+    assert tree['nodes'][0]['title'] == 'Cell biology'
+
+
+def test_ops_endpoint_rebases_an_older_base_version(client, tree_id):
+    response = client.post(f'/api/Trees/{tree_id}/ops', json={
+        'baseVersion': 1, 'ops': [{'op': 'moveNode', 'id': '2', 'position': {'x': 1, 'y': 1}}]})
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'message': 'Operations applied successfully', 'version': 4, 'applied': 1, 'rebased': True}
+
+
+def test_ops_endpoint_returns_conflicts_without_writing(client, tree_id):
+    response = client.post(f'/api/Trees/{tree_id}/ops', json={'baseVersion': 3, 'ops': [
+        {'op': 'retitleNode', 'id': '1', 'title': 'Not saved'},
+        {'op': 'moveNode', 'id': '9', 'position': {'x': 0, 'y': 0}},
+    ]})
+    assert response.status_code == 409
+    body = response.get_json()
+    assert [conflict['index'] for conflict in body['conflicts']] == [1]
+    assert body['version'] == 3
+    assert body['nodes'] == NODES
+
+    tree = client.get(f'/api/Trees/{tree_id}').get_json()[tree_id]
+    assert tree['version'] == 3
+    assert tree['nodes'][0]['title'] == 'Cells'
+
+
+def test_ops_endpoint_rejects_a_base_version_ahead_of_the_tree(client, tree_id):
+    response = client.post(f'/api/Trees/{tree_id}/ops', json={
+        'baseVersion': 7, 'ops': [{'op': 'deleteNode', 'id': '1'}]})
+    assert response.status_code == 409
+    assert response.get_json()['version'] == 3
+
+
+def test_ops_endpoint_errors(client, tree_id):
+    ops = [{'op': 'deleteNode', 'id': '1'}]
+    assert client.post('/api/Trees/missing-tree/ops', json={'baseVersion': 0, 'ops': ops}).status_code == 404
+    assert client.post(f'/api/Trees/{tree_id}/ops', json={'baseVersion': -1, 'ops': ops}).status_code == 400
+    assert client.post(f'/api/Trees/{tree_id}/ops', json={'baseVersion': 3, 'ops': [{'op': 'nope'}]}).status_code == 400
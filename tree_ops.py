@@ -0,0 +1,120 @@
+"""
+Incremental edits for Trees documents.
+
+The tree editor sends batches of node/edge operations instead of re-uploading
+the whole web. Each Trees document carries a `version` counter; a batch names
+the version it was computed against (`baseVersion`) and is applied on top of the
+stored tree. Batches computed against an older version are rebased: they are
+applied as long as every operation still makes sense against the current tree,
+and rejected as a conflict otherwise.
+
+Supported operations (the `op` key):
+  - addNode:     {"op": "addNode", "node": {"id", "type", "title", "position", ...}}
+  - moveNode:    {"op": "moveNode", "id": ..., "position": {"x": ..., "y": ...}}
+  - retitleNode: {"op": "retitleNode", "id": ..., "title": ...}
+  - updateNode:  {"op": "updateNode", "id": ..., "fields": {...}}
+  - deleteNode:  {"op": "deleteNode", "id": ...}   (also removes its edges)
+  - addEdge:     {"op": "addEdge", "edge": {"from": ..., "to": ...}}
+  - deleteEdge:  {"op": "deleteEdge", "edge": {"from": ..., "to": ...}}
+"""
+
+NODE_OPS = ('addNode', 'moveNode', 'retitleNode', 'updateNode', 'deleteNode')
+EDGE_OPS = ('addEdge', 'deleteEdge')
+MAX_OPS_PER_BATCH = 500
+
+# Fields a client may not overwrite through updateNode
+_PROTECTED_NODE_FIELDS = ('id',)
+
+
+class TreeOpError(ValueError):
+    """Raised for a malformed operation batch (maps to HTTP 400)."""
+
+
+def validate_ops(ops):
+    """Check the shape of an operation batch before touching storage."""
+    if not isinstance(ops, list) or not ops:
+        raise TreeOpError("ops must be a non-empty list")
+    if len(ops) > MAX_OPS_PER_BATCH:
+        raise TreeOpError(f"A batch may contain at most {MAX_OPS_PER_BATCH} operations")
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict):
+            raise TreeOpError(f"Operation {index} must be an object")
+        kind = op.get('op')
+        if kind == 'addNode':
+            node = op.get('node')
+            if not isinstance(node, dict) or not node.get('id'):
+                raise TreeOpError(f"Operation {index}: addNode requires a node with an id")
+        elif kind in ('moveNode', 'retitleNode', 'updateNode', 'deleteNode'):
+            if not op.get('id'):
+                raise TreeOpError(f"Operation {index}: {kind} requires an id")
+            if kind == 'moveNode' and not isinstance(op.get('position'), dict):
+                raise TreeOpError(f"Operation {index}: moveNode requires a position")
+            if kind == 'retitleNode' and not isinstance(op.get('title'), str):
+                raise TreeOpError(f"Operation {index}: retitleNode requires a title")
+            if kind == 'updateNode' and not isinstance(op.get('fields'), dict):
+                raise TreeOpError(f"Operation {index}: updateNode requires fields")
+        elif kind in EDGE_OPS:
+            edge = op.get('edge')
+            if not isinstance(edge, dict) or not edge.get('from') or not edge.get('to'):
+                raise TreeOpError(f"Operation {index}: {kind} requires an edge with from and to")
+        else:
+            raise TreeOpError(f"Operation {index}: unknown op '{kind}'")
+
+
+def apply_ops(nodes, edges, ops):
+    """
+    Apply a validated batch to node and edge lists.
+
+    Returns (nodes, edges, conflicts), where conflicts lists the indexes of
+    operations that target nodes which no longer exist (or, for addNode,
+    already exist). The input lists are not modified.
+    """
+    node_order = [node.get('id') for node in nodes]
+    node_map = {node.get('id'): dict(node) for node in nodes}
+    edge_list = [dict(edge) for edge in edges]
+    edge_keys = {(edge.get('from'), edge.get('to')) for edge in edge_list}
+    conflicts = []
+
+    for index, op in enumerate(ops):
+        kind = op['op']
+        if kind == 'addNode':
+            node_id = op['node']['id']
+            if node_id in node_map:
+                conflicts.append({"index": index, "reason": f"Node {node_id} already exists"})
+                continue
+            node_map[node_id] = dict(op['node'])
+            node_order.append(node_id)
+        elif kind == 'deleteNode':
+            node_id = op['id']
+            # Deleting an already-deleted node is not a conflict
+            if node_map.pop(node_id, None) is not None:
+                node_order.remove(node_id)
+                edge_list = [e for e in edge_list if node_id not in (e.get('from'), e.get('to'))]
+                edge_keys = {(e.get('from'), e.get('to')) for e in edge_list}
+        elif kind in NODE_OPS:
+            node = node_map.get(op['id'])
+            if node is None:
+                conflicts.append({"index": index, "reason": f"Node {op['id']} does not exist"})
+                continue
+            if kind == 'moveNode':
+                node['position'] = op['position']
+            elif kind == 'retitleNode':
+                node['title'] = op['title']
+            else:
+                for field, value in op['fields'].items():
+                    if field not in _PROTECTED_NODE_FIELDS:
+                        node[field] = value
+        else:
+            key = (op['edge']['from'], op['edge']['to'])
+            if kind == 'addEdge':
+                missing = [node_id for node_id in key if node_id not in node_map]
+                if missing:
+                    conflicts.append({"index": index, "reason": f"Edge endpoint {missing[0]} does not exist"})
+                elif key not in edge_keys:
+                    edge_list.append({"from": key[0], "to": key[1]})
+                    edge_keys.add(key)
+            elif key in edge_keys:
+                edge_list = [e for e in edge_list if (e.get('from'), e.get('to')) != key]
+                edge_keys.discard(key)
+
+    return [node_map[node_id] for node_id in node_order], edge_list, conflicts